@@ -0,0 +1,507 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Benchmarks that run the daemon against the simulated Si4707 so that
+# latency and throughput can be measured without the radio hardware.
+#
+#   python bench.py alerts --count 1000
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.defer import succeed
+
+from rpiwr.daemon import Radio
+from rpiwr.daemon import Receivers
+from rpiwr.si4707 import SAMEMessage
+from rpiwr.si4707 import SI4707
+
+SAMPLE_HEADER = 'ZCZC-WXR-TOR-019153-019169+0030-2911500-KDMX/NWS-'
+
+class BenchRadio(Radio):
+    # A simulated radio that keeps its state file and the rest of its
+    # var_dir in a temporary directory, so that a benchmark never leaves
+    # state behind for the real daemon to warm boot from
+
+    def __init__(self, config):
+        self.var_dir = tempfile.mkdtemp(prefix = 'rpiwr-bench-')
+        config['radio']['var_dir'] = self.var_dir
+        Radio.__init__(self, 'bench', config)
+
+    def cleanup(self):
+        Radio.cleanup(self)
+        shutil.rmtree(self.var_dir, ignore_errors = True)
+
+class AlertBenchRadio(BenchRadio):
+    # Feeds scripted SAME broadcasts through the full interrupt path and
+    # times each interrupt from its edge to the end of its handling.
+
+    def __init__(self, count, header, completion, command_time, error_rate, alert_cache, interrupts, record):
+        BenchRadio.__init__(self, {'radio': {'simulate': True,
+                                             'completion': completion,
+                                             'interrupts': interrupts},
+                                   'same': {'alert_cache_size': alert_cache},
+                                   'outbox': {'path': None},
+                                   'history': {'path': None},
+                                   'trace': {'path': record}})
+        self.bus.command_time = command_time
+        self.error_rate = error_rate
+        self.random = random.Random(4707)
+        self.count = count
+        self.header = header
+        self.latencies = []
+        self.headers = 0
+        self.decoded = 0
+        self.alerts = 0
+        self.wrong = 0
+        self.eoms = 0
+        self.started = None
+
+    def bootPeriodic(self):
+        reactor.callLater(1.0, self.startAlerts)
+
+    def startAlerts(self):
+        for i in range(self.count):
+            if self.error_rate:
+                for copy in range(3):
+                    self.bus.queueSAME(*self.corrupt(self.header), repeats = 1, eom = False)
+                self.bus.queueSAME(b'', repeats = 0, eom = True)
+            else:
+                self.bus.queueSAME(self.header)
+        # forget the interrupts seen while the radio was being set up
+        del self.latencies[:]
+        self.started = time.perf_counter()
+        self.bus.deliverSAME()
+
+    def corrupt(self, header):
+        # flip a bit in some of the bytes and report them with a low
+        # confidence, as a weak signal would
+        data = bytearray(header.encode('ascii'))
+        confidence = [3] * len(data)
+        for i in range(len(data)):
+            if self.random.random() < self.error_rate:
+                data[i] ^= 1 << self.random.randrange(7)
+                confidence[i] = 0
+        return bytes(data), confidence
+
+    def recordInterruptLatency(self, latency):
+        self.latencies.append(latency)
+        Radio.recordInterruptLatency(self, latency)
+
+    def logSAMEStatus(self, result):
+        if result.status & self.radio.HDRRDY:
+            self.headers += 1
+            if result.header is not None:
+                self.decoded += 1
+        Radio.logSAMEStatus(self, result)
+        if result.status & self.radio.EOMDET:
+            self.eoms += 1
+            if self.eoms == self.count:
+                self.report()
+                reactor.stop()
+
+    def logSAMEHeader(self, header):
+        self.alerts += 1
+        if header.raw.decode('ascii') != self.header:
+            self.wrong += 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+        print('broadcasts: {} ({} headers, {} decoded) in {:.3f} s'.format(self.eoms, self.headers, self.decoded, elapsed))
+        print('alerts: {} emitted, {} wrong, {} corrected by voting, {} rejected'.format(
+            self.alerts, self.wrong, self.same_voter.corrected, self.same_voter.rejected))
+        print('alert cache: {size} entries, {duplicates} duplicates dropped'.format(**self.alert_cache.statistics()))
+        print('throughput: {:.0f} broadcasts/min'.format(self.eoms / elapsed * 60))
+        print('interrupt latency: p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000,
+            latencies[-1] * 1000))
+        interrupts = self.interruptStatistics()
+        print('interrupts: {edges} edges, {coalesced} coalesced, {serviced} serviced'.format(**interrupts))
+        statistics = self.radio.busStatistics()
+        print('bus queue: max depth {}, rejected {}'.format(statistics['max_depth'], statistics['rejected']))
+        for name, service_time in sorted(statistics['service_time'].items()):
+            print('  {:<16} {:>7} calls, mean {:.3f} ms, max {:.3f} ms'.format(
+                name, service_time['count'], service_time['mean'] * 1000, service_time['max'] * 1000))
+        for name, wait in sorted(statistics['queue_wait'].items()):
+            print('  queue wait {:<9} {:>7} commands, mean {:.3f} ms'.format(
+                name, wait['count'], wait['sum'] / wait['count'] * 1000))
+        print('command completion ({}):'.format(statistics['completion']['mode']))
+        for name, latency in sorted(statistics['completion']['latency'].items()):
+            print('  {:<16} {:>7} waits, mean {:.3f} ms, max {:.3f} ms'.format(
+                name, latency['count'], latency['mean'] * 1000, latency['max'] * 1000))
+
+class SignalBenchRadio(BenchRadio):
+    # Replays a steady but noisy signal, one step per simulated second,
+    # that is lost part of the way through, and counts the bus commands
+    # and status messages it takes to follow it in each RSQ mode.
+
+    def __init__(self, mode, steps, loss_step):
+        BenchRadio.__init__(self, {'radio': {'simulate': True,
+                                             'rsq_mode': mode},
+                                   'outbox': {'path': None},
+                                   'history': {'path': None}})
+        self.random = random.Random(4707)
+        self.steps = steps
+        self.loss_step = loss_step
+        self.step = 0
+        self.level = (40, 12)
+        self.lost_seen = None
+        self.commands = 0
+        self.published = 0
+
+    def bootPeriodic(self):
+        reactor.callLater(0.5, self.startSignal)
+
+    def startSignal(self):
+        self.commands = sum(self.bus.commands.values())
+        self.published = self.telemetry.published
+        self.loop = LoopingCall(self.nextStep)
+        self.loop.start(0.002)
+
+    def nextStep(self):
+        if self.step == self.steps:
+            self.loop.stop()
+            self.report()
+            reactor.stop()
+            return
+        if self.step == self.loss_step:
+            self.level = (15, 1)
+        rssi, snr = self.level
+        self.bus.setSignal(rssi + self.random.choice((-1, 0, 0, 0, 1)),
+                           max(0, snr + self.random.choice((-1, 0, 0, 0, 1))))
+        if self.rsq_mode == self.RSQ_INTERRUPT:
+            interval = self.heartbeat_interval
+        else:
+            interval = 60
+        if self.step % interval == interval - 1:
+            self.periodicRSQStatus()
+        self.step += 1
+
+    def logRSQStatus(self, result):
+        if self.step >= self.loss_step and self.lost_seen is None and result['snr'] <= 2:
+            self.lost_seen = self.step
+        Radio.logRSQStatus(self, result)
+
+    def report(self):
+        print('mode: {}, {} simulated seconds'.format(self.rsq_mode, self.steps))
+        print('bus commands: {}'.format(sum(self.bus.commands.values()) - self.commands))
+        print('RSQ interrupts: {}'.format(self.rsq_crossings))
+        print('telemetry messages: {}'.format(self.telemetry.published - self.published))
+        if self.lost_seen is None:
+            print('signal loss not seen')
+        else:
+            print('signal loss seen after {} s'.format(self.lost_seen - self.loss_step))
+
+class ScanBenchRadio(BenchRadio):
+    # Times a scan of the seven channels with a simulated tune time,
+    # either by the channel scanner or, as a baseline, by tuning each
+    # channel with the fixed TUNE_DELAY sleep and reading its signal.
+
+    def __init__(self, method, tune_time):
+        completion = 'sleep' if method == 'sleep' else 'cts'
+        BenchRadio.__init__(self, {'radio': {'simulate': True,
+                                             'completion': completion},
+                                   'outbox': {'path': None},
+                                   'history': {'path': None}})
+        self.bus.tune_time = tune_time
+        self.method = method
+
+    def bootPeriodic(self):
+        start = time.perf_counter()
+        if self.method == 'sleep':
+            d = self.sleepScan([])
+        else:
+            d = self.scanChannels()
+            d.addCallback(lambda ignored: self.scanner.results)
+        d.addCallback(self.report, start)
+        d.addBoth(lambda ignored: reactor.stop())
+
+    def sleepScan(self, results):
+        if len(results) == len(self.radio.freqLowByte):
+            return succeed(results)
+        d = self.radio.tune(self.radio.freqLowByte[len(results)])
+        d.addCallback(lambda ignored: self.radio.getRSQStatus())
+        d.addCallback(lambda rsq: results.append(rsq) or self.sleepScan(results))
+        return d
+
+    def report(self, results, start):
+        elapsed = time.perf_counter() - start
+        print('method: {}, tune time {:.3f} s'.format(self.method, self.bus.tune_time))
+        print('scan of {} channels: {:.3f} s'.format(len(results), elapsed))
+        if self.method != 'sleep':
+            for result in results:
+                print('  {frequency} MHz  valid {valid!s:<5}  rssi {rssi:>4}  snr {snr:>3}'.format(**result))
+
+class ReceiverBenchRadio(Radio):
+    # One of the simulated receivers of the receivers benchmark, which
+    # tells the benchmark when it is up.
+
+    def _bootFinished(self, ignored):
+        Radio._bootFinished(self, ignored)
+        self.bench.radioReady(self)
+
+class ReceiversBench(Receivers):
+    # Brings up several simulated receivers in one process and reports
+    # how long it took until all of them were ready, next to what their
+    # boots took one by one, and what each receiver costs in threads and
+    # memory.
+
+    radio_class = ReceiverBenchRadio
+
+    def __init__(self, count, tune_time):
+        self.threads = threading.active_count()
+        self.rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.var_dir = tempfile.mkdtemp(prefix = 'rpiwr-bench-')
+        Receivers.__init__(self, 'bench', {'radio': {'simulate': True,
+                                                     'cold_boot': True,
+                                                     'var_dir': self.var_dir},
+                                           'mqtt': None,
+                                           'outbox': {'path': None},
+                                           'history': {'path': None},
+                                           'receivers': [{'name': str(i)} for i in range(count)]})
+        for radio in self.radios:
+            radio.bench = self
+            radio.bus.tune_time = tune_time
+        self.ready = 0
+        self.started = None
+        reactor.callWhenRunning(self.start)
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def radioReady(self, radio):
+        self.ready += 1
+        if self.ready == len(self.radios):
+            self.report(time.monotonic() - self.started)
+            reactor.stop()
+
+    def report(self, elapsed):
+        boots = [radio.startup['total'] for radio in self.radios]
+        threads = threading.active_count() - self.threads
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self.rss
+        print('receivers: {}'.format(len(self.radios)))
+        print('all ready after {:.3f} s, boots took {:.3f} s one after another'.format(elapsed, sum(boots)))
+        print('slowest boot {:.3f} s, fastest {:.3f} s'.format(max(boots), min(boots)))
+        print('threads per receiver: {:.1f}'.format(threads / len(self.radios)))
+        print('max RSS per receiver: {:.0f} KiB'.format(rss / len(self.radios)))
+
+    def cleanup(self):
+        Receivers.cleanup(self)
+        shutil.rmtree(self.var_dir, ignore_errors = True)
+
+class ReplayBenchRadio(BenchRadio):
+    # Plays a recorded I2C trace back through the daemon, as fast as it
+    # will go or at the pace it was recorded, and counts what came out.
+
+    def __init__(self, path, realtime, completion):
+        BenchRadio.__init__(self, {'radio': {'replay': path,
+                                             'replay_realtime': realtime,
+                                             'completion': completion},
+                                   'same': {'alert_cache_size': 0},
+                                   'outbox': {'path': None},
+                                   'history': {'path': None}})
+        self.headers = 0
+        self.decoded = 0
+        self.alerts = 0
+        self.started = time.perf_counter()
+
+    def bootPeriodic(self):
+        # the periodic polls would only stray from the trace
+        self.loop = LoopingCall(self.checkFinished)
+        self.loop.start(0.01)
+
+    def checkFinished(self):
+        if self.bus.finished and self.radio.busStatistics()['depth'] == 0 and not self._isr_running:
+            self.loop.stop()
+            self.report()
+            reactor.stop()
+
+    def logSAMEStatus(self, result):
+        if result.status & self.radio.HDRRDY:
+            self.headers += 1
+            if result.header is not None:
+                self.decoded += 1
+        Radio.logSAMEStatus(self, result)
+
+    def logSAMEHeader(self, header):
+        self.alerts += 1
+        Radio.logSAMEHeader(self, header)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print('trace: {} records, {} interrupt edges'.format(len(self.bus.records), self.bus.edges))
+        print('replayed in {:.3f} s ({})'.format(elapsed, 'realtime' if self.bus.realtime else 'as fast as possible'))
+        print('bus: {} writes, {} reads, {} mismatches'.format(self.bus.writes, self.bus.reads, self.bus.mismatches))
+        print('SAME: {} headers, {} decoded, {} alerts emitted'.format(self.headers, self.decoded, self.alerts))
+        interrupts = self.interruptStatistics()
+        print('interrupts: {edges} edges, {coalesced} coalesced, {serviced} serviced'.format(**interrupts))
+
+class ListSAMEMessage(object):
+    # SAMEMessage as it was before it unpacked the confidence levels lazily,
+    # kept here as the baseline for the page benchmark
+
+    def __init__(self, sameStatus, sameState, sameLength):
+        self.status = sameStatus
+        self.state = sameState
+        self.length = sameLength
+
+        self.confidence = []
+        self.data = []
+
+    def addData(self, result):
+        self.confidence.append((result[5] >> 0) & 0x03)
+        self.confidence.append((result[5] >> 2) & 0x03)
+        self.confidence.append((result[5] >> 4) & 0x03)
+        self.confidence.append((result[5] >> 6) & 0x03)
+        self.confidence.append((result[4] >> 0) & 0x03)
+        self.confidence.append((result[4] >> 2) & 0x03)
+        self.confidence.append((result[4] >> 4) & 0x03)
+        self.confidence.append((result[4] >> 6) & 0x03)
+
+        self.data.append(result[6])
+        self.data.append(result[7])
+        self.data.append(result[8])
+        self.data.append(result[9])
+        self.data.append(result[10])
+        self.data.append(result[11])
+        self.data.append(result[12])
+        self.data.append(result[13])
+
+def pageBenchmark(header, number):
+    # per page cost of storing the WB_SAME_STATUS responses of one header;
+    # a message length of zero leaves the header decoder out of it
+    data = header.encode('ascii')
+    pages = []
+    for i in range(0, len(data), 8):
+        page = list(data[i:i + 8])
+        pages.append([0x80, 0x05, 0x00, len(data), 0xff, 0xff] + page + [0x00] * (8 - len(page)))
+
+    def run(cls, length):
+        msg = cls(0x05, 0x00, length)
+        for page in pages:
+            msg.addData(page)
+
+    for name, cls, length in (('list (before)', ListSAMEMessage, 0),
+                              ('lazy', SAMEMessage, 0),
+                              ('lazy + decode', SAMEMessage, len(data))):
+        elapsed = min(timeit.repeat(lambda: run(cls, length), number = number, repeat = 5))
+        print('{:<20} {:.3f} us/page'.format(name, elapsed / number / len(pages) * 1e6))
+
+def i2cBenchmark(bus, address, driver, count):
+    # reads the radio's status byte over a real bus, which needs the
+    # radio hardware; the first read checks that a transfer goes through
+    # at all
+    if driver == 'raw':
+        from rpiwr.i2c import RawDevice
+        device = RawDevice(address, bus)
+    else:
+        from rpiwr.i2c import Device
+        device = Device(address, bus)
+    status = device.readRaw8()
+    print('status: 0x{:02X}{}'.format(status, ' (CTS)' if status & SI4707.CTSINT else ''))
+    start = time.perf_counter()
+    for i in range(count):
+        device.readRaw8()
+    elapsed = time.perf_counter() - start
+    print('{} transfers: mean {:.1f} us'.format(count, elapsed / count * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'rpiwr benchmarks')
+    subparsers = parser.add_subparsers(dest = 'benchmark')
+    alerts = subparsers.add_parser('alerts', help = 'SAME alert cycles through the simulated radio')
+    alerts.add_argument('--count', type = int, default = 1000)
+    alerts.add_argument('--header', default = SAMPLE_HEADER)
+    alerts.add_argument('--completion', choices = ['cts', 'sleep'], default = 'cts')
+    alerts.add_argument('--error-rate', type = float, default = 0.0,
+                        help = 'probability that each byte of each header copy is corrupted')
+    alerts.add_argument('--command-time', type = float, default = 0.0,
+                        help = 'seconds the simulated radio holds CTS low after each command')
+    alerts.add_argument('--alert-cache', type = int, default = 0,
+                        help = 'size of the duplicate alert cache, 0 so that every broadcast is counted')
+    alerts.add_argument('--interrupts', choices = ['rpi_gpio', 'gpiochip'], default = 'rpi_gpio',
+                        help = 'gpiochip reads the edges from a pipe in the reactor, as from the GPIO character device')
+    alerts.add_argument('--record', metavar = 'PATH',
+                        help = 'record the I2C transfers and interrupt edges to a trace')
+    pages = subparsers.add_parser('pages', help = 'per page cost of SAMEMessage.addData')
+    pages.add_argument('--number', type = int, default = 20000)
+    pages.add_argument('--header', default = SAMPLE_HEADER)
+    signal = subparsers.add_parser('signal', help = 'following the signal quality in each RSQ mode')
+    signal.add_argument('--mode', choices = ['interrupt', 'poll'], default = 'interrupt')
+    signal.add_argument('--steps', type = int, default = 3600)
+    signal.add_argument('--loss-step', type = int, default = 1800)
+    scan = subparsers.add_parser('scan', help = 'time a scan of all seven channels')
+    scan.add_argument('--method', choices = ['stc', 'sleep'], default = 'stc',
+                      help = 'stc for the channel scanner, sleep for tuning with the fixed delay')
+    scan.add_argument('--tune-time', type = float, default = 0.05,
+                      help = 'seconds the simulated radio takes to tune')
+    receivers = subparsers.add_parser('receivers', help = 'bring up several receivers in one process')
+    receivers.add_argument('--count', type = int, default = 4)
+    receivers.add_argument('--tune-time', type = float, default = 0.05,
+                           help = 'seconds the simulated radio takes to tune')
+    replay = subparsers.add_parser('replay', help = 'play a recorded I2C trace back through the daemon')
+    replay.add_argument('trace')
+    replay.add_argument('--realtime', action = 'store_true',
+                        help = 'keep the interrupts to the pace of the recording')
+    replay.add_argument('--completion', choices = ['cts', 'sleep'], default = 'cts',
+                        help = 'the completion mode the trace was recorded with')
+    i2c = subparsers.add_parser('i2c', help = 'transfers on a real I2C bus')
+    i2c.add_argument('--bus', type = lambda value: int(value) if value.isdigit() else value, default = 1,
+                     help = 'the bus number, or for the raw driver the path to its device')
+    i2c.add_argument('--address', type = lambda value: int(value, 0), default = SI4707.RADIO_ADDRESS)
+    i2c.add_argument('--driver', choices = ['raw', 'smbus'], default = 'raw',
+                     help = 'raw for one I2C_RDWR ioctl per transfer, smbus for the smbus module')
+    i2c.add_argument('--count', type = int, default = 1000)
+    args = parser.parse_args()
+
+    if args.benchmark == 'alerts':
+        bench = AlertBenchRadio(args.count, args.header, args.completion, args.command_time, args.error_rate,
+                                args.alert_cache, args.interrupts, args.record)
+    elif args.benchmark == 'signal':
+        bench = SignalBenchRadio(args.mode, args.steps, args.loss_step)
+    elif args.benchmark == 'scan':
+        bench = ScanBenchRadio(args.method, args.tune_time)
+    elif args.benchmark == 'receivers':
+        bench = ReceiversBench(args.count, args.tune_time)
+    elif args.benchmark == 'replay':
+        bench = ReplayBenchRadio(args.trace, args.realtime, args.completion)
+    elif args.benchmark == 'pages':
+        pageBenchmark(args.header, args.number)
+        return
+    elif args.benchmark == 'i2c':
+        i2cBenchmark(args.bus, args.address, args.driver, args.count)
+        return
+    else:
+        parser.print_help()
+        sys.exit(1)
+    try:
+        reactor.run()
+    finally:
+        bench.cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# A single long lived thread that owns an I2C bus. Bus operations are
+# queued to it from the reactor, highest priority first, and their
+# results are delivered back to the reactor through Deferreds.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import threading
+import time
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import fail
+from twisted.python.failure import Failure
+
+from .metrics import Histogram
+
+class BusQueueFull(Exception):
+    pass
+
+class BusWorker(object):
+    log = Logger()
+
+    # Waiting commands are run in order of priority, then in the order
+    # they were submitted.
+    ISR = 0
+    USER = 1
+    PERIODIC = 2
+    PRIORITY_NAMES = {ISR: 'isr', USER: 'user', PERIODIC: 'periodic'}
+
+    # upper bounds, in seconds, of the queue wait histogram buckets
+    WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, name = 'i2c', maxsize = 64):
+        self.name = name
+        self.maxsize = maxsize
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        # {owner: (priority, until)}, commands of a held priority and
+        # below wait until every hold on them has been released or has
+        # run out
+        self._holds = {}
+
+        self.max_depth = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._service_times = {}
+        self._waits = {priority: Histogram(self.WAIT_BUCKETS) for priority in self.PRIORITY_NAMES}
+        self._stats_lock = threading.Lock()
+
+        self._thread = threading.Thread(target = self._run, name = name)
+        self._thread.daemon = True
+        self._thread.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def submit(self, fn, *args, **kw):
+        return self.submitWithPriority(self.USER, fn, *args, **kw)
+
+    def submitWithPriority(self, priority, fn, *args, **kw):
+        # must be called from the reactor thread; cancelling the Deferred
+        # drops the command if it hasn't started yet
+        if not self._running:
+            return fail(BusQueueFull('{} bus worker is stopped'.format(self.name)))
+        item = [priority, next(self._sequence), None, fn, args, kw, time.perf_counter()]
+        response = Deferred(lambda d: self._cancel(item))
+        item[2] = response
+        with self._condition:
+            if len(self._heap) >= self.maxsize:
+                self.rejected += 1
+                return fail(BusQueueFull('{} bus queue is full ({} commands)'.format(self.name, self.maxsize)))
+            heapq.heappush(self._heap, item)
+            depth = len(self._heap)
+            self._condition.notify()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return response
+
+    def hold(self, owner, priority, seconds):
+        # keeps commands of this priority and below waiting for up to
+        # seconds, for instance while an alert is being received; a
+        # second hold by the same owner replaces its first
+        with self._condition:
+            self._holds[owner] = (priority, time.monotonic() + seconds)
+
+    def release(self, owner):
+        # ends the owner's hold, holds by others stay in place
+        with self._condition:
+            if self._holds.pop(owner, None) is not None:
+                self._condition.notify()
+
+    def _heldUntil(self, priority):
+        # when the last hold on commands of this priority runs out, 0.0
+        # if there is none
+        now = time.monotonic()
+        until = 0.0
+        for owner, (held, expires) in list(self._holds.items()):
+            if expires <= now:
+                del self._holds[owner]
+            elif priority >= held:
+                until = max(until, expires)
+        return until
+
+    def cancelWaiting(self, priority):
+        # drops every waiting command of this priority and below
+        with self._condition:
+            waiting = [item for item in self._heap if item[0] >= priority and item[3] is not None]
+        for item in waiting:
+            item[2].cancel()
+        return len(waiting)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def depth(self):
+        with self._condition:
+            return len(self._heap)
+
+    def statistics(self):
+        with self._stats_lock:
+            commands = {name: {'count': count,
+                               'mean': total / count,
+                               'max': maximum}
+                        for name, (count, total, maximum) in self._service_times.items()}
+            waits = {self.PRIORITY_NAMES[priority]: histogram.snapshot()
+                     for priority, histogram in self._waits.items()}
+        return {'depth': self.depth(),
+                'max_depth': self.max_depth,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled,
+                'service_time': commands,
+                'queue_wait': waits}
+
+    def _cancel(self, item):
+        # the Deferred is failed with CancelledError by Twisted; the
+        # command is skipped when it reaches the front of the queue
+        with self._condition:
+            if item[3] is not None:
+                item[3] = None
+                self.cancelled += 1
+
+    def _next(self):
+        with self._condition:
+            while True:
+                if not self._running:
+                    return None
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                item = self._heap[0]
+                if item[3] is None:
+                    heapq.heappop(self._heap)
+                    continue
+                if self._holds:
+                    remaining = self._heldUntil(item[0]) - time.monotonic()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+                heapq.heappop(self._heap)
+                fn = item[3]
+                # from here on the command can't be cancelled
+                item[3] = None
+                return item[0], item[2], fn, item[4], item[5], item[6]
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                break
+
+            priority, response, fn, args, kw, submitted = item
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kw)
+            except Exception:
+                reactor.callFromThread(self._deliver, response.errback, Failure())
+            else:
+                reactor.callFromThread(self._deliver, response.callback, result)
+            elapsed = time.perf_counter() - start
+
+            wait = start - submitted
+            name = getattr(fn, '__name__', repr(fn))
+            with self._stats_lock:
+                count, total, maximum = self._service_times.get(name, (0, 0.0, 0.0))
+                self._service_times[name] = (count + 1, total + elapsed, max(maximum, elapsed))
+                self._waits[priority].record(wait)
+
+    def _deliver(self, fire, result):
+        # the Deferred may have been cancelled while the command ran
+        if not fire.__self__.called:
+            fire(result)
@@ -0,0 +1,176 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# The rpiwr command. Kept light: the daemon itself is imported only
+# once the arguments have been parsed, so that --profile-startup can
+# time the import along with the rest of the start.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+cli_imported = time.time()
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+
+CONFIG_FILE = '/opt/rpiwr/etc/config.json'
+CPUINFO_FILE = '/proc/cpuinfo'
+
+class SerialNotFound(Exception):
+    pass
+
+# loadConfig and findSerial are looked up through the module when main
+# runs, so a site that keeps its config or serial number somewhere else
+# can replace them before calling main.
+
+def loadConfig(path):
+    with open(path, 'rb') as c:
+        return json.loads(c.read().decode('utf-8'))
+
+def findSerial(config, cpuinfo = CPUINFO_FILE):
+    # use the serial number embedded into the Raspberry Pi as a unique
+    # identifier, unless the config overrides it (as it must on a machine
+    # that isn't a Raspberry Pi)
+    serial = config.get('serial')
+    if serial is not None:
+        return serial
+    cpuinfo_re = re.compile(br'\nSerial\s+:\s+([0-9a-f]+)\s*\n')
+    try:
+        with open(cpuinfo, 'rb') as f:
+            match = cpuinfo_re.search(f.read())
+    except OSError as e:
+        raise SerialNotFound('Cannot read {}: {}'.format(cpuinfo, e))
+    if not match:
+        raise SerialNotFound('Cannot read serial number from {}'.format(cpuinfo))
+    return match.group(1).decode('ascii')
+
+def processAge():
+    # seconds from the start of this process to when this module was
+    # imported, from /proc, to the kernel's clock tick; None if /proc
+    # can't tell us
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            # the command name can hold spaces, the fields after it can't
+            fields = f.read().rsplit(b')', 1)[1].split()
+        with open('/proc/uptime', 'rb') as f:
+            uptime = float(f.read().split()[0])
+        started = float(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - (time.time() - cli_imported) - started
+
+class StartupProfile(object):
+    # Seconds taken by each phase of the start, from the interpreter
+    # up to every receiver having booted.
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        age = processAge()
+        if age is not None:
+            self.phases['interpreter'] = max(age, 0.0)
+        self.phases['cli_import'] = time.time() - cli_imported
+        self._last = time.perf_counter()
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases[name] = now - self._last
+        self._last = now
+
+    def report(self, receivers, out):
+        out.write('Startup profile:\n')
+        for name, elapsed in self.phases.items():
+            out.write('  {:<22} {:8.3f} s\n'.format(name, elapsed))
+        for name, elapsed in receivers.startup.items():
+            out.write('  {:<22} {:8.3f} s\n'.format(name + '_setup', elapsed))
+        for radio in receivers.radios:
+            out.write('Receiver {} ({}):\n'.format(radio.serial, 'ready' if radio.booted else 'failed'))
+            for name, elapsed in radio.startup.items():
+                if name == 'warm':
+                    out.write('  {:<22} {:>8}\n'.format('kind', 'warm' if elapsed else 'cold'))
+                else:
+                    out.write('  {:<22} {:8.3f} s\n'.format(name, elapsed))
+        out.flush()
+
+def main(argv = None):
+    profile = StartupProfile()
+    parser = argparse.ArgumentParser(prog = 'rpiwr', description = 'Raspberry Pi Weather Radio')
+    parser.add_argument('--config', default = CONFIG_FILE,
+                        help = 'configuration file (default: %(default)s)')
+    parser.add_argument('--cold-boot', action = 'store_true',
+                        help = 'reset and patch the radio even if it is already configured')
+    parser.add_argument('--profile-startup', action = 'store_true',
+                        help = 'report the time taken by each phase of the start, once every receiver has booted, and exit')
+    args = parser.parse_args(argv)
+    profile.phase('arguments')
+
+    from twisted.logger import globalLogBeginner
+    from twisted.logger import textFileLogObserver
+    from twisted.internet import reactor
+    from twisted.internet.defer import gatherResults
+    from .daemon import Receivers
+    from .configwatch import ConfigWatcher
+    profile.phase('daemon_import')
+
+    try:
+        config = loadConfig(args.config)
+    except (OSError, ValueError) as e:
+        sys.stderr.write('Cannot read {}: {}\n'.format(args.config, e))
+        sys.exit(1)
+    profile.phase('config')
+
+    try:
+        serial = findSerial(config)
+    except SerialNotFound as e:
+        sys.stderr.write('{}\n'.format(e))
+        sys.exit(1)
+    profile.phase('serial')
+
+    # the config as it is in the file, for the reload to compare with
+    loaded = config
+    if args.cold_boot:
+        config = dict(config, radio = dict(config.get('radio', {}), cold_boot = True))
+
+    # the log takes over sys.stdout, the profile goes to the real one
+    stdout = sys.stdout
+    output = textFileLogObserver(sys.stderr, timeFormat="")
+    globalLogBeginner.beginLoggingTo([output])
+    profile.phase('logging')
+
+    r = Receivers(serial, config)
+    watcher = ConfigWatcher(args.config, loaded, loadConfig, r.reload,
+                            delay = config.get('reload', {}).get('delay', 1.0))
+    watcher.start(watch = config.get('reload', {}).get('watch', False))
+    profile.phase('init')
+
+    if args.profile_startup:
+        def booted(results):
+            profile.phase('boot')
+            profile.report(r, stdout)
+            reactor.stop()
+        def waitForBoot():
+            d = gatherResults([radio.whenBooted() for radio in r.radios])
+            d.addCallback(booted)
+        reactor.callWhenRunning(waitForBoot)
+
+    try:
+        reactor.run()
+    finally:
+        watcher.stop()
+        r.cleanup()
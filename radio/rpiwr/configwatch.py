@@ -0,0 +1,107 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Reloads the config file on SIGHUP (systemctl reload rpiwr) and, with
+# "watch" set in the reload section, whenever the file is written,
+# through inotify. Editors write a file in several steps, so a reload
+# waits until the file has been quiet for a moment. A config that can't
+# be read or parsed is logged and the running one is kept.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import signal
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+
+class ConfigWatcher(object):
+    log = Logger()
+
+    def __init__(self, path, config, load, apply, delay = 1.0, clock = reactor):
+        # load(path) returns the config, apply(config) puts it in place
+        self.path = os.path.abspath(path)
+        self.config = config
+        self.load = load
+        self.apply = apply
+        self.delay = delay
+        self.clock = clock
+        self.notifier = None
+        self._pending = None
+        self.reloads = 0
+        self.failures = 0
+
+    def start(self, watch = False):
+        signal.signal(signal.SIGHUP, self._hangup)
+        if not watch:
+            return
+        from twisted.internet import inotify
+        from twisted.python.filepath import FilePath
+        try:
+            self.notifier = inotify.INotify()
+        except inotify.INotifyError as e:
+            self.log.warn('Cannot watch {path:} for changes: {error:}', path = self.path, error = e)
+            return
+        self.notifier.startReading()
+        # the directory is watched, not the file, since an editor that
+        # saves by renaming a new file into place leaves a watch on the
+        # old file with nothing to report
+        self.notifier.watch(FilePath(os.path.dirname(self.path)),
+                            mask = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_CREATE,
+                            callbacks = [self._changed])
+
+    def stop(self):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+        if self._pending is not None and self._pending.active():
+            self._pending.cancel()
+        self._pending = None
+
+    def _hangup(self, signum, frame):
+        # signal handlers run between two bytecodes of whatever the main
+        # thread is doing, the reload is left to the reactor
+        self.clock.callFromThread(self.reload)
+
+    def _changed(self, ignored, path, mask):
+        # inotify names the file in bytes
+        if os.fsdecode(path.path) != self.path:
+            return
+        if self._pending is not None and self._pending.active():
+            self._pending.reset(self.delay)
+        else:
+            self._pending = self.clock.callLater(self.delay, self.reload)
+
+    def reload(self):
+        self._pending = None
+        try:
+            config = self.load(self.path)
+        except (OSError, ValueError) as e:
+            self.failures += 1
+            self.log.warn('Cannot reload {path:}, keeping the running config: {error:}', path = self.path, error = e)
+            return
+        if config == self.config:
+            self.log.info('{path:} is unchanged', path = self.path)
+            return
+        self.log.info('Reloading {path:}', path = self.path)
+        self.config = config
+        self.reloads += 1
+        d = self.apply(config)
+        if d is not None:
+            d.addErrback(self._applyFailed)
+
+    def _applyFailed(self, failure):
+        self.log.failure('Applying the reloaded config failed', failure)
@@ -0,0 +1,1369 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# This code is based heavily on the sample code provided by AIW Industries at
+# https://github.com/AIWIndustries/Pi_4707/blob/master/firmware/NWRSAME_v2.py
+#
+# It's been heavily refactored for use with the Twisted framework as well as code
+# cleanups and additional functionality.
+
+# Copyright 2016 by Jeffrey C. Ollie
+# Copyright 2013 by Ray H. Dees
+# Copyright 2013 by AIW Industries, LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Only what every daemon needs is imported here. MQTT and TLS, the web
+# server, the signal history, the GPIO character device, the bus trace
+# and the simulator are imported where they are set up, and only when
+# the config asks for them, which keeps the start on a Pi Zero short.
+
+import time
+import threading
+import json
+import collections
+import os
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.task import deferLater
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import succeed
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import gatherResults
+
+from .si4707 import SI4707
+from .i2c import Device
+from .busworker import BusWorker
+from .telemetry import TelemetryPublisher
+from .outbox import DiskQueue
+from .outbox import Outbox
+from .metrics import Histogram
+from .metrics import PrometheusText
+from .scanner import ChannelScanner
+from . import same
+
+class WarmBootUnavailable(Exception):
+    pass
+
+class Radio(object):
+    log = Logger()
+
+    # the AIW Industries add-on board is hard wired to these GPIO pins,
+    # other boards set theirs in the radio section of their receiver
+
+    radio_reset_pin = 17
+    radio_interrupt_pin = 23
+    relay_1_pin = 13
+    relay_2_pin = 19
+
+    def __init__(self, serial, config):
+        self.serial = serial
+        self.config = config
+        self.radio = None
+        self.mqtt = None
+        self.mqtt_supervisor = None
+        # the topics the broker's session holds for this receiver, None
+        # until they have been read from the state file
+        self.subscribed = None
+
+        radio_config = self.config.get('radio', {})
+        self.radio_reset_pin = radio_config.get('reset_pin', self.radio_reset_pin)
+        self.radio_interrupt_pin = radio_config.get('interrupt_pin', self.radio_interrupt_pin)
+        self.relay_1_pin = radio_config.get('relay_1_pin', self.relay_1_pin)
+        self.relay_2_pin = radio_config.get('relay_2_pin', self.relay_2_pin)
+        # state, outbox and history files go here unless they are set
+        var_dir = radio_config.get('var_dir', '/opt/rpiwr/var')
+
+        # with "simulate" set the radio is replaced by a software model of
+        # the Si4707 so that the daemon can run without the hardware, with
+        # "replay" by a recorded trace of a radio
+        if radio_config.get('replay') is not None:
+            from .i2ctrace import ReplayBus
+            from .simulator import SimulatedGPIO
+            self.bus = ReplayBus(radio_config['replay'], realtime = radio_config.get('replay_realtime', False))
+            self.gpio = SimulatedGPIO(self.bus, self.radio_reset_pin, self.radio_interrupt_pin)
+            self.lineEvents = self.gpio.lineEvents
+        elif self.config.get('radio', {}).get('simulate', False):
+            from .simulator import SimulatedSI4707
+            from .simulator import SimulatedGPIO
+            self.bus = SimulatedSI4707()
+            self.gpio = SimulatedGPIO(self.bus, self.radio_reset_pin, self.radio_interrupt_pin)
+            self.lineEvents = self.gpio.lineEvents
+        else:
+            from RPi import GPIO
+            self.bus = self.config.get('radio', {}).get('bus', 1)
+            self.gpio = GPIO
+            self.lineEvents = self.gpioLineEvents
+
+        # where interrupt edges come from, see bootInterrupts
+        self.interrupt_source = radio_config.get('interrupts', self.INTERRUPTS_RPI_GPIO)
+        self.edges = None
+
+        address = radio_config.get('address', SI4707.RADIO_ADDRESS)
+        if radio_config.get('i2c', 'smbus') == 'dev' and isinstance(self.bus, int):
+            from .i2c import RawDevice
+            device = RawDevice(address, self.bus)
+        else:
+            device = Device(address, self.bus)
+
+        # every transfer and interrupt edge can be recorded, to be played
+        # back with "replay"
+        trace_config = self.config.get('trace', {})
+        self.trace = None
+        if trace_config.get('path') is not None:
+            from .i2ctrace import RecordingDevice
+            from .i2ctrace import TraceWriter
+            self.trace = TraceWriter(trace_config['path'],
+                                     max_size = trace_config.get('max_size', 1 << 20),
+                                     backups = trace_config.get('backups', 3))
+            device = RecordingDevice(device, self.trace)
+            l = LoopingCall(self.trace.flush)
+            reactor.callWhenRunning(l.start, trace_config.get('flush_interval', 5), now = False)
+            reactor.addSystemEventTrigger('before', 'shutdown', self.trace.close)
+        worker = BusWorker(name = 'i2c-{}'.format(self.serial),
+                           maxsize = self.config.get('radio', {}).get('queue_size', 64))
+        self.radio = SI4707(device, worker,
+                            completion = self.config.get('radio', {}).get('completion', SI4707.COMPLETION_CTS),
+                            wait_for_stc = self.config.get('radio', {}).get('wait_for_stc', True))
+        self.tune_low_byte = self.configuredChannel()
+
+        self.state_file = self.config.get('radio', {}).get('state_file', os.path.join(var_dir, 'state.json'))
+        self.cold_boot = self.config.get('radio', {}).get('cold_boot', False)
+        self.warm = False
+        # the channel the radio was found on by a warm boot
+        self.warm_channel = None
+
+        self.rsq_mode = self.config.get('radio', {}).get('rsq_mode', self.RSQ_INTERRUPT)
+        self.rssi_window = self.config.get('radio', {}).get('rssi_window', 3)
+        self.snr_window = self.config.get('radio', {}).get('snr_window', 3)
+        self.heartbeat_interval = self.config.get('radio', {}).get('heartbeat_interval', 900)
+        self.rsq_crossings = 0
+        self.polls = []
+        self.summary_loop = None
+        self.audit_loop = None
+        self.reloads = 0
+
+        # the channel scan, and moving to a better channel when the
+        # signal on this one falls below rescan_snr
+        scan_config = self.config.get('scan', {})
+        self.scanner = ChannelScanner(self.radio,
+                                      dwell = scan_config.get('dwell', 0.0),
+                                      same_dwell = scan_config.get('same_dwell', 0.0))
+        self.scan_on_boot = scan_config.get('on_boot', False)
+        self.rescan_snr = scan_config.get('rescan_snr', None)
+        self.rescan_holdoff = scan_config.get('rescan_holdoff', 3600)
+        self.scan_min_improvement = scan_config.get('min_improvement', 3)
+        self.last_scan = None
+        # a SAME message is being received until then
+        self.same_until = 0.0
+
+        # interrupt edges that arrive while one is waiting to be serviced
+        # are folded into it; _isr_edge is the time of the first edge
+        # that no service has started for yet
+        self._isr_lock = threading.Lock()
+        self._isr_edge = None
+        self._isr_running = False
+        self.isr_edges = 0
+        self.isr_coalesced = 0
+        self.isr_serviced = 0
+        self.isr_latency = Histogram(self.ISR_LATENCY_BUCKETS)
+
+        self.startup = collections.OrderedDict()
+        # deferreds waiting on the end of the boot, and its outcome
+        self.boot_waiters = []
+        self.booted = None
+        self.snapshot = None
+
+        same.tables.county_file = self.config.get('same', {}).get('county_file', same.COUNTY_FILE)
+        self.same_voter = same.SAMEVoter(threshold = self.config.get('same', {}).get('confidence_threshold',
+                                                                                      SI4707.SAME_CONFIDENCE_THRESHOLD),
+                                         timeout = SI4707.SAME_TIME_OUT)
+        self.alert_cache = same.AlertCache(maxsize = self.config.get('same', {}).get('alert_cache_size', 256),
+                                           min_ttl = self.config.get('same', {}).get('duplicate_window', 900))
+        self.published_alerts = None
+
+        # messages published while the broker can't be reached wait here
+        outbox_config = self.config.get('outbox', {})
+        outbox_path = outbox_config.get('path', os.path.join(var_dir, 'outbox'))
+        disk = None
+        if outbox_path is not None:
+            try:
+                os.makedirs(os.path.dirname(outbox_path), exist_ok = True)
+                disk = DiskQueue(outbox_path, size = outbox_config.get('disk_size', 1 << 20))
+            except OSError as e:
+                self.log.warn('Cannot open outbox {path:}, alerts will only be held in memory: {error:}',
+                              path = outbox_path, error = e)
+        self.outbox = Outbox(disk,
+                             memory_size = outbox_config.get('memory_size', 256),
+                             rate = outbox_config.get('rate', 20.0))
+
+        self.telemetry = TelemetryPublisher(self.serial, self.outbox,
+                                            deadbands = self.config.get('telemetry', {}).get('deadband', {}),
+                                            intervals = self.config.get('telemetry', {}).get('min_interval', {}))
+
+        # signal quality history kept on the device
+        history_config = self.config.get('history', {})
+        history_path = history_config.get('path', os.path.join(var_dir, 'history.sqlite'))
+        self.history = None
+        if history_path is not None:
+            import sqlite3
+            from .history import SignalHistory
+            try:
+                os.makedirs(os.path.dirname(history_path), exist_ok = True)
+                self.history = SignalHistory(history_path,
+                                             flush_interval = history_config.get('flush_interval', 60),
+                                             raw_retention = history_config.get('raw_retention', 86400),
+                                             minute_retention = history_config.get('minute_retention', 7 * 86400),
+                                             hour_retention = history_config.get('hour_retention', 365 * 86400))
+            except (OSError, sqlite3.Error) as e:
+                self.log.warn('Cannot open history {path:}, signal history will not be kept: {error:}',
+                              path = history_path, error = e)
+        if self.history is not None:
+            reactor.callWhenRunning(self.history.start)
+            reactor.addSystemEventTrigger('before', 'shutdown', self.history.close)
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self.saveState)
+
+        # every receiver boots on its own, so several come up in parallel
+        reactor.callWhenRunning(self.boot)
+
+    # Bringing up the radio is a list of phases that run one after
+    # another. Each phase is the boot<Phase> method, which may return a
+    # Deferred, and none of them block the reactor so that the MQTT
+    # connection comes up in parallel. The time taken by each phase is
+    # kept in self.startup and published once MQTT is connected.
+
+    # The probe phase decides between the two plans. A warm boot is used
+    # when the radio kept its power across a restart of the daemon and
+    # still has the patch, channel and interrupt configuration recorded
+    # in the state file, so the reset and patch upload can be skipped.
+
+    BOOT_PLAN = ['reset', 'patch', 'interrupts', 'configure', 'tune', 'snapshot', 'signal', 'periodic']
+    WARM_BOOT_PLAN = ['interrupts', 'rearm', 'snapshot', 'signal', 'periodic']
+
+    RESET_HOLD = 0.01       # time the reset pin is held low
+    RESET_SETTLE = 0.01     # time between releasing reset and powering up
+
+    # In "interrupt" mode the radio watches the signal quality itself and
+    # interrupts when the RSSI or SNR leaves a window around the last
+    # reading, which is then moved to be around the new one. The status
+    # is only polled every heartbeat_interval seconds in case an
+    # interrupt goes missing. "poll" reads it every minute.
+    RSQ_POLL = 'poll'
+    RSQ_INTERRUPT = 'interrupt'
+    RSQ_INTERRUPTS = SI4707.RSSILIEN | SI4707.RSSIHIEN | SI4707.SNRLIEN | SI4707.SNRHIEN
+    RSQ_THRESHOLD_MAX = 127
+
+    POLL_TICK = 1.0         # how often the periodic polls are checked
+
+    # RPi.GPIO watches the interrupt line on a thread of its own, which
+    # hands each edge to the reactor. With "gpiochip" the reactor reads
+    # the edges, with the kernel's timestamps, from the GPIO character
+    # device itself.
+    INTERRUPTS_RPI_GPIO = 'rpi_gpio'
+    INTERRUPTS_GPIOCHIP = 'gpiochip'
+
+    # upper bounds, in seconds, of the interrupt latency histogram buckets
+    ISR_LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1.0)
+
+    def bootProperties(self):
+        return [(SI4707.GPO_IEN, (#SI4707.CTSIEN |
+                                  SI4707.ERRIEN |
+                                  SI4707.RSQIEN |
+                                  SI4707.SAMEIEN |
+                                  SI4707.ASQIEN |
+                                  SI4707.STCIEN)),
+                (SI4707.WB_SAME_INTERRUPT_SOURCE, (SI4707.HDRRDYIEN |
+                                                   SI4707.PREDETIEN |
+                                                   SI4707.SOMDETIEN |
+                                                   SI4707.EOMDETIEN)),
+                (SI4707.WB_ASQ_INT_SOURCE, SI4707.ALERTONIEN),
+                (SI4707.WB_RSQ_INT_SOURCE, self.RSQ_INTERRUPTS if self.rsq_mode == self.RSQ_INTERRUPT else 0)]
+
+    def boot(self):
+        self.boot_started = time.monotonic()
+        d = self._bootPhase(None, 'probe')
+        d.addCallback(self._bootPlan)
+        d.addCallbacks(self._bootFinished, self._bootFailed)
+        return d
+
+    def _bootPlan(self, ignored):
+        if self.warm:
+            plan = self.WARM_BOOT_PLAN
+        else:
+            plan = self.BOOT_PLAN
+        d = succeed(None)
+        for phase in plan:
+            d.addCallback(self._bootPhase, phase)
+        return d
+
+    def _bootPhase(self, ignored, phase):
+        self.log.debug('Boot phase: {phase:}', phase = phase)
+        start = time.monotonic()
+        d = maybeDeferred(getattr(self, 'boot' + phase[0].upper() + phase[1:]))
+        d.addCallback(self._bootPhaseFinished, phase, start)
+        return d
+
+    def _bootPhaseFinished(self, ignored, phase, start):
+        self.startup[phase] = time.monotonic() - start
+
+    def whenBooted(self):
+        # fires with True once the radio is ready, False if it failed to
+        # start
+        if self.booted is not None:
+            return succeed(self.booted)
+        d = Deferred()
+        self.boot_waiters.append(d)
+        return d
+
+    def _bootDone(self, booted):
+        self.booted = booted
+        waiters, self.boot_waiters = self.boot_waiters, []
+        for d in waiters:
+            d.callback(booted)
+
+    def _bootFinished(self, ignored):
+        self.startup['total'] = time.monotonic() - self.boot_started
+        self.startup['warm'] = self.warm
+        self.saveState()
+        self.log.info('Radio ready after {kind:} boot in {total:.3f} s: {phases:}',
+                      kind = 'warm' if self.warm else 'cold',
+                      total = self.startup['total'],
+                      phases = ', '.join('{} {:.3f} s'.format(phase, elapsed)
+                                         for phase, elapsed in self.startup.items()
+                                         if phase not in ('total', 'warm')))
+        self.publishStartup()
+        self._bootDone(True)
+
+    def _bootFailed(self, failure):
+        self.log.failure('Radio failed to start', failure = failure)
+        self._bootDone(False)
+
+    def bootProbe(self):
+        self.gpio.setmode(self.gpio.BCM)
+
+        self.gpio.setup(self.relay_1_pin, self.gpio.OUT)
+        self.gpio.output(self.relay_1_pin, self.gpio.LOW)
+        self.gpio.setup(self.relay_2_pin, self.gpio.OUT)
+        self.gpio.output(self.relay_2_pin, self.gpio.LOW)
+
+        # keep the radio out of reset until we know whether it needs one
+        self.gpio.setup(self.radio_reset_pin, self.gpio.OUT, initial = self.gpio.HIGH)
+
+        self.warm = False
+        if self.cold_boot:
+            self.log.info('Cold boot requested')
+            return
+
+        state = self.loadState()
+        if state is None:
+            return
+
+        d = self.radio.getRevision()
+        d.addCallback(self._bootProbeRevision, state)
+        d.addCallback(self._bootProbeTune, state)
+        d.addCallback(self._bootProbeProperties, state)
+        d.addErrback(self._bootProbeFailed)
+        return d
+
+    def _bootProbeRevision(self, revision, state):
+        if revision['patch_id'] == '0x0000' or revision['patch_id'] != state.get('patch_id'):
+            raise WarmBootUnavailable('radio has patch {}, expected {}'.format(revision['patch_id'], state.get('patch_id')))
+        return self.radio.getTuneStatus()
+
+    def _bootProbeTune(self, tune_status, state):
+        if tune_status['channel'] != state.get('channel'):
+            raise WarmBootUnavailable('radio is tuned to {:04X}, expected {}'.format(tune_status['channel'], state.get('channel')))
+        # a channel that differs from the config is put right by the rearm
+        self.warm_channel = tune_status['channel']
+        properties = [prop for prop, value in self.bootProperties()]
+        properties.extend(int(prop, 16) for prop in state.get('properties', {}))
+        properties = sorted(set(properties))
+        d = gatherResults([self.radio.getProperty(prop) for prop in properties], consumeErrors = True)
+        d.addCallback(lambda values: dict(zip(properties, values)))
+        return d
+
+    def _bootProbeProperties(self, values, state):
+        for prop, expected in self.bootProperties():
+            if values[prop] != expected:
+                raise WarmBootUnavailable('property {:04X} is {:04X}, expected {:04X}'.format(prop, values[prop], expected))
+        self.log.info('Radio is already configured, skipping reset and patch')
+        self.radio.power = self.radio.ON
+        self.warm = True
+
+    def _bootProbeFailed(self, failure):
+        if failure.check(WarmBootUnavailable):
+            self.log.info('Cold boot: {reason:}', reason = failure.value)
+        else:
+            self.log.info('Cold boot: could not probe the radio: {failure:}', failure = failure.value)
+
+    def loadState(self):
+        try:
+            with open(self.state_file, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except FileNotFoundError:
+            self.log.info('No state file at {path:}', path = self.state_file)
+        except (OSError, ValueError) as e:
+            self.log.warn('Cannot read state file {path:}: {error:}', path = self.state_file, error = e)
+        return None
+
+    def saveState(self):
+        if self.radio.power != self.radio.ON or self.snapshot is None:
+            return
+        state = {'patch_id': self.snapshot['revision']['patch_id'],
+                 'channel': self.snapshot['tune']['channel'],
+                 'properties': {'0x{:04X}'.format(prop): value
+                                for prop, value in self.radio.cachedProperties().items()},
+                 'saved': time.time()}
+        if self.subscribed is not None:
+            state['subscriptions'] = self.subscribed
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok = True)
+            tmp = self.state_file + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(state).encode('utf-8'))
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            self.log.warn('Cannot write state file {path:}: {error:}', path = self.state_file, error = e)
+
+    def bootReset(self):
+        self.log.debug('Resetting the radio')
+        self.gpio.output(self.radio_reset_pin, self.gpio.LOW)
+        d = deferLater(reactor, self.RESET_HOLD, self.gpio.output, self.radio_reset_pin, self.gpio.HIGH)
+        d.addCallback(lambda ignored: self.radio.invalidateProperties())
+        d.addCallback(lambda ignored: deferLater(reactor, self.RESET_SETTLE, lambda: None))
+        return d
+
+    def bootPatch(self):
+        self.log.debug('Powering up and patching!')
+        return self.radio.patch()
+
+    def gpioLineEvents(self, pin, callback):
+        from .gpioevents import GPIOLineEvents
+        return GPIOLineEvents(self.config.get('radio', {}).get('gpio_chip', '/dev/gpiochip0'), pin, callback)
+
+    def bootInterrupts(self):
+        self.log.debug('Setting up interrupt callbacks')
+        self.gpio.setup(self.radio_interrupt_pin, self.gpio.IN, pull_up_down = self.gpio.PUD_UP)
+        if self.interrupt_source == self.INTERRUPTS_GPIOCHIP and self.edges is None:
+            try:
+                self.edges = self.lineEvents(self.radio_interrupt_pin, self.edgeEvent)
+            except OSError as e:
+                self.log.warn('Cannot watch the interrupt line through the GPIO character device, '
+                              'using RPi.GPIO instead: {error:}', error = e)
+                self.interrupt_source = self.INTERRUPTS_RPI_GPIO
+            else:
+                self.edges.start()
+                return
+        self.gpio.add_event_detect(self.radio_interrupt_pin, self.gpio.FALLING, callback = self.callback)
+
+    def bootConfigure(self):
+        # start watching for interrupts from the radio; all of the
+        # properties go out in one bus session
+        properties = self.bootProperties() + [(SI4707.RX_HARD_MUTE, 0x0003)]
+        volume = self.config.get('radio', {}).get('volume')
+        if volume is not None:
+            properties.append((SI4707.RX_VOLUME, max(0, min(volume, SI4707.RADIO_VOLUME))))
+        return gatherResults([self.radio.setProperties(properties),
+                              self.radio.setAGCStatus(0x01)],
+                             consumeErrors = True)
+
+    def configuredChannel(self):
+        frequency = self.config.get('radio', {}).get('frequency', '162.550')
+        try:
+            return SI4707.freqLowByte[SI4707.freqNow.index('{:.3f}'.format(float(frequency)))]
+        except ValueError:
+            self.log.warn('{frequency:} is not a weather radio channel, using 162.550 MHz', frequency = frequency)
+            return 0xfc
+
+    def applyVolume(self):
+        volume = self.config.get('radio', {}).get('volume')
+        if volume is None or self.radio.cachedProperties().get(SI4707.RX_VOLUME) == volume:
+            return succeed(None)
+        d = self.radio.setVolume(volume)
+        d.addCallback(lambda ignored: self.refreshVolumeStatus())
+        return d
+
+    def bootTune(self):
+        if self.scan_on_boot:
+            return self.scanChannels()
+        return self.radio.tune(self.tune_low_byte)
+
+    def bootRearm(self):
+        # an interrupt that arrived while nobody was listening has left the
+        # interrupt line low, so there will be no edge for it; a volume or
+        # frequency set in the config while the daemon was down is applied
+        # now, unless a scan on boot is to pick the channel
+        ds = [self.serviceInterrupt(), self.applyVolume()]
+        if not self.scan_on_boot:
+            ds.append(self.retune(self.warm_channel))
+        return gatherResults(ds, consumeErrors = True)
+
+    def bootSnapshot(self):
+        d = gatherResults([self.radio.getRevision(),
+                           self.radio.getTuneStatus(),
+                           self.radio.getRSQStatus(),
+                           self.radio.getMute(),
+                           self.radio.getVolume()],
+                          consumeErrors = True)
+        d.addCallback(self._bootSnapshot)
+        return d
+
+    def _bootSnapshot(self, results):
+        revision, tune_status, rsq_status, mute, volume = results
+        self.logRevision(revision)
+        self.snapshot = {'revision': revision,
+                         'tune': tune_status,
+                         'rsq': rsq_status,
+                         'mute': mute,
+                         'volume': volume}
+        self.logTuneStatus(tune_status)
+        self.logRSQStatus(rsq_status)
+        self.logMuteStatus(mute)
+        self.logVolumeStatus(volume)
+        self.publishSnapshot()
+
+    def logRevision(self, result):
+        self.log.debug('Revision: {result:}', result = result)
+
+    def bootSignal(self):
+        if self.rsq_mode != self.RSQ_INTERRUPT:
+            return
+        return self.recentreRSQ(self.snapshot['rsq'])
+
+    def recentreRSQ(self, rsq_status, priority = BusWorker.PERIODIC):
+        # thresholds are in the chip's units, dBµV and dB
+        rssi = rsq_status['rssi'] + SI4707.RSSI_OFFSET
+        snr = rsq_status['snr']
+        window = [(SI4707.WB_RSQ_RSSI_LOW_THRESHOLD, max(0, rssi - self.rssi_window)),
+                  (SI4707.WB_RSQ_RSSI_HIGH_THRESHOLD, min(self.RSQ_THRESHOLD_MAX, rssi + self.rssi_window)),
+                  (SI4707.WB_RSQ_SNR_LOW_THRESHOLD, max(0, snr - self.snr_window)),
+                  (SI4707.WB_RSQ_SNR_HIGH_THRESHOLD, min(self.RSQ_THRESHOLD_MAX, snr + self.snr_window))]
+        cached = self.radio.cachedProperties()
+        window = [(prop, value) for prop, value in window if cached.get(prop) != value]
+        if not window:
+            return succeed(None)
+        self.log.debug('RSQ window: {window:}', window = window)
+        return self.radio.setProperties(window, priority = priority)
+
+    def statusInterval(self):
+        if self.rsq_mode == self.RSQ_INTERRUPT:
+            return self.heartbeat_interval
+        return 60
+
+    def bootPeriodic(self):
+        # the first values were published with the snapshot so the first
+        # polls are a full period away
+        status_interval = self.statusInterval()
+        now = time.monotonic()
+        self.polls = [[status_interval, now + status_interval, self.radio.getMute, self.logMuteStatus],
+                      [status_interval, now + status_interval, self.radio.getVolume, self.logVolumeStatus],
+                      [status_interval, now + status_interval, self.radio.getRSQStatus, self.updateRSQStatus],
+                      [status_interval, now + status_interval, self.radio.getTuneStatus, self.logTuneStatus]]
+        l = LoopingCall(self.periodicPolls)
+        l.start(self.POLL_TICK, now = False)
+
+        for offset, fn in enumerate([self.periodicBusStatistics,
+                                     self.periodicAlertExpiry,
+                                     self.periodicConnectionStatistics]):
+            l = LoopingCall(fn)
+            reactor.callLater(offset, l.start, 60, now = False)
+        self.summary_loop = self.periodicLoop(self.summary_loop, self.periodicCommandMetrics,
+                                              self.config.get('metrics', {}).get('summary_interval', 0))
+        self.audit_loop = self.periodicLoop(self.audit_loop, self.periodicPropertyAudit,
+                                            self.config.get('radio', {}).get('property_audit_interval', 0))
+
+    def periodicLoop(self, loop, fn, interval):
+        # (re)starts calling fn every interval seconds, an interval of 0
+        # stops it; returns the new loop
+        if loop is not None and loop.running:
+            loop.stop()
+        if interval <= 0:
+            return None
+        loop = LoopingCall(fn)
+        loop.start(interval, now = False)
+        return loop
+
+    def publishSnapshot(self):
+        if self.snapshot is None:
+            return
+        self.outbox.publish(topic = 'weather_radio/{}/status'.format(self.serial), qos = 0, message = json.dumps(self.snapshot))
+
+    def publishStartup(self):
+        if 'total' not in self.startup:
+            return
+        self.outbox.publish(topic = 'weather_radio/{}/startup'.format(self.serial), qos = 0, message = json.dumps(self.startup))
+
+    def publishActiveAlerts(self):
+        # retained so that a client connecting later sees what is in effect
+        now = time.time()
+        self.published_alerts = frozenset(header.key() for header, expires in self.alert_cache.active(now))
+        self.outbox.publish(topic = 'weather_radio/{}/active_alerts'.format(self.serial), qos = 1, retain = True,
+                            durable = True, message = json.dumps(self.alert_cache.snapshot(now)))
+
+    def cleanup(self):
+        # the reset pin is left alone so the radio keeps its configuration
+        # for a warm boot
+        self.gpio.cleanup([self.relay_1_pin, self.relay_2_pin, self.radio_interrupt_pin])
+        if self.edges is not None:
+            self.edges.stop()
+
+    def scanChannels(self):
+        # scans every channel, publishes what was found as one message and
+        # tunes to the best channel, or back to the one the radio was on
+        # unless the best is clearly better
+        self.last_scan = time.monotonic()
+        if self.snapshot is not None:
+            current = self.snapshot['tune']['channel']
+        else:
+            current = None
+        self.radio.hold('scan', BusWorker.PERIODIC, len(self.radio.freqLowByte) *
+                                (self.radio.STC_TIMEOUT + self.scanner.dwell + self.scanner.same_dwell))
+        d = self.scanner.scan()
+        d.addCallback(self._scanned, current)
+        d.addBoth(self._scanFinished)
+        return d
+
+    def _scanned(self, results, current):
+        selected = best = results[0]
+        for result in results[1:]:
+            if result['channel'] == current and not self.scanBetter(best, result):
+                selected = result
+        if selected['channel'] != current:
+            self.log.info('Moving to {frequency:} MHz, SNR {snr:}', frequency = selected['frequency'], snr = selected['snr'])
+        self.outbox.publish(topic = 'weather_radio/{}/scan'.format(self.serial), qos = 0, retain = True,
+                            message = json.dumps({'time': time.time(),
+                                                  'elapsed': self.scanner.last_scan_time,
+                                                  'previous': current,
+                                                  'selected': selected['frequency'],
+                                                  'channels': results}))
+        self.tune_low_byte = selected['channel'] & 0xff
+        d = self.radio.tune(self.tune_low_byte)
+        if self.rsq_mode == self.RSQ_INTERRUPT and self.snapshot is not None:
+            d.addCallback(lambda ignored: self.radio.getRSQStatus())
+            d.addCallback(self.updateRSQStatus, BusWorker.USER)
+        return d
+
+    def _scanFinished(self, result):
+        self.radio.release('scan')
+        return result
+
+    def _scanFailed(self, failure):
+        self.log.failure('Channel scan failed', failure)
+
+    def scanBetter(self, best, current):
+        if best['valid'] and not current['valid']:
+            return True
+        return best['snr'] >= current['snr'] + self.scan_min_improvement
+
+    def rescanDue(self, result):
+        if self.rescan_snr is None or result['snr'] >= self.rescan_snr or self.scanner.scanning:
+            return False
+        now = time.monotonic()
+        if now < self.same_until:
+            return False
+        return self.last_scan is None or now - self.last_scan >= self.rescan_holdoff
+
+    def periodicPolls(self):
+        # the status polls that are due are read in one turn of the bus,
+        # behind anything more urgent; mute and volume come from the
+        # property cache without touching the bus at all
+        now = time.monotonic()
+        due = [poll for poll in self.polls if poll[1] <= now]
+        if not due:
+            return
+        commands = []
+        for poll in due:
+            interval, next_due, method, handler = poll
+            poll[1] = now + interval
+            if hasattr(method, '__wrapped__'):
+                commands.append((method, handler))
+            else:
+                method().addCallback(handler)
+        if commands:
+            d = self.radio.batch([(method, ()) for method, handler in commands], priority = BusWorker.PERIODIC)
+            d.addCallback(self._periodicPolls, [handler for method, handler in commands])
+
+    def _periodicPolls(self, results, handlers):
+        for handler, result in zip(handlers, results):
+            handler(result)
+
+    def periodicRSQStatus(self):
+        d = self.radio.getRSQStatus(priority = BusWorker.PERIODIC)
+        d.addCallback(self.updateRSQStatus)
+
+    def refreshMuteStatus(self):
+        d = self.radio.getMute()
+        d.addCallback(self.logMuteStatus)
+
+    def refreshVolumeStatus(self):
+        d = self.radio.getVolume()
+        d.addCallback(self.logVolumeStatus)
+
+    def periodicPropertyAudit(self):
+        d = self.radio.auditProperties(priority = BusWorker.PERIODIC)
+        d.addCallback(self.logPropertyAudit)
+
+    def logPropertyAudit(self, drift):
+        self.log.debug('Property audit: {count:} drifted', count = len(drift))
+
+    def periodicBusStatistics(self):
+        statistics = self.radio.busStatistics()
+        statistics['interrupts'] = self.interruptStatistics()
+        self.log.debug('Bus statistics: {statistics:}', statistics = statistics)
+        self.log.debug('Telemetry: {statistics:}', statistics = self.telemetry.statistics())
+        self.log.debug('Outbox: {statistics:}', statistics = self.outbox.statistics())
+        if self.history is not None:
+            self.log.debug('History: {statistics:}', statistics = self.history.statistics())
+        self.outbox.publish(topic = 'weather_radio/{}/bus_statistics'.format(self.serial), qos = 0, message = json.dumps(statistics))
+
+    def periodicCommandMetrics(self):
+        self.outbox.publish(topic = 'weather_radio/{}/command_metrics'.format(self.serial), qos = 0,
+                            message = json.dumps(self.radio.metrics.summary(), sort_keys = True))
+
+    def metricsPage(self, page = None, labels = ()):
+        # labels tell the receivers apart when there is more than one
+        if page is None:
+            page = PrometheusText()
+        metrics = self.radio.metrics
+        for phase, (name, help) in enumerate([('command_lock_wait_seconds', 'Time radio commands waited for the bus.'),
+                                              ('command_bus_io_seconds', 'Time radio commands spent in I2C transfers.'),
+                                              ('command_sleep_seconds', 'Time radio commands slept waiting for the radio.'),
+                                              ('command_dispatch_seconds', 'Time from a radio command finishing to its result reaching the reactor.')]):
+            page.histogram(name, help, [(labels + (('command', command),), phases[phase])
+                                        for command, phases in sorted(metrics.commands.items())])
+        page.counter('command_errors_total', 'Radio commands that failed.',
+                     [(labels + (('command', command),), count) for command, count in sorted(metrics.errors.items())])
+
+        statistics = self.radio.busStatistics()
+        page.gauge('bus_queue_depth', 'Commands waiting for the bus.', [(labels, statistics['depth'])])
+        page.counter('bus_queue_rejected_total', 'Commands refused because the bus queue was full.',
+                     [(labels, statistics['rejected'])])
+        page.counter('bus_queue_cancelled_total', 'Commands cancelled while waiting for the bus.',
+                     [(labels, statistics['cancelled'])])
+
+        page.histogram('interrupt_latency_seconds', 'Time from an interrupt edge to the end of its handling.',
+                       [(labels, self.isr_latency)])
+        page.counter('interrupt_edges_total', 'Edges seen on the interrupt line.', [(labels, self.isr_edges)])
+        page.counter('interrupt_coalesced_total', 'Interrupt edges folded into a service already waiting.',
+                     [(labels, self.isr_coalesced)])
+        return page
+
+    def periodicConnectionStatistics(self):
+        if self.mqtt_supervisor is None:
+            return
+        statistics = self.mqtt_supervisor.statistics()
+        self.log.debug('Connection statistics: {statistics:}', statistics = statistics)
+        self.outbox.publish(topic = 'weather_radio/{}/connection_statistics'.format(self.serial), qos = 0, message = json.dumps(statistics))
+
+    def periodicAlertExpiry(self):
+        now = time.time()
+        self.alert_cache.expire(now)
+        active = frozenset(header.key() for header, expires in self.alert_cache.active(now))
+        if active != self.published_alerts:
+            self.publishActiveAlerts()
+
+    # this will end up being called from some thread in the RPi.GPIO library
+    def callback(self, pin):
+        if self._edgeSeen(time.perf_counter()):
+            reactor.callFromThread(self._interruptEdge)
+
+    def edgeEvent(self, edge):
+        # called on the reactor thread by the GPIO character device with
+        # the time of the edge
+        if self._edgeSeen(edge):
+            self._interruptEdge()
+
+    def _edgeSeen(self, edge):
+        # true when a service has to be started for this edge
+        if self.trace is not None:
+            self.trace.edge(edge)
+        with self._isr_lock:
+            self.isr_edges += 1
+            if self._isr_edge is not None:
+                # the service that is already waiting will see this one too
+                self.isr_coalesced += 1
+                return False
+            self._isr_edge = edge
+            if self._isr_running:
+                # picked up when the running service is finished
+                return False
+        return True
+
+    def _interruptEdge(self):
+        d = self.serviceInterrupt()
+        d.addErrback(self._interruptFailed)
+
+    def _interruptFailed(self, failure):
+        self.log.failure('Servicing the radio interrupt failed', failure)
+
+    def serviceInterrupt(self):
+        with self._isr_lock:
+            edge = self._isr_edge
+            self._isr_edge = None
+            self._isr_running = True
+        d = self.radio.serviceInterrupt(priority = BusWorker.ISR)
+        d.addCallback(self.handleInterrupt, edge)
+        d.addBoth(self._interruptServiced)
+        return d
+
+    def _interruptServiced(self, result):
+        with self._isr_lock:
+            self._isr_running = False
+            again = self._isr_edge is not None
+        if again:
+            self._interruptEdge()
+        return result
+
+    def handleInterrupt(self, event, edge):
+        self.log.debug('interrupt status: {status:}', status = event.status)
+        self.isr_serviced += 1
+
+        if event.tune is not None:
+            self.log.debug('STC interrupt')
+            self.same_voter.reset()
+            self.logTuneStatus(event.tune)
+
+        if event.rsq is not None and self.scanner.scanning:
+            # the signal of whichever channel is being scanned
+            self.log.debug('RSQ interrupt during channel scan')
+        elif event.rsq is not None:
+            self.log.debug('RSQ interrupt')
+            self.rsq_crossings += 1
+            self.updateRSQStatus(event.rsq, BusWorker.ISR)
+
+        if event.same is not None:
+            self.log.debug('SAME interrupt')
+            if self.scanner.scanning:
+                self.scanner.sameActivity(event.same.status)
+            self.logSAMEStatus(event.same)
+
+        if event.asq is not None:
+            self.log.debug('ASQ interrupt')
+            self.logASQStatus(event.asq)
+
+        if event.status & self.radio.ERRINT:
+            self.log.debug('Error interrupt received')
+
+        # from the edge to the end of handling it, for interrupts that
+        # came from an edge rather than from the rearm at boot
+        if edge is not None:
+            self.recordInterruptLatency(time.perf_counter() - edge)
+
+    def recordInterruptLatency(self, latency):
+        self.isr_latency.record(latency)
+
+    def interruptStatistics(self):
+        return {'edges': self.isr_edges,
+                'coalesced': self.isr_coalesced,
+                'serviced': self.isr_serviced,
+                'latency': self.isr_latency.snapshot()}
+
+    def logTuneStatus(self, result):
+        self.log.debug('Tune status: {status:}', status = result)
+        if self.snapshot is not None:
+            self.snapshot['tune'] = result
+        if self.history is not None:
+            self.history.add(result)
+        self.telemetry.update({'rssi': result['rssi'],
+                               'snr': result['snr'],
+                               'frequency': result['frequency'],
+                               'channel': result['channel']})
+
+    def logRSQStatus(self, result):
+        self.log.debug('RSQ status: {status:}', status = result)
+        if self.history is not None:
+            self.history.add(result)
+        self.telemetry.update({'rssi': result['rssi'],
+                               'snr': result['snr'],
+                               'frequency_offset': result['frequency_offset']})
+
+    def updateRSQStatus(self, result, priority = BusWorker.PERIODIC):
+        self.logRSQStatus(result)
+        if self.rescanDue(result):
+            self.log.info('SNR is down to {snr:}, scanning for a better channel', snr = result['snr'])
+            d = self.scanChannels()
+            d.addErrback(self._scanFailed)
+        if self.rsq_mode == self.RSQ_INTERRUPT:
+            return self.recentreRSQ(result, priority)
+
+    def logSAMEStatus(self, result):
+        self.log.debug('SAME status: {status:} {state:} {length:} {confidence:} {data:}', status = result.status, state = result.state, length = result.length, confidence = list(result.confidence), data = bytes(result.data))
+
+        if result.status & self.radio.HDRRDY and result.length >= self.radio.SAME_MIN_LENGTH:
+            self.log.debug('SAME header detected')
+            if result.header is None:
+                self.log.debug('SAME header copy did not decode: {error:}', error = result.parser.error)
+            header = self.same_voter.add(result.data[:result.length], result.confidence[:result.length],
+                                         time.monotonic(), result.header)
+            if header is not None:
+                # a re-broadcast of an alert that is still in effect
+                if self.alert_cache.add(header, time.time()):
+                    self.logSAMEHeader(header)
+                    self.publishActiveAlerts()
+                else:
+                    self.log.debug('SAME header already seen: {header:}', header = header)
+
+        if result.status & (self.radio.PREDET | self.radio.SOMDET | self.radio.HDRRDY):
+            # keep the periodic polls off the bus until the alert is in
+            self.radio.hold('same', BusWorker.PERIODIC, self.radio.SAME_TIME_OUT)
+            self.same_until = time.monotonic() + self.radio.SAME_TIME_OUT
+
+        if result.status & self.radio.PREDET:
+            self.log.debug('SAME preamble detected')
+
+        if result.status & self.radio.SOMDET:
+            self.log.debug('SAME start of message detected')
+
+        if result.status & self.radio.EOMDET:
+            self.log.debug('SAME end of message detected')
+            # the interrupt service has already flushed the buffer
+            self.same_voter.reset()
+            self.same_until = 0.0
+            self.radio.release('same')
+
+    def logSAMEHeader(self, header):
+        self.log.info('SAME header: {header:}', header = header)
+        self.outbox.publish(topic = 'weather_radio/{}/alert'.format(self.serial), qos = 1, durable = True,
+                            message = json.dumps(header.asDict()))
+
+    def logASQStatus(self, result):
+        self.log.debug('ASQ status: {status:}', status = result)
+
+        #if result == 0x01:
+        #    self.radio.sameFlush()
+        #    self.log.debug('1050 Hz Alert Tone: ON')
+        #
+        #elif result == 0x02:
+        #    self.log.debug('1050 Hz Alert Tone: OFF')
+
+    def logMuteStatus(self, result):
+        self.log.debug('Mute status: {status:}', status = result)
+
+        if result:
+            message = 'ON'
+        else:
+            message = 'OFF'
+
+        self.telemetry.update({'mute_status': message})
+
+    def logVolumeStatus(self, result):
+        self.log.debug('Volume status: {status:}', status = result)
+
+        self.telemetry.update({'volume_status': result})
+
+    def mqttConnected(self, mqtt, session_present):
+        self.mqtt = mqtt
+
+        self.outbox.connected(self.mqtt)
+        self.telemetry.resend()
+        topics = self.mqttTopics()
+        if self.subscribed is None:
+            self.subscribed = (self.loadState() or {}).get('subscriptions', [])
+        # the broker kept the subscriptions with the session, but a session
+        # left by an older version may lack topics added since
+        if session_present and self.subscribed == topics:
+            return
+        d = self.mqtt.subscribe([(topic, 0) for topic in topics])
+        d.addCallback(self.mqttSubscribed, topics)
+
+    def mqttTopics(self):
+        return sorted('weather_radio/{}/{}'.format(self.serial, topic)
+                      for topic in ['mute_control', 'volume_control', 'history/request', 'scan_control'])
+
+    def mqttSubscribed(self, result, topics):
+        self.log.debug('Subscribed: {result:}', result = result)
+        self.subscribed = topics
+        self.saveState()
+
+    def mqttDisconnected(self, reason):
+        self.mqtt = None
+        self.outbox.disconnected()
+
+    def mqttReceiveMessage(self, topic, payload, qos, dup, retain, msgid):
+        self.log.debug('topic = {topic}, payload = {payload}, qos = {qos}, dup = {dup}, retain = {retain}, msgid = {msgid}',
+                       topic = topic,
+                       payload = payload,
+                       qos = qos,
+                       dup = dup,
+                       retain = retain,
+                       msgid = msgid)
+        if topic.endswith('/mute_control'):
+            if payload == b'ON':
+                self.log.debug('Turning mute on!')
+                self.radio.setMute(True)
+            elif payload == b'OFF':
+                self.log.debug('Turning mute off!')
+                self.radio.setMute(False)
+            self.refreshMuteStatus()
+        if topic.endswith('/volume_control'):
+            if payload == b'INCREASE':
+                self.radio.volumeIncrease()
+            elif payload == b'DECREASE':
+                self.radio.volumeDecrease()
+            else:
+                try:
+                    volume = int(payload)
+                    self.radio.setVolume(volume)
+                except ValueError:
+                    pass
+            self.refreshVolumeStatus()
+        if topic.endswith('/history/request'):
+            self.historyRequest(payload)
+        if topic.endswith('/scan_control') and payload == b'SCAN':
+            if not self.scanner.scanning:
+                d = self.scanChannels()
+                d.addErrback(self._scanFailed)
+
+    def historyRequest(self, payload):
+        # the answer carries the request's id, if it had one, so that a
+        # client can match them up
+        from .history import HistoryQueryError
+        request = {}
+        try:
+            request = json.loads(payload.decode('utf-8'))
+            if not isinstance(request, dict):
+                request = {}
+                raise HistoryQueryError('request is not a JSON object')
+            if self.history is None:
+                raise HistoryQueryError('no history is kept')
+            response = self.history.request(request)
+        except (ValueError, HistoryQueryError) as e:
+            response = {'error': str(e)}
+        if 'id' in request:
+            response['id'] = request['id']
+        self.outbox.publish(topic = 'weather_radio/{}/history/response'.format(self.serial), qos = 0,
+                            message = json.dumps(response))
+
+    # A reloaded config is compared with the running one and only what
+    # changed is applied, without a reset or a patch upload: a new
+    # frequency is tuned, a new volume or RSQ setup is written to the
+    # radio's properties and everything else kept in the daemon is
+    # updated in place. The settings below are only read when the daemon
+    # starts, a change to them is logged and waits for a restart.
+    RESTART_SETTINGS = frozenset(['radio.reset_pin', 'radio.interrupt_pin', 'radio.relay_1_pin', 'radio.relay_2_pin',
+                                  'radio.var_dir', 'radio.state_file', 'radio.simulate', 'radio.replay',
+                                  'radio.replay_realtime', 'radio.bus', 'radio.address', 'radio.i2c',
+                                  'radio.interrupts', 'radio.gpio_chip', 'radio.queue_size', 'radio.completion',
+                                  'radio.wait_for_stc', 'outbox', 'history', 'trace'])
+    # handled by Receivers, or only meaningful when the daemon starts
+    IGNORED_SETTINGS = frozenset(['serial', 'mqtt', 'web', 'receivers', 'reload', 'radio.cold_boot'])
+
+    def reload(self, config):
+        old, self.config = self.config, config
+        changed = set(setting for setting in changedSettings(old, config)
+                      if setting not in self.IGNORED_SETTINGS and setting.split('.')[0] not in self.IGNORED_SETTINGS)
+        restart = sorted(setting for setting in changed
+                         if setting in self.RESTART_SETTINGS or setting.split('.')[0] in self.RESTART_SETTINGS)
+        if restart:
+            self.log.warn('Restart the daemon to apply {settings:} to {serial:}',
+                          settings = ', '.join(restart), serial = self.serial)
+        changed.difference_update(restart)
+        if not changed:
+            return succeed(None)
+        self.log.info('Applying {settings:} to {serial:}', settings = ', '.join(sorted(changed)), serial = self.serial)
+        self.reloads += 1
+
+        scan_config = self.config.get('scan', {})
+        self.scanner.dwell = scan_config.get('dwell', 0.0)
+        self.scanner.same_dwell = scan_config.get('same_dwell', 0.0)
+        self.scan_on_boot = scan_config.get('on_boot', False)
+        self.rescan_snr = scan_config.get('rescan_snr', None)
+        self.rescan_holdoff = scan_config.get('rescan_holdoff', 3600)
+        self.scan_min_improvement = scan_config.get('min_improvement', 3)
+
+        same_config = self.config.get('same', {})
+        if 'same.county_file' in changed:
+            same.tables.setCountyFile(same_config.get('county_file', same.COUNTY_FILE))
+        self.same_voter.threshold = same_config.get('confidence_threshold', SI4707.SAME_CONFIDENCE_THRESHOLD)
+        self.alert_cache.maxsize = same_config.get('alert_cache_size', 256)
+        self.alert_cache.min_ttl = same_config.get('duplicate_window', 900)
+
+        self.telemetry.deadbands = dict(self.telemetry.DEADBANDS)
+        self.telemetry.deadbands.update(self.config.get('telemetry', {}).get('deadband', {}))
+        self.telemetry.intervals = self.config.get('telemetry', {}).get('min_interval', {})
+
+        radio_config = self.config.get('radio', {})
+        rsq_mode = radio_config.get('rsq_mode', self.RSQ_INTERRUPT)
+        rsq_changed = (rsq_mode != self.rsq_mode or
+                       radio_config.get('rssi_window', 3) != self.rssi_window or
+                       radio_config.get('snr_window', 3) != self.snr_window)
+        self.rsq_mode = rsq_mode
+        self.rssi_window = radio_config.get('rssi_window', 3)
+        self.snr_window = radio_config.get('snr_window', 3)
+        self.heartbeat_interval = radio_config.get('heartbeat_interval', 900)
+        self.tune_low_byte = self.configuredChannel()
+
+        # the loops and the radio are only touched once the boot is over,
+        # a boot still under way picks the new values up as it goes
+        d = self.whenBooted()
+        d.addCallback(self._reloadBooted, changed, rsq_changed)
+        return d
+
+    def _reloadBooted(self, booted, changed, rsq_changed):
+        if not booted:
+            return
+        now = time.monotonic()
+        status_interval = self.statusInterval()
+        for poll in self.polls:
+            if poll[0] != status_interval:
+                poll[0] = status_interval
+                poll[1] = min(poll[1], now + status_interval)
+        if 'metrics.summary_interval' in changed:
+            self.summary_loop = self.periodicLoop(self.summary_loop, self.periodicCommandMetrics,
+                                                  self.config.get('metrics', {}).get('summary_interval', 0))
+        if 'radio.property_audit_interval' in changed:
+            self.audit_loop = self.periodicLoop(self.audit_loop, self.periodicPropertyAudit,
+                                                self.config.get('radio', {}).get('property_audit_interval', 0))
+
+        ds = []
+        if 'radio.volume' in changed:
+            ds.append(self.applyVolume())
+        if rsq_changed:
+            ds.append(self.reloadRSQ())
+        if 'radio.frequency' in changed:
+            ds.append(self.retune())
+        d = gatherResults(ds, consumeErrors = True)
+        d.addCallback(lambda ignored: self.saveState())
+        d.addErrback(self._reloadFailed)
+        return d
+
+    def reloadRSQ(self):
+        d = self.radio.setProperties([(SI4707.WB_RSQ_INT_SOURCE,
+                                       self.RSQ_INTERRUPTS if self.rsq_mode == self.RSQ_INTERRUPT else 0)])
+        if self.rsq_mode == self.RSQ_INTERRUPT:
+            d.addCallback(lambda ignored: self.radio.getRSQStatus())
+            d.addCallback(self.recentreRSQ, BusWorker.USER)
+        return d
+
+    def retune(self, current = None):
+        # current is the channel the radio is on, if it isn't in the snapshot
+        if self.scanner.scanning:
+            # the scan tunes when it is done, to the best channel
+            return succeed(None)
+        if current is None and self.snapshot is not None:
+            current = self.snapshot['tune']['channel']
+        if current is not None and current & 0xff == self.tune_low_byte:
+            return succeed(None)
+        self.log.info('Tuning to {frequency:} MHz', frequency = SI4707.freqNow[SI4707.freqLowByte.index(self.tune_low_byte)])
+        d = self.radio.tune(self.tune_low_byte)
+        d.addCallback(lambda ignored: self.radio.getTuneStatus())
+        d.addCallback(self.logTuneStatus)
+        # on a boot the signal phase reads the RSQ status itself
+        if self.rsq_mode == self.RSQ_INTERRUPT and self.snapshot is not None:
+            d.addCallback(lambda ignored: self.radio.getRSQStatus())
+            d.addCallback(self.updateRSQStatus, BusWorker.USER)
+        return d
+
+    def _reloadFailed(self, failure):
+        self.log.failure('Applying the reloaded config failed', failure)
+
+def changedSettings(old, new):
+    # the settings that differ between two configs, as "section.key" for
+    # the keys of a section and "key" for anything else
+    changed = set()
+    for key in set(old) | set(new):
+        a = old.get(key)
+        b = new.get(key)
+        if a == b:
+            continue
+        if isinstance(a, dict) or isinstance(b, dict):
+            a = a if isinstance(a, dict) else {}
+            b = b if isinstance(b, dict) else {}
+            keys = set('{}.{}'.format(key, k) for k in set(a) | set(b) if a.get(k) != b.get(k))
+            # an empty section and no section at all are told apart
+            changed.update(keys or [key])
+        else:
+            changed.add(key)
+    return changed
+
+class Receivers(object):
+    # The receivers run by this daemon. Each one is a Radio with its own
+    # bus worker, interrupt line and topics under weather_radio/<serial>/;
+    # they share the MQTT connection and the web server.
+    log = Logger()
+
+    radio_class = Radio
+
+    def __init__(self, serial, config):
+        self.serial = serial
+        self.config = config
+        self.radios = []
+        receivers = self.config.get('receivers')
+        if receivers is None:
+            # a single receiver, configured by the top level sections
+            self.radios.append(self.radio_class(serial, config))
+        else:
+            for index, receiver in enumerate(receivers):
+                name = receiver.get('name', str(index))
+                self.radios.append(self.radio_class(receiver.get('serial', '{}-{}'.format(serial, name)),
+                                                    self.receiverConfig(receiver, name)))
+        self.mqtt_supervisor = None
+        self._mqtt_shutdown = None
+        self.web_port = None
+        # seconds taken to set up MQTT and the web server
+        self.startup = collections.OrderedDict()
+
+        reactor.callWhenRunning(self.mqttSetup)
+        reactor.callWhenRunning(self.webSetup)
+
+    def receiverConfig(self, receiver, name):
+        # the top level sections are the defaults for every receiver, each
+        # section of the receiver is laid over the one of the same name
+        config = dict(self.config)
+        del config['receivers']
+        for key, value in receiver.items():
+            if isinstance(value, dict):
+                section = dict(config.get(key, {}))
+                section.update(value)
+                config[key] = section
+            else:
+                config[key] = value
+        # each receiver keeps its files in a directory of its own
+        if 'var_dir' not in receiver.get('radio', {}):
+            config['radio'] = dict(config.get('radio', {}),
+                                   var_dir = os.path.join(self.config.get('radio', {}).get('var_dir', '/opt/rpiwr/var'), name))
+        return config
+
+    def cleanup(self):
+        for radio in self.radios:
+            radio.cleanup()
+
+    def reload(self, config):
+        # applies a reloaded config to the receivers, the MQTT connection
+        # and the web server, see Radio.reload
+        old, self.config = self.config, config
+        if old.get('serial') != config.get('serial'):
+            self.log.warn('Restart the daemon to apply serial')
+        ds = []
+        receivers = config.get('receivers')
+        if (receivers is None) != (old.get('receivers') is None):
+            self.log.warn('Restart the daemon to apply receivers')
+        elif receivers is None:
+            ds.append(self.radios[0].reload(config))
+        else:
+            names = [receiver.get('name', str(index)) for index, receiver in enumerate(receivers)]
+            old_names = [receiver.get('name', str(index)) for index, receiver in enumerate(old['receivers'])]
+            if names != old_names:
+                self.log.warn('Restart the daemon to add, remove or rename receivers')
+            for radio, name, old_name, receiver in zip(self.radios, names, old_names, receivers):
+                if name == old_name:
+                    ds.append(radio.reload(self.receiverConfig(receiver, name)))
+        if old.get('mqtt', {}) != config.get('mqtt', {}):
+            self.log.info('MQTT settings changed, reconnecting')
+            self.mqttStop()
+            self.mqttSetup()
+        if old.get('web', {}) != config.get('web', {}):
+            ds.append(self.webRestart())
+        return gatherResults(ds, consumeErrors = True)
+
+    def mqttStop(self):
+        supervisor, self.mqtt_supervisor = self.mqtt_supervisor, None
+        if supervisor is None:
+            return
+        reactor.removeSystemEventTrigger(self._mqtt_shutdown)
+        self._mqtt_shutdown = None
+        # the old connection no longer speaks for the receivers, even
+        # while it is still closing
+        supervisor.connected = None
+        supervisor.disconnected = None
+        connected = supervisor.mqtt is not None
+        supervisor.stop()
+        for radio in self.radios:
+            radio.mqtt_supervisor = None
+            if connected:
+                radio.mqttDisconnected(None)
+
+    def mqttSetup(self):
+        # "mqtt": null runs the receivers without a broker
+        if 'mqtt' in self.config and self.config['mqtt'] is None:
+            return
+        start = time.perf_counter()
+        from .supervisor import MQTTSupervisor
+        mqtt_tls = self.config.get('mqtt', {}).get('tls', False)
+        mqtt_hostname = self.config.get('mqtt', {}).get('hostname', '127.0.0.1')
+        mqtt_port = self.config.get('mqtt', {}).get('port', None)
+        if mqtt_port is None:
+            if mqtt_tls:
+                mqtt_port = 8883
+            else:
+                mqtt_port = 1883
+
+        # every daemon needs its own client id for its session to persist
+        client_id = self.config.get('mqtt', {}).get('client_id', 'rpiwr-{}'.format(self.serial))
+        self.mqtt_supervisor = MQTTSupervisor(mqtt_hostname, mqtt_port, client_id,
+                                              tls = mqtt_tls,
+                                              keepalive = self.config.get('mqtt', {}).get('keepalive', 60),
+                                              initial_delay = self.config.get('mqtt', {}).get('reconnect_initial_delay', 1.0),
+                                              max_delay = self.config.get('mqtt', {}).get('reconnect_max_delay', 300.0))
+        self.mqtt_supervisor.connected = self.mqttConnected
+        self.mqtt_supervisor.disconnected = self.mqttDisconnected
+        for radio in self.radios:
+            radio.mqtt_supervisor = self.mqtt_supervisor
+        self._mqtt_shutdown = reactor.addSystemEventTrigger('before', 'shutdown', self.mqtt_supervisor.stop)
+        self.mqtt_supervisor.start()
+        self.startup['mqtt'] = time.perf_counter() - start
+
+    def mqttConnected(self, mqtt, session_present):
+        mqtt.setPublishHandler(self.mqttReceiveMessage)
+        for radio in self.radios:
+            radio.mqttConnected(mqtt, session_present)
+
+    def mqttDisconnected(self, reason):
+        for radio in self.radios:
+            radio.mqttDisconnected(reason)
+
+    def mqttReceiveMessage(self, topic, payload, qos, dup, retain, msgid):
+        for radio in self.radios:
+            if topic.startswith('weather_radio/{}/'.format(radio.serial)):
+                radio.mqttReceiveMessage(topic, payload, qos, dup, retain, msgid)
+                break
+
+    def metricsPage(self):
+        page = PrometheusText()
+        for radio in self.radios:
+            if len(self.radios) > 1:
+                radio.metricsPage(page, (('receiver', radio.serial),))
+            else:
+                radio.metricsPage(page)
+        return page
+
+    def webSetup(self):
+        port = self.config.get('web', {}).get('port', None)
+        if port is None:
+            return
+        start = time.perf_counter()
+        from twisted.internet import endpoints
+        from .web import site
+        histories = {radio.serial: radio.history for radio in self.radios if radio.history is not None}
+        endpoint = endpoints.TCP4ServerEndpoint(reactor, port, interface = self.config.get('web', {}).get('interface', ''))
+        d = endpoint.listen(site(self.metricsPage, histories))
+        d.addCallbacks(self._webListening, self._webFailed, errbackArgs = (port,))
+        self.startup['web'] = time.perf_counter() - start
+
+    def webRestart(self):
+        port, self.web_port = self.web_port, None
+        if port is None:
+            d = succeed(None)
+        else:
+            d = maybeDeferred(port.stopListening)
+        d.addCallback(lambda ignored: self.webSetup())
+        return d
+
+    def _webListening(self, port):
+        self.web_port = port
+
+    def _webFailed(self, failure, port):
+        self.log.failure('Cannot listen for HTTP on port {port:}', failure, port = port)
@@ -0,0 +1,143 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Edges on a GPIO line, read by the reactor from a file descriptor
+# rather than by a thread of RPi.GPIO. On the Pi the descriptor is a
+# line event request on the GPIO character device, which also gives the
+# kernel's time of each edge. A pipe written in the same format by some
+# other code can stand in for it, as the simulated radio does.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import fcntl
+import os
+import struct
+import time
+
+from zope.interface import implementer
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+from twisted.internet.error import ConnectionLost
+from twisted.internet.interfaces import IReadDescriptor
+
+# from linux/gpio.h, version 1 of the interface
+
+GPIOHANDLE_REQUEST_INPUT = 1 << 0
+GPIOEVENT_REQUEST_RISING_EDGE = 1 << 0
+GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+
+# struct gpioevent_request and _IOWR(0xB4, 0x04, struct gpioevent_request)
+GPIOEVENT_REQUEST = struct.Struct('III32si')
+GPIO_GET_LINEEVENT_IOCTL = 0xC0000000 | GPIOEVENT_REQUEST.size << 16 | 0xB4 << 8 | 0x04
+
+# struct gpioevent_data: timestamp in nanoseconds and the kind of edge
+GPIOEVENT_DATA = struct.Struct('QI4x')
+GPIOEVENT_EVENT_RISING_EDGE = 0x01
+GPIOEVENT_EVENT_FALLING_EDGE = 0x02
+
+@implementer(IReadDescriptor)
+class EdgeSource(object):
+    # Calls callback on the reactor thread with the time of each edge on
+    # the time.perf_counter() clock. Subclasses provide the descriptor,
+    # which is read as a series of kernel line events.
+    log = Logger()
+
+    READ_SIZE = 4096
+
+    def __init__(self, fd, callback, clock = reactor):
+        self.fd = fd
+        self.callback = callback
+        self.clock = clock
+        self.edges = 0
+        os.set_blocking(fd, False)
+
+    def start(self):
+        self.clock.addReader(self)
+
+    def stop(self):
+        if self.fd is None:
+            return
+        self.clock.removeReader(self)
+        os.close(self.fd)
+        self.fd = None
+
+    def fileno(self):
+        if self.fd is None:
+            return -1
+        return self.fd
+
+    def logPrefix(self):
+        return self.__class__.__name__
+
+    def connectionLost(self, reason):
+        # the reactor also lets go of its readers this way when it stops
+        if not reason.check(ConnectionDone, ConnectionLost):
+            self.log.failure('Stopped reading GPIO edges', reason)
+        self.stop()
+
+    def doRead(self):
+        try:
+            data = os.read(self.fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        for timestamp in self.timestamps(data):
+            self.edges += 1
+            self.callback(self.edgeTime(timestamp))
+
+    def timestamps(self, data):
+        # the kernel times, as CLOCK_MONOTONIC nanoseconds, of the edges
+        # in data
+        return [timestamp for timestamp, event in GPIOEVENT_DATA.iter_unpack(data)]
+
+    def edgeTime(self, timestamp):
+        # kernels before 5.7 stamp line events with CLOCK_REALTIME
+        monotonic = time.monotonic_ns()
+        if timestamp > monotonic + 1000000000:
+            age = time.time_ns() - timestamp
+        else:
+            age = monotonic - timestamp
+        return time.perf_counter() - max(age, 0) / 1e9
+
+class GPIOLineEvents(EdgeSource):
+    # Falling edges of one line of a GPIO chip, by default the Pi's.
+    # Bias is left as it is, it is set up through RPi.GPIO.
+
+    def __init__(self, chip, line, callback, consumer = b'rpiwr', clock = reactor):
+        request = bytearray(GPIOEVENT_REQUEST.pack(line, GPIOHANDLE_REQUEST_INPUT,
+                                                   GPIOEVENT_REQUEST_FALLING_EDGE, consumer, 0))
+        chip_fd = os.open(chip, os.O_RDONLY)
+        try:
+            fcntl.ioctl(chip_fd, GPIO_GET_LINEEVENT_IOCTL, request)
+        finally:
+            os.close(chip_fd)
+        EdgeSource.__init__(self, GPIOEVENT_REQUEST.unpack(request)[4], callback, clock = clock)
+
+class PipeEdges(EdgeSource):
+    # Edges written into a pipe by trigger(), from any thread, in the
+    # same format as the kernel's line events.
+
+    def __init__(self, callback, clock = reactor):
+        self.read_fd, self.write_fd = os.pipe()
+        EdgeSource.__init__(self, self.read_fd, callback, clock = clock)
+
+    def trigger(self):
+        os.write(self.write_fd, GPIOEVENT_DATA.pack(time.monotonic_ns(), GPIOEVENT_EVENT_FALLING_EDGE))
+
+    def stop(self):
+        if self.fd is not None:
+            EdgeSource.stop(self)
+            os.close(self.write_fd)
@@ -0,0 +1,205 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Keeps a history of the signal quality on the radio itself, in an
+# SQLite database in WAL mode. Samples are buffered in memory, together
+# with their one minute and one hour min/max/mean rollups, and written
+# out in a single transaction every flush_interval seconds so that the
+# SD card isn't written on every reading. Each resolution is pruned to
+# its own retention period.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import time
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+class HistoryQueryError(Exception):
+    pass
+
+class SignalHistory(object):
+    log = Logger()
+
+    FIELDS = ('rssi', 'snr', 'frequency_offset', 'frequency')
+
+    RAW = 'raw'
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    # rollup table: bucket width in seconds
+    ROLLUPS = {MINUTE: 60, HOUR: 3600}
+
+    # queries without a resolution get the finest one that keeps the
+    # answer to about this many rows
+    MAX_ROWS = 1500
+
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS raw (field TEXT NOT NULL, time REAL NOT NULL, value REAL NOT NULL)',
+              'CREATE INDEX IF NOT EXISTS raw_field_time ON raw (field, time)',
+              'CREATE TABLE IF NOT EXISTS minute (field TEXT NOT NULL, time INTEGER NOT NULL, '
+              'min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL, count INTEGER NOT NULL, '
+              'PRIMARY KEY (field, time))',
+              'CREATE TABLE IF NOT EXISTS hour (field TEXT NOT NULL, time INTEGER NOT NULL, '
+              'min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL, count INTEGER NOT NULL, '
+              'PRIMARY KEY (field, time))']
+
+    def __init__(self, path, flush_interval = 60, raw_retention = 86400,
+                 minute_retention = 7 * 86400, hour_retention = 365 * 86400, clock = reactor):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = {self.RAW: raw_retention,
+                          self.MINUTE: minute_retention,
+                          self.HOUR: hour_retention}
+        self.clock = clock
+
+        self._db = sqlite3.connect(path, isolation_level = None)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        # a crash may lose the last transaction but can't corrupt the
+        # database, and commits don't have to wait for the card
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+
+        # (field, time, value) waiting to be written
+        self._samples = []
+        # table: {(field, bucket start): [min, max, sum, count]}
+        self._rollups = {table: {} for table in self.ROLLUPS}
+
+        self.samples = 0
+        self.flushes = 0
+        self.flush_time = 0.0
+
+        self._loop = None
+
+    def start(self):
+        self._loop = LoopingCall(self.flush)
+        self._loop.clock = self.clock
+        self._loop.start(self.flush_interval, now = False)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+        self.flush()
+
+    def close(self):
+        self.stop()
+        self._db.close()
+
+    def add(self, values, now = None):
+        # values: {field: value}, anything not in FIELDS is left out
+        if now is None:
+            now = time.time()
+        for field in self.FIELDS:
+            value = values.get(field)
+            if value is None:
+                continue
+            self._samples.append((field, now, value))
+            self.samples += 1
+            for table, width in self.ROLLUPS.items():
+                key = (field, int(now) - int(now) % width)
+                bucket = self._rollups[table].get(key)
+                if bucket is None:
+                    self._rollups[table][key] = [value, value, value, 1]
+                else:
+                    if value < bucket[0]:
+                        bucket[0] = value
+                    if value > bucket[1]:
+                        bucket[1] = value
+                    bucket[2] += value
+                    bucket[3] += 1
+
+    def flush(self):
+        if not self._samples:
+            return
+        start = time.perf_counter()
+        now = time.time()
+        with self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany('INSERT INTO raw (field, time, value) VALUES (?, ?, ?)', self._samples)
+            for table, buckets in self._rollups.items():
+                # a bucket may already have been started by an earlier flush
+                self._db.executemany('INSERT INTO {0} (field, time, min, max, sum, count) VALUES (?, ?, ?, ?, ?, ?) '
+                                     'ON CONFLICT (field, time) DO UPDATE SET '
+                                     'min = min({0}.min, excluded.min), max = max({0}.max, excluded.max), '
+                                     'sum = {0}.sum + excluded.sum, count = {0}.count + excluded.count'.format(table),
+                                     [key + tuple(bucket) for key, bucket in buckets.items()])
+            for table, retention in self.retention.items():
+                self._db.execute('DELETE FROM {} WHERE time < ?'.format(table), (now - retention,))
+        self._samples = []
+        self._rollups = {table: {} for table in self.ROLLUPS}
+        self.flushes += 1
+        self.flush_time = time.perf_counter() - start
+
+    def query(self, field, start, end, resolution = None):
+        # rows of [time, value] for raw samples or [time, min, max, mean]
+        # for the rollups, oldest first
+        if field not in self.FIELDS:
+            raise HistoryQueryError('unknown field: {}'.format(field))
+        if end < start:
+            raise HistoryQueryError('end is before start')
+        if resolution is None:
+            resolution = self.resolutionFor(end - start)
+        if resolution not in self.retention:
+            raise HistoryQueryError('unknown resolution: {}'.format(resolution))
+
+        # whatever is still buffered belongs in the answer
+        self.flush()
+        if resolution == self.RAW:
+            rows = self._db.execute('SELECT time, value FROM raw WHERE field = ? AND time >= ? AND time <= ? '
+                                    'ORDER BY time', (field, start, end))
+        else:
+            # including the bucket that start falls in
+            rows = self._db.execute('SELECT time, min, max, sum / count FROM {} '
+                                    'WHERE field = ? AND time > ? AND time <= ? '
+                                    'ORDER BY time'.format(resolution),
+                                    (field, start - self.ROLLUPS[resolution], end))
+        return {'field': field,
+                'start': start,
+                'end': end,
+                'resolution': resolution,
+                'rows': [list(row) for row in rows]}
+
+    def resolutionFor(self, span):
+        # samples come in about once a second at most
+        if span <= self.MAX_ROWS:
+            return self.RAW
+        if span <= self.MAX_ROWS * self.ROLLUPS[self.MINUTE]:
+            return self.MINUTE
+        return self.HOUR
+
+    def request(self, request, now = None):
+        # a query as a dict, as sent over MQTT or HTTP; start and end are
+        # Unix times, or seconds before now when they are negative
+        if now is None:
+            now = time.time()
+        try:
+            field = request['field']
+            start = float(request.get('start', -3600))
+            end = float(request.get('end', now))
+        except (KeyError, TypeError, ValueError) as e:
+            raise HistoryQueryError('bad request: {}'.format(e))
+        if start < 0:
+            start += now
+        if end < 0:
+            end += now
+        return self.query(field, start, end, request.get('resolution'))
+
+    def statistics(self):
+        return {'samples': self.samples,
+                'pending': len(self._samples),
+                'flushes': self.flushes,
+                'flush_time': self.flush_time}
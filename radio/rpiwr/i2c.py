@@ -0,0 +1,238 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Quick Python 3 I2C layer over the lower level smbus operations, and
+# an alternative that drives /dev/i2c-N directly with I2C_RDWR.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import fcntl
+import os
+import time
+
+class Device(object):
+    # bus is either the number of an I2C bus (opened through smbus) or
+    # any object that implements the SMBus methods used below, such as
+    # the software radio in simulator.py
+
+    def __init__(self, address, bus):
+        if isinstance(bus, int):
+            from smbus import SMBus
+            bus = SMBus(bus)
+        self._bus = bus
+        self._address = address
+        # seconds spent in bus transfers, for the command metrics
+        self.io_time = 0.0
+
+    def writeRaw8(self, value):
+        value = value & 0xff
+        start = time.perf_counter()
+        self._bus.write_byte(self._address, value)
+        self.io_time += time.perf_counter() - start
+
+    def readRaw8(self):
+        start = time.perf_counter()
+        result = self._bus.read_byte(self._address) & 0xff
+        self.io_time += time.perf_counter() - start
+        return result
+
+    def write8(self, register, value):
+        value = value & 0xff
+        start = time.perf_counter()
+        self._bus.write_byte_data(self._address, register, value)
+        self.io_time += time.perf_counter() - start
+
+    def readU8(self, register):
+        start = time.perf_counter()
+        result = self._bus.read_byte_data(self._address, register) & 0xFF
+        self.io_time += time.perf_counter() - start
+        return result
+
+    def readS8(self, register):
+        result = self.readU8(register)
+        if result > 127:
+            result -= 256
+        return result
+
+    def write16(self, register, value):
+        value = value & 0xffff
+        start = time.perf_counter()
+        self._bus.write_word_data(self._address, register, value)
+        self.io_time += time.perf_counter() - start
+
+    def readU16(self, register, little_endian = True):
+        start = time.perf_counter()
+        result = self._bus.read_word_data(self._address,register) & 0xFFFF
+        self.io_time += time.perf_counter() - start
+        if not little_endian:
+            result = ((result << 8) & 0xFF00) + (result >> 8)
+        return result
+
+    def readS16(self, register, little_endian = True):
+        result = self.readU16(register, little_endian)
+        if result > 32767:
+            result -= 65536
+        return result
+
+    def writeList(self, register, data):
+        start = time.perf_counter()
+        self._bus.write_i2c_block_data(self._address, register, data)
+        self.io_time += time.perf_counter() - start
+
+    def readList(self, register, length):
+        start = time.perf_counter()
+        results = self._bus.read_i2c_block_data(self._address, register, length)
+        self.io_time += time.perf_counter() - start
+        return results
+
+    def readBlock(self, length):
+        # SMBus has no plain multi-byte read so register 0 is sent first
+        return self.readList(0, length)
+
+    def transfer(self, register, data, length):
+        # writes register and data, then reads length bytes back
+        self.writeList(register, data)
+        return self.readBlock(length)
+
+# from linux/i2c.h and linux/i2c-dev.h
+
+I2C_M_RD = 0x0001
+I2C_RDWR = 0x0707
+
+class _I2CMessage(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_uint16),
+                ('flags', ctypes.c_uint16),
+                ('len', ctypes.c_uint16),
+                ('buf', ctypes.c_void_p)]
+
+class _I2CReadWrite(ctypes.Structure):
+    _fields_ = [('msgs', ctypes.POINTER(_I2CMessage)),
+                ('nmsgs', ctypes.c_uint32)]
+
+class RawDevice(object):
+    # The same methods as Device, but each one is a single I2C_RDWR ioctl
+    # on /dev/i2c-N. Writes go out of and reads come into buffers
+    # allocated once, so reads return a memoryview of the read buffer
+    # that is only good until the next transfer. Reads that don't need
+    # a register byte don't send one, and transfer() is a write and a
+    # read joined by a repeated start.
+
+    BUFFER_SIZE = 64
+
+    def __init__(self, address, bus):
+        # bus is the number of an I2C bus or the path to its device
+        if isinstance(bus, int):
+            bus = '/dev/i2c-{}'.format(bus)
+        self._fd = os.open(bus, os.O_RDWR)
+        self._address = address
+        self.io_time = 0.0
+
+        self._write = bytearray(self.BUFFER_SIZE)
+        self._read = bytearray(self.BUFFER_SIZE)
+        self._messages = (_I2CMessage * 2)()
+        self._write_message = self._messages[0]
+        self._write_message.addr = address
+        self._write_message.flags = 0
+        self._write_message.buf = ctypes.addressof(ctypes.c_char.from_buffer(self._write))
+        self._read_message = self._messages[1]
+        self._read_message.addr = address
+        self._read_message.flags = I2C_M_RD
+        self._read_message.buf = ctypes.addressof(ctypes.c_char.from_buffer(self._read))
+        # the ioctl argument for the write and read together, the write
+        # alone and the read alone
+        self._both = _I2CReadWrite(self._messages, 2)
+        self._write_only = _I2CReadWrite(self._messages, 1)
+        self._read_only = _I2CReadWrite(ctypes.pointer(self._read_message), 1)
+        self._view = memoryview(self._read)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _transfer(self, request, write_length, read_length):
+        if read_length > self.BUFFER_SIZE:
+            raise ValueError('I2C read longer than {} bytes'.format(self.BUFFER_SIZE))
+        self._write_message.len = write_length
+        self._read_message.len = read_length
+        start = time.perf_counter()
+        # the request is handed over as a buffer, the kernel follows the
+        # message pointers in it
+        fcntl.ioctl(self._fd, I2C_RDWR, request)
+        self.io_time += time.perf_counter() - start
+        return self._view[:read_length]
+
+    def _writeData(self, register, data):
+        self._write[0] = register & 0xff
+        length = len(data)
+        if length >= self.BUFFER_SIZE:
+            raise ValueError('I2C write longer than {} bytes'.format(self.BUFFER_SIZE))
+        self._write[1:length + 1] = bytes(data)
+        return length + 1
+
+    def writeRaw8(self, value):
+        self._write[0] = value & 0xff
+        self._transfer(self._write_only, 1, 0)
+
+    def readRaw8(self):
+        return self._transfer(self._read_only, 0, 1)[0]
+
+    def write8(self, register, value):
+        self._write[0] = register & 0xff
+        self._write[1] = value & 0xff
+        self._transfer(self._write_only, 2, 0)
+
+    def readU8(self, register):
+        self._write[0] = register & 0xff
+        return self._transfer(self._both, 1, 1)[0]
+
+    def readS8(self, register):
+        result = self.readU8(register)
+        if result > 127:
+            result -= 256
+        return result
+
+    def write16(self, register, value):
+        self._write[0] = register & 0xff
+        self._write[1] = value & 0xff
+        self._write[2] = (value >> 8) & 0xff
+        self._transfer(self._write_only, 3, 0)
+
+    def readU16(self, register, little_endian = True):
+        self._write[0] = register & 0xff
+        result = self._transfer(self._both, 1, 2)
+        if little_endian:
+            return result[0] | result[1] << 8
+        return result[0] << 8 | result[1]
+
+    def readS16(self, register, little_endian = True):
+        result = self.readU16(register, little_endian)
+        if result > 32767:
+            result -= 65536
+        return result
+
+    def writeList(self, register, data):
+        self._transfer(self._write_only, self._writeData(register, data), 0)
+
+    def readList(self, register, length):
+        self._write[0] = register & 0xff
+        return self._transfer(self._both, 1, length)
+
+    def readBlock(self, length):
+        return self._transfer(self._read_only, 0, length)
+
+    def transfer(self, register, data, length):
+        return self._transfer(self._both, self._writeData(register, data), length)
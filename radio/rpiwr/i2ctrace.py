@@ -0,0 +1,458 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Recording of everything that goes over the I2C bus to the radio, and
+# the interrupt edges from it, to a compact binary trace; and a bus that
+# plays a trace back to the daemon in place of the radio, so that what
+# happened in the field can be looked at again on any machine.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# A trace file is a header, the magic, the time the file starts at and
+# the run it belongs to, followed by records. A run is the files written
+# by one TraceWriter without any records lost in between. Each record is
+# its kind, the microseconds since the record before it, a register and
+# the length of the data that follows. A gap too long for the delta is a GAP record whose data is
+# the length of the gap in seconds. Times are time.perf_counter().
+
+import os
+import struct
+import threading
+import time
+
+from twisted.logger import Logger
+
+from .si4707 import SI4707
+
+MAGIC = b'RPIWRI2C'
+HEADER = struct.Struct('<8sdQ')
+RECORD = struct.Struct('<BIBB')
+GAP_DATA = struct.Struct('<d')
+
+WRITE = 1           # register and the data written after it
+READ = 2            # register and the data read back after it
+READ_BLOCK = 3      # data read without a register
+EDGE = 4            # an edge on the interrupt line
+GAP = 5
+
+MAX_DELTA = 0xffffffff
+
+class TraceWriter(object):
+    # Records are gathered in memory and written out when buffer_size
+    # bytes have built up or flush() is called. The file is rotated when
+    # it would grow past max_size, keeping backups older files as
+    # path.1 (the newest) to path.<backups>; a file left by an earlier
+    # run is moved aside the same way. Records that can't be written are
+    # dropped and counted, and the next flush starts a new run. Records
+    # come from the bus thread and from whatever sees the interrupt
+    # edges, so they are added under a lock.
+    log = Logger()
+
+    def __init__(self, path, max_size = 1 << 20, backups = 3, buffer_size = 1 << 16):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.buffer_size = buffer_size
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        # records in the buffer
+        self._pending = 0
+        self._last = time.perf_counter()
+        # the time of the last record written out, which the records in
+        # the buffer are relative to
+        self._written = self._last
+        self._file = None
+        self._size = 0
+        self._closed = False
+        self._run = time.time_ns()
+
+        self.records = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rotations = 0
+
+    def write(self, register, data):
+        self._record(WRITE, register, data)
+
+    def read(self, register, data):
+        self._record(READ, register, data)
+
+    def readBlock(self, data):
+        self._record(READ_BLOCK, 0, data)
+
+    def edge(self, when = None):
+        self._record(EDGE, 0, b'', when)
+
+    def _record(self, kind, register, data, when = None):
+        if when is None:
+            when = time.perf_counter()
+        with self._lock:
+            if self._closed:
+                return
+            # _last is the time of the last record as it will be read
+            # back, so rounding doesn't add up
+            gap = max(when - self._last, 0.0)
+            delta = int(gap * 1e6)
+            if delta > MAX_DELTA:
+                self._buffer += RECORD.pack(GAP, 0, 0, GAP_DATA.size)
+                self._buffer += GAP_DATA.pack(gap)
+                self._last += gap
+                delta = 0
+            else:
+                self._last += delta / 1e6
+            self._buffer += RECORD.pack(kind, delta, register & 0xff, len(data))
+            self._buffer += bytes(data)
+            self.records += 1
+            self._pending += 1
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        # anything recorded after this is dropped, a flush would start
+        # a new file
+        with self._lock:
+            self._flush()
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def statistics(self):
+        return {'records': self.records,
+                'dropped': self.dropped,
+                'pending': len(self._buffer),
+                'flushes': self.flushes,
+                'rotations': self.rotations}
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        try:
+            if self._file is None or self._size + len(self._buffer) > self.max_size:
+                self._rotate()
+            self._file.write(self._buffer)
+            self._file.flush()
+        except OSError as e:
+            self.log.warn('Cannot write I2C trace {path:}, dropping {count:} records: {error:}',
+                          path = self.path, count = self._pending, error = e)
+            self.dropped += self._pending
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+            # the next file can't carry on from this one
+            self._run = time.time_ns()
+        else:
+            self._size += len(self._buffer)
+            self.flushes += 1
+        self._buffer = bytearray()
+        self._pending = 0
+        self._written = self._last
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        self._file = open(self.path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, self._written, self._run))
+        self._size = HEADER.size
+
+    def _rotate(self):
+        # also opens the first file, and the next one after a failed write
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            for n in range(self.backups - 1, 0, -1):
+                if os.path.exists('{}.{}'.format(self.path, n)):
+                    os.replace('{}.{}'.format(self.path, n), '{}.{}'.format(self.path, n + 1))
+            if self.backups > 0:
+                os.replace(self.path, '{}.1'.format(self.path))
+            self.rotations += 1
+        self._open()
+
+class RecordingDevice(object):
+    # Wraps an i2c.Device or i2c.RawDevice and records every transfer.
+
+    def __init__(self, device, writer):
+        self._device = device
+        self.writer = writer
+
+    @property
+    def io_time(self):
+        return self._device.io_time
+
+    def writeRaw8(self, value):
+        self._device.writeRaw8(value)
+        self.writer.write(value, b'')
+
+    def readRaw8(self):
+        result = self._device.readRaw8()
+        self.writer.readBlock(bytes((result,)))
+        return result
+
+    def write8(self, register, value):
+        self._device.write8(register, value)
+        self.writer.write(register, bytes((value & 0xff,)))
+
+    def readU8(self, register):
+        result = self._device.readU8(register)
+        self.writer.read(register, bytes((result,)))
+        return result
+
+    def readS8(self, register):
+        result = self.readU8(register)
+        if result > 127:
+            result -= 256
+        return result
+
+    def write16(self, register, value):
+        self._device.write16(register, value)
+        self.writer.write(register, bytes((value & 0xff, (value >> 8) & 0xff)))
+
+    def readU16(self, register, little_endian = True):
+        result = self._device.readU16(register, little_endian)
+        if little_endian:
+            self.writer.read(register, bytes((result & 0xff, result >> 8)))
+        else:
+            self.writer.read(register, bytes((result >> 8, result & 0xff)))
+        return result
+
+    def readS16(self, register, little_endian = True):
+        result = self.readU16(register, little_endian)
+        if result > 32767:
+            result -= 65536
+        return result
+
+    def writeList(self, register, data):
+        self._device.writeList(register, data)
+        self.writer.write(register, data)
+
+    def readList(self, register, length):
+        result = self._device.readList(register, length)
+        self.writer.read(register, result)
+        return result
+
+    def readBlock(self, length):
+        result = self._device.readBlock(length)
+        self.writer.readBlock(result)
+        return result
+
+    def transfer(self, register, data, length):
+        result = self._device.transfer(register, data, length)
+        self.writer.write(register, data)
+        self.writer.readBlock(result)
+        return result
+
+def traceRun(path):
+    with open(path, 'rb') as f:
+        magic, when, run = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('{} is not an I2C trace'.format(path))
+    return run
+
+def tracePaths(path):
+    # the files of the newest run of a rotated trace, oldest first; the
+    # backups of an earlier run are left out
+    paths = [path] if os.path.exists(path) else []
+    run = traceRun(path) if paths else None
+    n = 1
+    while os.path.exists('{}.{}'.format(path, n)):
+        backup = '{}.{}'.format(path, n)
+        if run is None:
+            run = traceRun(backup)
+        elif traceRun(backup) != run:
+            break
+        paths.insert(0, backup)
+        n += 1
+    return paths
+
+def readTrace(paths):
+    # (kind, time, register, data) for every record of the files, with
+    # GAP records folded into the times
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, when, run = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('{} is not an I2C trace'.format(path))
+        offset = HEADER.size
+        while offset + RECORD.size <= len(data):
+            kind, delta, register, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            payload = data[offset:offset + length]
+            offset += length
+            when += delta / 1e6
+            if kind == GAP:
+                when += GAP_DATA.unpack(payload)[0]
+                continue
+            yield (kind, when, register, payload)
+
+class ReplayBus(object):
+    # Plays a trace back in place of smbus.SMBus and the radio, with the
+    # same interrupt listeners as simulator.SimulatedSI4707. Reads get
+    # what was read at that point of the trace and writes are checked
+    # against what was written. An edge fires once the bus has got as
+    # far as it in the trace, and with realtime no earlier than it did
+    # when the trace was recorded.
+    #
+    # The daemon can stray from the trace, say a status poll that fell
+    # differently, so a write that isn't the next one in the trace is
+    # looked for in the next LOOKAHEAD records, and a read that the
+    # trace has no more of is answered with the last read of that
+    # length. Both are counted as mismatches.
+    log = Logger()
+
+    LOOKAHEAD = 64
+
+    def __init__(self, paths, realtime = False):
+        if isinstance(paths, str):
+            paths = tracePaths(paths)
+        self.records = list(readTrace(paths))
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._listeners = []
+        self._last_reads = {}
+        self._started = None
+        self._timers = []
+
+        self.writes = 0
+        self.reads = 0
+        self.edges = 0
+        self.mismatches = 0
+
+    @property
+    def finished(self):
+        return self._cursor >= len(self.records)
+
+    def progress(self):
+        return self._cursor, len(self.records)
+
+    def addInterruptListener(self, listener):
+        self._listeners.append(listener)
+
+    def removeInterruptListener(self, listener):
+        self._listeners.remove(listener)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        for timer in self._timers:
+            timer.cancel()
+
+    # smbus.SMBus
+
+    def write_byte(self, address, value):
+        self._write(value, b'')
+
+    def read_byte(self, address):
+        return self._read(1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._write(register, bytes((value & 0xff,)))
+
+    def read_byte_data(self, address, register):
+        return self._read(1)[0]
+
+    def write_word_data(self, address, register, value):
+        self._write(register, bytes((value & 0xff, (value >> 8) & 0xff)))
+
+    def read_word_data(self, address, register):
+        result = self._read(2)
+        return result[0] | result[1] << 8
+
+    def write_i2c_block_data(self, address, register, data):
+        self._write(register, bytes(data))
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._read(length)
+
+    def _write(self, register, data):
+        with self._lock:
+            self.writes += 1
+            edges = self._skipTo(self._cursor)
+            end = min(len(self.records), self._cursor + self.LOOKAHEAD)
+            for index in range(self._cursor, end):
+                kind, when, recorded_register, recorded = self.records[index]
+                if kind == WRITE and recorded_register == register and recorded == data:
+                    if any(record[0] != EDGE for record in self.records[self._cursor:index]):
+                        self.mismatches += 1
+                    edges += self._skipTo(index + 1)
+                    break
+            else:
+                self.mismatches += 1
+        self._fire(edges)
+
+    def _read(self, length):
+        with self._lock:
+            self.reads += 1
+            edges = self._skipTo(self._cursor)
+            if self._cursor < len(self.records):
+                kind, when, register, data = self.records[self._cursor]
+                if kind in (READ, READ_BLOCK) and len(data) == length:
+                    self._last_reads[length] = data
+                    edges += self._skipTo(self._cursor + 1)
+                    result = list(data)
+                else:
+                    result = self._stray(length)
+            else:
+                result = self._stray(length)
+        self._fire(edges)
+        return result
+
+    def _stray(self, length):
+        self.mismatches += 1
+        data = self._last_reads.get(length)
+        if data is None:
+            return [SI4707.CTSINT] + [0x00] * (length - 1)
+        return list(data)
+
+    def _skipTo(self, index):
+        # moves the cursor to index and past any edges there, returning
+        # the times of the edges that were passed
+        if self._started is None and self.records:
+            # the trace's clock against ours
+            self._started = time.perf_counter() - self.records[0][1]
+        edges = [record[1] for record in self.records[self._cursor:index] if record[0] == EDGE]
+        self._cursor = index
+        while self._cursor < len(self.records) and self.records[self._cursor][0] == EDGE:
+            edges.append(self.records[self._cursor][1])
+            self._cursor += 1
+        return edges
+
+    def _fire(self, edges):
+        if not edges:
+            return
+        now = time.perf_counter()
+        for when in edges:
+            delay = self._started + when - now
+            if self.realtime and delay > 0:
+                timer = threading.Timer(delay, self._edge)
+                self._timers.append(timer)
+                timer.start()
+            else:
+                self._edge()
+
+    def _edge(self):
+        self.edges += 1
+        for listener in list(self._listeners):
+            listener()
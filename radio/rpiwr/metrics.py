@@ -0,0 +1,163 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Fixed bucket histograms for the timings the daemon keeps, and their
+# rendering in the Prometheus text exposition format for the /metrics
+# page of the daemon's web server (see web.py).
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+import itertools
+
+class Histogram(object):
+    # Counts per bucket are kept as they are recorded and only made
+    # cumulative when they are read. Not thread safe, callers that
+    # record from more than one thread hold their own lock.
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds):
+        # bounds are the upper bounds of the buckets, in increasing order
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        return list(itertools.accumulate(self.counts))
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'buckets': dict(zip([str(bound) for bound in self.bounds] + ['+Inf'], self.cumulative()))}
+
+    def summary(self):
+        if self.count:
+            mean = self.sum / self.count
+        else:
+            mean = 0.0
+        return {'count': self.count,
+                'mean': mean,
+                'max': self.max}
+
+class CommandMetrics(object):
+    # Where the time of each radio command goes: waiting for the bus,
+    # talking on it, sleeping for the radio to finish, and getting the
+    # result back to the reactor thread. Recorded on the reactor thread
+    # only.
+
+    PHASES = ('lock_wait', 'bus_io', 'sleep', 'dispatch')
+
+    # upper bounds, in seconds, of the histogram buckets
+    BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+               0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, bounds = BUCKETS):
+        self.bounds = bounds
+        # command: histogram for each phase, in the order of PHASES
+        self.commands = {}
+        self.errors = collections.Counter()
+
+    def record(self, command, lock_wait, bus_io, sleep, dispatch):
+        phases = self.commands.get(command)
+        if phases is None:
+            phases = self.commands[command] = tuple(Histogram(self.bounds) for phase in self.PHASES)
+        phases[0].record(lock_wait)
+        phases[1].record(bus_io)
+        phases[2].record(sleep)
+        phases[3].record(dispatch)
+
+    def error(self, command):
+        self.errors[command] += 1
+
+    def statistics(self):
+        return {command: dict(zip(self.PHASES, [histogram.snapshot() for histogram in phases]),
+                              errors = self.errors[command])
+                for command, phases in self.commands.items()}
+
+    def summary(self):
+        commands = set(self.commands) | set(self.errors)
+        summary = {}
+        for command in commands:
+            phases = self.commands.get(command, ())
+            summary[command] = dict(zip(self.PHASES, [histogram.summary() for histogram in phases]),
+                                    errors = self.errors[command])
+        return summary
+
+class PrometheusText(object):
+    # Builds a page in the Prometheus text exposition format. Samples of
+    # a metric family can be added more than once, by each receiver with
+    # its own labels, and the family is written out once.
+
+    CONTENT_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix = 'rpiwr_'):
+        self.prefix = prefix
+        # name: (type, help, lines)
+        self.families = collections.OrderedDict()
+
+    def counter(self, name, help, samples):
+        lines = self._family(name, 'counter', help)
+        for labels, value in samples:
+            lines.append(self._sample(name, labels, value))
+
+    def gauge(self, name, help, samples):
+        lines = self._family(name, 'gauge', help)
+        for labels, value in samples:
+            lines.append(self._sample(name, labels, value))
+
+    def histogram(self, name, help, samples):
+        # samples are (labels, Histogram)
+        lines = self._family(name, 'histogram', help)
+        for labels, histogram in samples:
+            for bound, count in zip([repr(float(bound)) for bound in histogram.bounds] + ['+Inf'],
+                                    histogram.cumulative()):
+                lines.append(self._sample(name + '_bucket', labels + (('le', bound),), count))
+            lines.append(self._sample(name + '_sum', labels, histogram.sum))
+            lines.append(self._sample(name + '_count', labels, histogram.count))
+
+    def text(self):
+        lines = []
+        for name, (kind, help, samples) in self.families.items():
+            lines.append('# HELP {}{} {}'.format(self.prefix, name, help))
+            lines.append('# TYPE {}{} {}'.format(self.prefix, name, kind))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def _family(self, name, kind, help):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = (kind, help, [])
+        return family[2]
+
+    def _sample(self, name, labels, value):
+        if labels:
+            labels = '{' + ','.join('{}="{}"'.format(label, self._escape(text)) for label, text in labels) + '}'
+        else:
+            labels = ''
+        return '{}{}{} {}'.format(self.prefix, name, labels, value)
+
+    def _escape(self, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,280 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Holds MQTT messages while the broker can't be reached. Telemetry is
+# kept in a small ring in memory, where a newer value for a topic
+# replaces the one waiting to be sent. Alerts are appended to a memory
+# mapped file so that they survive a restart, and each one stays there
+# until the broker has acknowledged it.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import mmap
+import os
+import struct
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+
+class DiskQueue(object):
+    # A fixed size file laid out as a header, holding the offsets of the
+    # first and one past the last record, followed by the records. New
+    # records go on the end. When the end of the file is reached the
+    # waiting records are moved back to the start, and if there still
+    # isn't room the oldest are dropped.
+
+    MAGIC = b'RWOB'
+    HEADER = struct.Struct('<4sII')
+    # record length (after this struct), qos, retain, topic length
+    RECORD = struct.Struct('<IBBH')
+
+    def __init__(self, path, size = 1 << 20):
+        self.path = path
+        self.size = size
+        self.dropped = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, self.head, self.tail = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or not self.HEADER.size <= self.head <= self.tail <= size:
+            self.head = self.tail = self.HEADER.size
+            self._writeHeader()
+        self.count = 0
+        offset = self.head
+        while offset < self.tail:
+            offset += self.RECORD.size + self.RECORD.unpack_from(self._map, offset)[0]
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def used(self):
+        return self.tail - self.head
+
+    def append(self, topic, message, qos, retain):
+        topic = topic.encode('utf-8')
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        length = self.RECORD.size + len(topic) + len(message)
+        if length > self.size - self.HEADER.size:
+            raise ValueError('message of {} bytes does not fit in the outbox'.format(length))
+
+        if self.tail + length > self.size:
+            self._compact()
+            while self.tail + length > self.size:
+                self.pop()
+                self.dropped += 1
+                self._compact()
+
+        offset = self.tail
+        self.RECORD.pack_into(self._map, offset, len(topic) + len(message), qos, retain, len(topic))
+        offset += self.RECORD.size
+        self._map[offset:offset + len(topic)] = topic
+        offset += len(topic)
+        self._map[offset:offset + len(message)] = message
+        # the record has to be on disk before the header points past it
+        self._sync(self.tail, offset + len(message))
+        self.tail = offset + len(message)
+        self.count += 1
+        self._writeHeader()
+
+    def peek(self):
+        # (topic, message, qos, retain) of the oldest record
+        if self.head == self.tail:
+            return None
+        length, qos, retain, topic_length = self.RECORD.unpack_from(self._map, self.head)
+        offset = self.head + self.RECORD.size
+        topic = self._map[offset:offset + topic_length].decode('utf-8')
+        message = bytearray(self._map[offset + topic_length:offset + length])
+        return topic, message, qos, bool(retain)
+
+    def pop(self):
+        if self.head == self.tail:
+            return
+        length = self.RECORD.unpack_from(self._map, self.head)[0]
+        self.head += self.RECORD.size + length
+        self.count -= 1
+        if self.head == self.tail:
+            self.head = self.tail = self.HEADER.size
+        self._writeHeader()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+    def _compact(self):
+        if self.head == self.HEADER.size:
+            return
+        used = self.tail - self.head
+        self._map.move(self.HEADER.size, self.head, used)
+        self._sync(self.HEADER.size, self.HEADER.size + used)
+        self.head = self.HEADER.size
+        self.tail = self.head + used
+        self._writeHeader()
+
+    def _writeHeader(self):
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self.head, self.tail)
+        self._sync(0, self.HEADER.size)
+
+    def _sync(self, start, end):
+        # msync wants a page aligned start
+        start -= start % mmap.PAGESIZE
+        self._map.flush(start, end - start)
+
+class Outbox(object):
+    log = Logger()
+
+    def __init__(self, disk = None, memory_size = 256, rate = 20.0, clock = reactor):
+        # without a disk queue the alerts are held in memory too
+        self.disk = disk
+        self.memory_size = memory_size
+        self.rate = rate
+        self.clock = clock
+        self.mqtt = None
+
+        # topic: (message, qos, retain), oldest first
+        self._ring = collections.OrderedDict()
+        self._alerts = collections.deque(maxlen = memory_size)
+        self._drain = None
+        self._inflight = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def publish(self, topic, message, qos = 0, retain = False, durable = False):
+        if durable:
+            if self.disk is not None:
+                self.disk.append(topic, message, qos, retain)
+            else:
+                if len(self._alerts) == self._alerts.maxlen:
+                    self.dropped += 1
+                self._alerts.append((topic, message, qos, retain))
+            self._schedule(0)
+            return
+
+        if self.mqtt is not None and not self._ring:
+            self._send(topic, message, qos, retain)
+            return
+
+        if topic in self._ring:
+            # only the newest value of a topic is worth sending
+            del self._ring[topic]
+            self.coalesced += 1
+        self._ring[topic] = (message, qos, retain)
+        if len(self._ring) > self.memory_size:
+            self._ring.popitem(last = False)
+            self.dropped += 1
+        self._schedule(0)
+
+    def connected(self, mqtt):
+        self.mqtt = mqtt
+        self._inflight = False
+        self._schedule(0)
+
+    def disconnected(self):
+        # an alert that wasn't acknowledged is still at the front of the
+        # queue and is sent again on the next connection
+        self.mqtt = None
+        self._inflight = False
+        if self._drain is not None and self._drain.active():
+            self._drain.cancel()
+        self._drain = None
+
+    def pending(self):
+        return len(self._ring) + self.pendingAlerts()
+
+    def pendingAlerts(self):
+        if self.disk is not None:
+            return len(self.disk)
+        return len(self._alerts)
+
+    def statistics(self):
+        statistics = {'telemetry': len(self._ring),
+                      'alerts': self.pendingAlerts(),
+                      'sent': self.sent,
+                      'coalesced': self.coalesced,
+                      'dropped': self.dropped}
+        if self.disk is not None:
+            statistics['disk_bytes'] = self.disk.used()
+            statistics['disk_dropped'] = self.disk.dropped
+        return statistics
+
+    def _schedule(self, delay):
+        if self.mqtt is None or self._drain is not None:
+            return
+        self._drain = self.clock.callLater(delay, self._drainOne)
+
+    def _drainOne(self):
+        # one message per call, at no more than rate messages a second;
+        # alerts go first and one at a time so that they stay in order
+        self._drain = None
+        if self.mqtt is None or self._inflight:
+            return
+
+        alert = self._peekAlert()
+        if alert is not None:
+            self._inflight = True
+            topic, message, qos, retain = alert
+            d = self._send(topic, message, qos, retain)
+            d.addCallbacks(self._alertSent, self._alertFailed,
+                           callbackArgs = (self.mqtt,), errbackArgs = (self.mqtt,))
+        elif self._ring:
+            topic, (message, qos, retain) = self._ring.popitem(last = False)
+            self._send(topic, message, qos, retain)
+
+        if self._ring:
+            self._schedule(1.0 / self.rate)
+
+    def _peekAlert(self):
+        if self.disk is not None:
+            return self.disk.peek()
+        if self._alerts:
+            return self._alerts[0]
+        return None
+
+    def _alertSent(self, result, mqtt):
+        if mqtt is not self.mqtt:
+            return
+        self._inflight = False
+        if self.disk is not None:
+            self.disk.pop()
+        else:
+            self._alerts.popleft()
+        if self.pendingAlerts() or self._ring:
+            self._schedule(1.0 / self.rate)
+
+    def _alertFailed(self, failure, mqtt):
+        self.log.failure('Publishing alert failed', failure)
+        if mqtt is self.mqtt:
+            self._inflight = False
+            self._schedule(1.0)
+
+    def _send(self, topic, message, qos, retain):
+        self.sent += 1
+        d = self.mqtt.publish(topic = topic, message = message, qos = qos, retain = retain)
+        if qos == 0:
+            d.addErrback(self._sendFailed, topic)
+        return d
+
+    def _sendFailed(self, failure, topic):
+        self.log.failure('Publishing to {topic:} failed', failure, topic = topic)
@@ -0,0 +1,556 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Decoding of Specific Area Message Encoding (SAME) headers as they are
+# read from the Si4707, in the form
+#
+#   ZCZC-ORG-EEE-PSSCCC-PSSCCC+TTTT-JJJHHMM-LLLLLLLL-
+#
+# See 47 CFR 11.31 and NWS Directive 10-1712 for the details.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import calendar
+import collections
+import os
+import time
+
+ORIGINATORS = (('EAS', 'Broadcast station or cable system'),
+               ('CIV', 'Civil authorities'),
+               ('WXR', 'National Weather Service'),
+               ('PEP', 'Primary Entry Point System'),
+               ('EAN', 'Emergency Action Notification Network'))
+
+EVENTS = (('ADR', 'Administrative Message'),
+          ('AVA', 'Avalanche Watch'),
+          ('AVW', 'Avalanche Warning'),
+          ('BLU', 'Blue Alert'),
+          ('BZW', 'Blizzard Warning'),
+          ('CAE', 'Child Abduction Emergency'),
+          ('CDW', 'Civil Danger Warning'),
+          ('CEM', 'Civil Emergency Message'),
+          ('CFA', 'Coastal Flood Watch'),
+          ('CFW', 'Coastal Flood Warning'),
+          ('DMO', 'Practice/Demo Warning'),
+          ('DSW', 'Dust Storm Warning'),
+          ('EAN', 'Emergency Action Notification'),
+          ('EAT', 'Emergency Action Termination'),
+          ('EQW', 'Earthquake Warning'),
+          ('EVI', 'Evacuation Immediate'),
+          ('EWW', 'Extreme Wind Warning'),
+          ('FFA', 'Flash Flood Watch'),
+          ('FFS', 'Flash Flood Statement'),
+          ('FFW', 'Flash Flood Warning'),
+          ('FLA', 'Flood Watch'),
+          ('FLS', 'Flood Statement'),
+          ('FLW', 'Flood Warning'),
+          ('FRW', 'Fire Warning'),
+          ('FSW', 'Flash Freeze Warning'),
+          ('FZW', 'Freeze Warning'),
+          ('HLS', 'Hurricane Local Statement'),
+          ('HMW', 'Hazardous Materials Warning'),
+          ('HUA', 'Hurricane Watch'),
+          ('HUW', 'Hurricane Warning'),
+          ('HWA', 'High Wind Watch'),
+          ('HWW', 'High Wind Warning'),
+          ('LAE', 'Local Area Emergency'),
+          ('LEW', 'Law Enforcement Warning'),
+          ('NAT', 'National Audible Test'),
+          ('NIC', 'National Information Center'),
+          ('NMN', 'Network Message Notification'),
+          ('NPT', 'National Periodic Test'),
+          ('NST', 'National Silent Test'),
+          ('NUW', 'Nuclear Power Plant Warning'),
+          ('RHW', 'Radiological Hazard Warning'),
+          ('RMT', 'Required Monthly Test'),
+          ('RWT', 'Required Weekly Test'),
+          ('SMW', 'Special Marine Warning'),
+          ('SPS', 'Special Weather Statement'),
+          ('SPW', 'Shelter in Place Warning'),
+          ('SQW', 'Snow Squall Warning'),
+          ('SSA', 'Storm Surge Watch'),
+          ('SSW', 'Storm Surge Warning'),
+          ('SVA', 'Severe Thunderstorm Watch'),
+          ('SVR', 'Severe Thunderstorm Warning'),
+          ('SVS', 'Severe Weather Statement'),
+          ('TOA', 'Tornado Watch'),
+          ('TOE', '911 Telephone Outage Emergency'),
+          ('TOR', 'Tornado Warning'),
+          ('TRA', 'Tropical Storm Watch'),
+          ('TRW', 'Tropical Storm Warning'),
+          ('TSA', 'Tsunami Watch'),
+          ('TSW', 'Tsunami Warning'),
+          ('VOW', 'Volcano Warning'),
+          ('WSA', 'Winter Storm Watch'),
+          ('WSW', 'Winter Storm Warning'))
+
+STATES = (('00', None),
+          ('01', 'AL'), ('02', 'AK'), ('04', 'AZ'), ('05', 'AR'), ('06', 'CA'),
+          ('08', 'CO'), ('09', 'CT'), ('10', 'DE'), ('11', 'DC'), ('12', 'FL'),
+          ('13', 'GA'), ('15', 'HI'), ('16', 'ID'), ('17', 'IL'), ('18', 'IN'),
+          ('19', 'IA'), ('20', 'KS'), ('21', 'KY'), ('22', 'LA'), ('23', 'ME'),
+          ('24', 'MD'), ('25', 'MA'), ('26', 'MI'), ('27', 'MN'), ('28', 'MS'),
+          ('29', 'MO'), ('30', 'MT'), ('31', 'NE'), ('32', 'NV'), ('33', 'NH'),
+          ('34', 'NJ'), ('35', 'NM'), ('36', 'NY'), ('37', 'NC'), ('38', 'ND'),
+          ('39', 'OH'), ('40', 'OK'), ('41', 'OR'), ('42', 'PA'), ('44', 'RI'),
+          ('45', 'SC'), ('46', 'SD'), ('47', 'TN'), ('48', 'TX'), ('49', 'UT'),
+          ('50', 'VT'), ('51', 'VA'), ('53', 'WA'), ('54', 'WV'), ('55', 'WI'),
+          ('56', 'WY'), ('60', 'AS'), ('66', 'GU'), ('69', 'MP'), ('72', 'PR'),
+          ('78', 'VI'))
+
+SUBDIVISIONS = ('All', 'Northwest', 'North', 'Northeast', 'West',
+                'Central', 'East', 'Southwest', 'South', 'Southeast')
+
+# County names aren't shipped with rpiwr. If this file exists it is read
+# the first time a county is looked up. It is expected to be in the
+# format of the Census Bureau's national_county.txt:
+#
+#   IA,19,153,Polk County,H1
+
+COUNTY_FILE = '/opt/rpiwr/etc/national_county.txt'
+
+class CodeTables(object):
+    # The lookup tables are built on first use so that importing this
+    # module stays cheap.
+
+    def __init__(self, county_file = COUNTY_FILE):
+        self.county_file = county_file
+        self._originators = None
+        self._events = None
+        self._states = None
+        self._counties = None
+
+    def setCountyFile(self, county_file):
+        # the counties are read again from the new file when next needed
+        self.county_file = county_file
+        self._counties = None
+
+    def originators(self):
+        if self._originators is None:
+            self._originators = dict(ORIGINATORS)
+        return self._originators
+
+    def events(self):
+        if self._events is None:
+            self._events = dict(EVENTS)
+        return self._events
+
+    def states(self):
+        if self._states is None:
+            self._states = dict(STATES)
+        return self._states
+
+    def counties(self):
+        if self._counties is None:
+            counties = {}
+            if self.county_file is not None and os.path.exists(self.county_file):
+                with open(self.county_file, 'r', encoding = 'latin-1') as f:
+                    for line in f:
+                        fields = line.rstrip('\r\n').split(',')
+                        if len(fields) < 4:
+                            continue
+                        counties[fields[1] + fields[2]] = fields[3]
+            self._counties = counties
+        return self._counties
+
+    def originator(self, code):
+        return self.originators().get(code)
+
+    def event(self, code):
+        return self.events().get(code)
+
+    def state(self, code):
+        return self.states().get(code[1:3])
+
+    def county(self, code):
+        return self.counties().get(code[1:])
+
+tables = CodeTables()
+
+class SAMEParseError(Exception):
+    pass
+
+class SAMEHeader(object):
+    def __init__(self):
+        self.originator = None
+        self.event = None
+        self.locations = []
+        self.purge = None           # (hours, minutes)
+        self.issued = None          # (day of year, hour, minute) UTC
+        self.station = None
+        self.raw = b''
+
+    def purgeMinutes(self):
+        hours, minutes = self.purge
+        return hours * 60 + minutes
+
+    def issuedTime(self, now):
+        # the header only carries the day of the year, so take the year
+        # that puts the issue time closest to now
+        day, hour, minute = self.issued
+        year = time.gmtime(now).tm_year
+        candidates = [calendar.timegm((y, 1, 1, hour, minute, 0)) + (day - 1) * 86400
+                      for y in (year - 1, year, year + 1)]
+        return min(candidates, key = lambda t: abs(t - now))
+
+    def expiresTime(self, now):
+        return self.issuedTime(now) + self.purgeMinutes() * 60
+
+    def key(self):
+        # identifies a header regardless of the order of its locations
+        return (self.originator, self.event, frozenset(self.locations),
+                self.purge, self.issued, self.station)
+
+    def asDict(self):
+        return {'originator': self.originator,
+                'originator_name': tables.originator(self.originator),
+                'event': self.event,
+                'event_name': tables.event(self.event),
+                'locations': [{'code': location,
+                               'subdivision': SUBDIVISIONS[int(location[0])],
+                               'state': tables.state(location),
+                               'county': tables.county(location)}
+                              for location in self.locations],
+                'purge_minutes': self.purgeMinutes(),
+                'issued': {'day': self.issued[0],
+                           'hour': self.issued[1],
+                           'minute': self.issued[2]},
+                'station': self.station,
+                'raw': self.raw.decode('ascii')}
+
+    def __repr__(self):
+        return '<SAMEHeader {}>'.format(self.raw.decode('ascii', 'replace'))
+
+# Character classes, indexed by byte value.
+
+def _charClass(chars):
+    table = bytearray(256)
+    for c in chars:
+        table[ord(c)] = 1
+    return bytes(table)
+
+_ALPHA = _charClass('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_DIGIT = _charClass('0123456789')
+_STATION = _charClass('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789/ ')
+
+_DASH = ord('-')
+_PLUS = ord('+')
+
+class SAMEParser(object):
+    # Consumes a header a few bytes at a time, as the pages are read from
+    # the radio. Each field is checked as soon as it is complete, and the
+    # first byte that can't be part of a valid header stops the parse so
+    # that the caller can stop reading.
+
+    PREFIX = b'ZCZC-'
+    MAX_LOCATIONS = 31
+
+    PREFIX_STATE = 0
+    ORIGINATOR = 1
+    EVENT = 2
+    LOCATION = 3
+    PURGE = 4
+    ISSUED = 5
+    STATION = 6
+    DONE = 7
+    FAILED = 8
+
+    # state: (field length, character class, {terminator: next state})
+    FIELDS = {ORIGINATOR: (3, _ALPHA, {_DASH: EVENT}),
+              EVENT: (3, _ALPHA, {_DASH: LOCATION}),
+              LOCATION: (6, _DIGIT, {_DASH: LOCATION, _PLUS: PURGE}),
+              PURGE: (4, _DIGIT, {_DASH: ISSUED}),
+              ISSUED: (7, _DIGIT, {_DASH: STATION}),
+              STATION: (8, _STATION, {_DASH: DONE})}
+
+    def __init__(self):
+        self.state = self.PREFIX_STATE
+        self.header = SAMEHeader()
+        self.error = None
+        self.failed_in = None
+        self._raw = bytearray()
+        self._field = bytearray()
+
+    @property
+    def done(self):
+        return self.state == self.DONE
+
+    @property
+    def failed(self):
+        return self.state == self.FAILED
+
+    def feed(self, data):
+        # returns False once the parse is over, successfully or not
+        for byte in data:
+            state = self.state
+            if state >= self.DONE:
+                return False
+            self._raw.append(byte)
+
+            if state == self.PREFIX_STATE:
+                if byte != self.PREFIX[len(self._raw) - 1]:
+                    self._fail('bad prefix {!r}'.format(bytes(self._raw)))
+                elif len(self._raw) == len(self.PREFIX):
+                    self.state = self.ORIGINATOR
+                continue
+
+            length, chars, terminators = self.FIELDS[state]
+            if len(self._field) < length:
+                if chars[byte]:
+                    self._field.append(byte)
+                else:
+                    self._fail('unexpected {!r} in field {}'.format(chr(byte), state))
+                continue
+
+            next_state = terminators.get(byte)
+            if next_state is None:
+                self._fail('unexpected {!r} after field {}'.format(chr(byte), state))
+                continue
+            self._complete(state, bytes(self._field).decode('ascii'))
+            self._field.clear()
+            if self.state != self.FAILED:
+                self.state = next_state
+                if next_state == self.DONE:
+                    self.header.raw = bytes(self._raw)
+
+        return self.state < self.DONE
+
+    def finish(self):
+        # called when the radio has no more data; a header whose last dash
+        # was lost is still complete
+        if self.state == self.STATION and len(self._field) == 8:
+            self._complete(self.STATION, bytes(self._field).decode('ascii'))
+            if self.state != self.FAILED:
+                self._raw.append(_DASH)
+                self.header.raw = bytes(self._raw)
+                self.state = self.DONE
+        elif self.state < self.DONE:
+            self._fail('header ended early')
+        return self.done
+
+    def _fail(self, reason):
+        self.failed_in = self.state
+        self.state = self.FAILED
+        self.error = reason
+
+    def _complete(self, state, text):
+        header = self.header
+        if state == self.ORIGINATOR:
+            if tables.originator(text) is None:
+                self._fail('unknown originator {}'.format(text))
+            header.originator = text
+
+        elif state == self.EVENT:
+            header.event = text
+
+        elif state == self.LOCATION:
+            if len(header.locations) >= self.MAX_LOCATIONS:
+                self._fail('too many locations')
+            header.locations.append(text)
+
+        elif state == self.PURGE:
+            hours, minutes = int(text[:2]), int(text[2:])
+            if minutes >= 60 or (hours == 0 and minutes % 15) or (hours > 0 and minutes % 30):
+                self._fail('bad purge time {}'.format(text))
+            header.purge = (hours, minutes)
+
+        elif state == self.ISSUED:
+            day, hour, minute = int(text[:3]), int(text[3:5]), int(text[5:])
+            if not (1 <= day <= 366) or hour > 23 or minute > 59:
+                self._fail('bad issue time {}'.format(text))
+            header.issued = (day, hour, minute)
+
+        elif state == self.STATION:
+            header.station = text
+
+def parse(data):
+    parser = SAMEParser()
+    parser.feed(data)
+    if not parser.done and not parser.finish():
+        raise SAMEParseError(parser.error)
+    return parser.header
+
+class SAMEVoter(object):
+    # SAME headers are sent three times in a row. The captures of one
+    # burst are lined up byte by byte and each byte is decided by a vote
+    # weighted by the confidence the radio reported for it, so that a
+    # bit error in one copy is outvoted by the others. A header is
+    # emitted once per burst: straight away if a single copy is received
+    # with every byte at or above the confidence threshold, otherwise
+    # after the second or third copy.
+
+    COPIES = 3
+
+    def __init__(self, threshold = 1, timeout = 6.0):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.emitted = None
+        self.corrected = 0
+        self.rejected = 0
+        self.reset()
+
+    def reset(self):
+        self._captures = []
+        self._last = None
+        self.emitted = None
+
+    def add(self, data, confidence, now, header = None):
+        # returns the header to act on, or None if this capture doesn't
+        # decide one (yet)
+        if self._last is not None and now - self._last > self.timeout:
+            self.reset()
+        self._last = now
+
+        data = bytes(data)
+        confidence = list(confidence[:len(data)])
+        clean = min(confidence, default = 0) >= self.threshold
+        if header is None and clean:
+            header = self._parse(data)
+
+        if self.emitted is not None:
+            # a cleanly received header that differs from the one already
+            # sent is the start of a new burst
+            if header is None or not clean or header.raw == self.emitted.raw:
+                return None
+            self.reset()
+            self._last = now
+
+        if len(self._captures) < self.COPIES:
+            self._captures.append((data, confidence))
+
+        if len(self._captures) == 1:
+            if clean and header is not None:
+                return self._emit(header)
+            return None
+
+        voted, weakest = self._vote()
+        header = self._parse(voted)
+        if header is None:
+            if len(self._captures) >= self.COPIES:
+                self.rejected += 1
+            return None
+        if len(self._captures) >= self.COPIES or weakest >= self.threshold:
+            if any(voted != data for data, confidence in self._captures):
+                self.corrected += 1
+            return self._emit(header)
+        return None
+
+    def _emit(self, header):
+        self.emitted = header
+        return header
+
+    def _parse(self, data):
+        parser = SAMEParser()
+        parser.feed(data)
+        if parser.done or parser.finish():
+            return parser.header
+        return None
+
+    def _vote(self):
+        # the length is voted on too, then each position goes to the byte
+        # with the most total confidence (plus one so that a confidence of
+        # zero still counts as a vote)
+        lengths = {}
+        for data, confidence in self._captures:
+            lengths[len(data)] = lengths.get(len(data), 0) + 1
+        length = max(lengths, key = lambda l: (lengths[l], l))
+
+        voted = bytearray(length)
+        weakest = 3
+        for i in range(length):
+            weights = {}
+            best = None
+            for data, confidence in self._captures:
+                if i >= len(data):
+                    continue
+                byte = data[i]
+                weight = weights.get(byte, 0) + confidence[i] + 1
+                weights[byte] = weight
+                if best is None or weight > weights[best]:
+                    best = byte
+            voted[i] = best
+            agreeing = sum(confidence[i] for data, confidence in self._captures
+                           if i < len(data) and data[i] == best)
+            weakest = min(weakest, agreeing)
+        return bytes(voted), weakest
+
+class AlertCache(object):
+    # Every header that has been acted on is remembered until it expires
+    # so that the copies of later re-broadcasts can be dropped. A header
+    # expires at its issue time plus its purge time, but is remembered for
+    # at least min_ttl seconds so that a header with a bad clock or an
+    # old issue time is still only acted on once. The least recently seen
+    # header is forgotten first when there are more than maxsize. A
+    # maxsize of zero turns de-duplication off.
+
+    def __init__(self, maxsize = 256, min_ttl = 900.0):
+        self.maxsize = maxsize
+        self.min_ttl = min_ttl
+        self.duplicates = 0
+        self.evicted = 0
+        self.expired = 0
+        # key: (header, expires, forget)
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, header, now):
+        # returns True if the header is new and should be acted on
+        if self.maxsize <= 0:
+            return True
+
+        key = header.key()
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > now:
+            self._entries.move_to_end(key)
+            self.duplicates += 1
+            return False
+
+        expires = header.expiresTime(now)
+        self._entries[key] = (header, expires, max(expires, now + self.min_ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+            self.evicted += 1
+        return True
+
+    def expire(self, now):
+        # forgets the headers that are past their time
+        stale = [key for key, (header, expires, forget) in self._entries.items() if forget <= now]
+        for key in stale:
+            del self._entries[key]
+        self.expired += len(stale)
+        return len(stale)
+
+    def active(self, now):
+        # the alerts that haven't reached their purge time, oldest first
+        return sorted(((header, expires) for header, expires, forget in self._entries.values() if expires > now),
+                      key = lambda entry: entry[1] - entry[0].purgeMinutes() * 60)
+
+    def snapshot(self, now):
+        alerts = []
+        for header, expires in self.active(now):
+            alert = header.asDict()
+            alert['expires'] = expires
+            alerts.append(alert)
+        return {'time': now,
+                'alerts': alerts}
+
+    def statistics(self):
+        return {'size': len(self._entries),
+                'duplicates': self.duplicates,
+                'evicted': self.evicted,
+                'expired': self.expired}
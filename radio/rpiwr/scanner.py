@@ -0,0 +1,125 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Tunes each of the seven NOAA weather channels in turn and measures
+# how well it is received, so that the radio can be put on the best
+# one. Each tune completes as soon as the radio reports seek/tune
+# complete rather than after a fixed delay.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet.defer import fail
+from twisted.internet.defer import succeed
+from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
+
+class ScanInProgress(Exception):
+    pass
+
+class ChannelScanner(object):
+    log = Logger()
+
+    def __init__(self, radio, dwell = 0.0, same_dwell = 0.0, clock = reactor):
+        # dwell is how long to let each channel settle before reading its
+        # signal quality, same_dwell how long to then listen for SAME
+        # activity on it
+        self.radio = radio
+        self.dwell = dwell
+        self.same_dwell = same_dwell
+        self.clock = clock
+
+        self.scanning = False
+        self.results = None
+        self.scans = 0
+        self.last_scan_time = None
+        self._current = None
+
+    def scan(self):
+        # the Deferred fires with a result per channel, best first
+        if self.scanning:
+            return fail(ScanInProgress('a channel scan is already running'))
+        self.scanning = True
+        self._start = time.perf_counter()
+        results = []
+        d = succeed(None)
+        for lowByte, name in zip(self.radio.freqLowByte, self.radio.freqNow):
+            d.addCallback(self._scanChannel, lowByte, name, results)
+        d.addBoth(self._scanFinished, results)
+        return d
+
+    def sameActivity(self, status):
+        # called with the SAME status seen while a channel is being
+        # listened to
+        if self._current is not None and status & (self.radio.PREDET | self.radio.SOMDET | self.radio.HDRRDY):
+            self._current['same'] = True
+
+    def _scanChannel(self, ignored, lowByte, name, results):
+        d = self.radio.scanTune(lowByte)
+        d.addCallback(self._tuned, name, results)
+        if self.dwell > 0:
+            d.addCallback(lambda result: deferLater(self.clock, self.dwell, lambda: result))
+        d.addCallback(self._measure)
+        if self.same_dwell > 0:
+            d.addCallback(lambda result: deferLater(self.clock, self.same_dwell, lambda: result))
+        d.addCallback(self._channelFinished)
+        return d
+
+    def _tuned(self, tune_status, name, results):
+        result = {'frequency': name,
+                  'channel': tune_status['channel'],
+                  'valid': tune_status['valid'],
+                  'rssi': tune_status['rssi'],
+                  'snr': tune_status['snr'],
+                  'frequency_offset': None,
+                  'same': False}
+        results.append(result)
+        self._current = result
+        return result
+
+    def _measure(self, result):
+        d = self.radio.getRSQStatus()
+        d.addCallback(self._measured, result)
+        return d
+
+    def _measured(self, rsq_status, result):
+        result['rssi'] = rsq_status['rssi']
+        result['snr'] = rsq_status['snr']
+        result['frequency_offset'] = rsq_status['frequency_offset']
+        return result
+
+    def _channelFinished(self, result):
+        self._current = None
+
+    def _scanFinished(self, outcome, results):
+        self.scanning = False
+        self._current = None
+        self.last_scan_time = time.perf_counter() - self._start
+        if isinstance(outcome, Failure):
+            return outcome
+        self.scans += 1
+        results.sort(key = self.rank, reverse = True)
+        self.results = results
+        self.log.info('Channel scan took {elapsed:.3f}s, best is {frequency:} MHz',
+                      elapsed = self.last_scan_time, frequency = results[0]['frequency'])
+        return results
+
+    def rank(self, result):
+        # a channel the radio calls valid beats one it doesn't, then one
+        # that was heard sending SAME, then the better SNR and RSSI
+        return (result['valid'], result['same'], result['snr'], result['rssi'])
@@ -0,0 +1,897 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# This code is based heavily on the sample code provided by AIW Industries at
+# https://github.com/AIWIndustries/Pi_4707/blob/master/firmware/SI4707_I2C_v2.py
+#
+# It's been heavily refactored for use with the Twisted framework as well as code
+# cleanups and additional functionality.
+
+# Copyright 2016 by Jeffrey C. Ollie
+# Copyright 2013 by Ray H. Dees
+# Copyright 2013 by AIW Industries, LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import threading
+import time
+
+from twisted.logger import Logger
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import succeed
+from twisted.internet.defer import gatherResults
+from twisted.internet import reactor
+
+from .i2c import Device
+from .busworker import BusWorker
+from .metrics import CommandMetrics
+from .same import SAMEParser
+
+# Runs the decorated method on the radio's bus worker thread. The worker
+# runs one command at a time in the order they were submitted so it also
+# serializes access to the radio.
+def locking(fn):
+    # the command is queued for the bus thread with the priority passed
+    # as the priority keyword, user control if there isn't one
+    @functools.wraps(fn)
+    def _wrap(self, *args, **kw):
+        priority = kw.pop('priority', BusWorker.USER)
+        return self._submit(priority, fn.__name__, fn, self, *args, **kw)
+
+    return _wrap
+
+class CommandTimeout(Exception):
+    pass
+
+class InterruptEvent(object):
+    # What one run of the interrupt service routine read from the radio.
+    # Each source is None unless its interrupt was pending.
+    __slots__ = ('status', 'tune', 'rsq', 'same', 'asq')
+
+    def __init__(self, status):
+        self.status = status
+        self.tune = None
+        self.rsq = None
+        self.same = None
+        self.asq = None
+
+class SI4707(object):
+    log = Logger()
+
+    ON =                                    0x01      #  Used for Power/Mute On.
+    OFF =                                   0x00      #  Used for Power/Mute Off.
+    CMD_DELAY =                            0.002      #  Inter-Command delay (>301 usec).
+    PROP_DELAY =                           0.010      #  Set Property Delay (>10.001 msec)
+    PUP_DELAY =                              0.2      #  Power Up Delay.  (110.001 msec)
+    TUNE_DELAY =                            0.25      #  Tune Delay. (250.001 msec)
+    CTS_TIMEOUT =                            1.0      #  Longest wait for CTS before giving up.
+    STC_TIMEOUT =                            1.0      #  Longest wait for STC after a tune.
+    POLL_MIN =                            0.0001      #  First CTS/STC poll backoff.
+    POLL_MAX =                             0.005      #  Largest CTS/STC poll backoff.
+    RADIO_ADDRESS =                         0x22 >> 1 #  I2C address of the Si4707 (w/SEN pin LOW)
+    RADIO_VOLUME =                          0x003F    #  Default Volume.
+
+    #  SAME Definitions.
+
+    SAME_CONFIDENCE_THRESHOLD =               1      #  Must be 1, 2 or 3, nothing else!
+    SAME_BUFFER_SIZE =                      255      #  The maximum number of receive bytes.
+    SAME_MIN_LENGTH =                        36      #  The SAME message minimum acceptable length.
+    SAME_LOCATION_CODES =                    30      #  Subtract 1, because we count from 0.
+    SAME_TIME_OUT =                           6      #  Time before buffers are flushed.
+
+    #  Program Control Status Bits.
+
+    INTAVL =                               0x10      #  A status interrupt is available.
+    MSGAVL =                               0x01      #  A SAME message is Available to be printed/parsed.
+    MSGPAR =                               0x02      #  The SAME message was successfully Parsed.
+    MSGUSD =                               0x04      #  When set, this SAME message has been used.
+    MSGPUR =                               0x08      #  The SAME message should be Purged (Third Header received).
+
+    #  Weather Band definitions.
+
+    WB_CHANNEL_SPACING =                0x0A         #  25 kHz.
+    WB_MIN_FREQUENCY =                  0xFDC0       #  162.400 mHz.
+    WB_MAX_FREQUENCY =                  0xFDFC       #  162.550 mHz.
+
+    #  Si4707 Command definitions.
+
+    POWER_UP =                          0x01       #  Powerup device.
+    GET_REV =                           0x10       #  Returns revision information on the device.
+    POWER_DOWN =                        0x11       #  Powerdown device.
+    SET_PROPERTY =                      0x12       #  Sets the value of a property.
+    GET_PROPERTY =                      0x13       #  Retrieves a propertys value.
+    GET_INT_STATUS =                    0x14       #  Read interrupt status bits.
+    PATCH_ARGS =                        0x15       #  Reserved command used for firmware file downloads.
+    PATCH_DATA =                        0x16       #  Reserved command used for firmware file downloads.
+    WB_TUNE_FREQ =                      0x50       #  Selects the WB tuning frequency.
+    WB_TUNE_STATUS =                    0x52       #  Queries the status of the previous WB_TUNE_FREQ command.
+    WB_RSQ_STATUS =                     0x53       #  Queries the status of the Received Signal Quality (RSQ) of the current channel.
+    WB_SAME_STATUS =                    0x54       #  Returns SAME information for the current channel.
+    WB_ASQ_STATUS =                     0x55       #  Queries the status of the 1050 Hz alert tone.
+    WB_AGC_STATUS =                     0x57       #  Queries the status of the AGC.
+    WB_AGC_OVERRIDE =                   0x58       #  Enable or disable the AGC.
+    GPIO_CTL =                          0x80       #  Configures GPO as output or Hi-Z.
+    GPIO_SET =                          0X81       #  Sets GPO output level (low or high).
+
+    #  Si4707 property definitions.
+
+    GPO_IEN     =                       0x0001      #  Enables GPO2 interrupt sources.
+    REFCLK_FREQ =                       0x0201      #  Sets frequency of reference clock in Hz.
+    REFCLK_PRESCALE =                   0x0202      #  Sets the prescaler value for RCLK input.
+    RX_VOLUME   =                       0x4000      #  Sets the output volume.
+    RX_HARD_MUTE =                      0x4001      #  Mutes the audio output.
+    WB_MAX_TUNE_ERROR =                 0x5108      #  Maximum change from the WB_TUNE_FREQ to which the AFC will lock.
+    WB_RSQ_INT_SOURCE =                 0x5200      #  Configures interrupts related to RSQ metrics.
+    WB_RSQ_SNR_HIGH_THRESHOLD =         0x5201      #  Sets high threshold for SNR interrupt.
+    WB_RSQ_SNR_LOW_THRESHOLD =          0x5202      #  Sets low threshold for SNR interrupt.
+    WB_RSQ_RSSI_HIGH_THRESHOLD =        0x5203      #  Sets high threshold for RSSI interrupt.
+    WB_RSQ_RSSI_LOW_THRESHOLD =         0x5204      #  Sets low threshold for RSSI interrupt.
+    WB_VALID_SNR_THRESHOLD =            0x5403      #  Sets SNR threshold to indicate a valid channel.
+    WB_VALID_RSSI_THRESHOLD =           0x5404      #  Sets RSSI threshold to indicate a valid channel.
+    WB_SAME_INTERRUPT_SOURCE =          0x5500      #  Configures SAME interrupt sources.
+    WB_ASQ_INT_SOURCE =                 0x5600      #  Configures 1050 Hz alert tone interrupts.
+
+    #  Si4707 power up command arguments.
+
+    WB =                                0x03      #  Function, 3 = WB receive.
+    QUERY =                             0x0F      #  Function, 15 = Query Library ID.
+    XOSCEN =                            0x10      #  Crystal Oscillator Enable.
+    PATCH =                             0x20      #  Patch Enable.
+    GPO2EN =                            0x40      #  GPO2 Output Enable.
+    CTSEN =                             0x80      #  CTS Interrupt Enable.
+
+    OPMODE =                            0x05      #  Application Setting, 5 = Analog L & R output.
+
+    RSSI_OFFSET =                       107       #  dBµV reported by the chip to dBm.
+
+    # Si4707 returned interrupt status bits.
+
+    STCINT =                        0x01      #  Seek/Tune Complete Interrupt.
+    ASQINT =                        0x02      #  1050 Hz Alert Tone Interrupt.
+    SAMEINT =                       0x04      #  SAME Interrupt.
+    RSQINT =                        0x08      #  Received Signal Quality Interrupt.
+    ERRINT =                        0x40      #  Error Interrupt.
+    CTSINT =                        0x80      #  Clear To Send Interrupt.
+
+    # Si4707 status register masks.
+
+    VALID =                         0x01      #  Valid Channel.
+    AFCRL =                         0x02      #  AFC Rail Indicator.
+
+    RSSILINT =                      0x01      #  RSSI was Detected Low.
+    RSSIHINT =                      0x02      #  RSSI was Detected High.
+    SNRLINT =                       0x04      #  SNR was Detected Low.
+    SNRHINT =                       0x08      #  SNR was Detected High.
+
+    HDRRDY =                        0x01      #  SAME Header Ready was detected.
+    PREDET =                        0x02      #  SAME Preamble was Detected.
+    SOMDET =                        0x04      #  SAME Start Of Message was Detected.
+    EOMDET =                        0x08      #  SAME End Of Message was Detected.
+
+    ALERTON =                       0x01      #  Alert Tone has not been detected on since last WB_TUNE_FREQ.
+    ALERTOF =                       0x02      #  Alert Tone has not been detected off since last WB_TUNE_FREQ.
+    ALERT =                         0x01      #  Alert Tone is currently present.
+
+    #  Si4707 interrupt acknowledge commands.
+
+    CHECK =                         0x00      #  Allows checking of status without clearing interrupt.
+    INTACK =                        0x01      #  If set, this bit clears the current interrupt.
+    CLRBUF =                        0x02      #  If set, the SAME buffer is cleared.
+
+    #  Si4707 sources for GPO2/INT Interrupt pin.
+
+    STCIEN =                        0x0001      #  Seek/Tune Complete Interrupt Enable.
+    ASQIEN =                        0x0002      #  ASQ Interrupt Enable.
+    SAMEIEN =                       0x0004      #  SAME Interrupt Enable.
+    RSQIEN =                        0x0008      #  RSQ Interrupt Enable.
+    ERRIEN =                        0x0040      #  Error Interrupt Enable.
+    CTSIEN =                        0x0080      #  CTS Interrupt Enable.
+    STCREP =                        0x0100      #  Repeat STCINT even if it is already set.
+    ASQREP =                        0x0200      #  Repeat ASQINT even if it is already set.
+    SAMEREP =                       0x0400      #  Repeat SAMEINT even if it is already set.
+    RSQREP =                        0x0800      #  Repeat RSQINT even if it is already set.
+
+    RSSILIEN =                      0x0001      #  RSSI detect Low Interrupt Enable.
+    RSSIHIEN =                      0x0002      #  RSSI detect High Interrupt Enable.
+    SNRLIEN =                       0x0004      #  SNR detect Low Interrupt Enable.
+    SNRHIEN =                       0x0008      #  SNR detect High Interrupt Enable.
+
+    HDRRDYIEN =                     0x0001      #  SAME Header Ready Interrupt Enable.
+    PREDETIEN =                     0x0002      #  SAME Preamble Detected Interrupt Enable.
+    SOMDETIEN =                     0x0004      #  SAME Start Of Message Detected Interrupt Enable.
+    EOMDETIEN =                     0x0008      #  SAME End Of Message Detected Interrupt Enable.
+
+    ALERTONIEN =                    0x0001      #  Sets 1050 Hz tone on as source of ASQ Interrupt.
+    ALERTOFIEN =                    0x0002      #  Sets 1050 Hz tone off as source of ASQ Interrupt.
+
+    #  Si4707 GPO control / set functions.
+
+    GPO1OEN =                       0x02      #  GPO1 output enable.
+    GPO2OEN =                       0x04      #  GPO2 output enable.  The use of GPO2 as an interrupt pin will override this.
+    GPO3OEN =                       0x08      #  GPO3 output enable.
+    GPO1LEVEL =                     0x02      #  Sets GPO1 High.
+    GPO2LEVEL =                     0x04      #  Sets GPO2 High.
+    GPO3LEVEL =                     0x08      #  Sets GPO3 High.
+
+
+    #  Command completion modes.
+
+    COMPLETION_CTS =                 'cts'      #  Poll the CTS (and STC) bits of the status byte.
+    COMPLETION_SLEEP =             'sleep'      #  Wait fixed intervals between commands.
+
+    COMMAND_NAMES = {POWER_UP: 'POWER_UP',
+                     GET_REV: 'GET_REV',
+                     POWER_DOWN: 'POWER_DOWN',
+                     SET_PROPERTY: 'SET_PROPERTY',
+                     GET_PROPERTY: 'GET_PROPERTY',
+                     GET_INT_STATUS: 'GET_INT_STATUS',
+                     PATCH_ARGS: 'PATCH_ARGS',
+                     PATCH_DATA: 'PATCH_DATA',
+                     WB_TUNE_FREQ: 'WB_TUNE_FREQ',
+                     WB_TUNE_STATUS: 'WB_TUNE_STATUS',
+                     WB_RSQ_STATUS: 'WB_RSQ_STATUS',
+                     WB_SAME_STATUS: 'WB_SAME_STATUS',
+                     WB_ASQ_STATUS: 'WB_ASQ_STATUS',
+                     WB_AGC_STATUS: 'WB_AGC_STATUS',
+                     WB_AGC_OVERRIDE: 'WB_AGC_OVERRIDE',
+                     GPIO_CTL: 'GPIO_CTL',
+                     GPIO_SET: 'GPIO_SET'}
+
+    #  Radio Variables.
+    freqHighByte = 0xFD
+    freqLowByte = [0xC0, 0xCA, 0xD4, 0xDE, 0xE8, 0xF2, 0xFC]
+    freqNow = ["162.400", "162.425","162.450", "162.475", "162.500", "162.525", "162.550"]
+
+    # Errata patch data from Silicon Labs for the Si4707
+    # used to help cure false alarm conditions
+    PATCH_COMMANDS = [(PATCH_ARGS, [0x00, 0x00, 0x04, 0xAE, 0x4D, 0x24, 0xBA]),
+                      (PATCH_DATA, [0x37, 0xB1, 0x23, 0xAC, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x58, 0xEB, 0x73, 0xC7, 0x0A]),
+                      (PATCH_DATA, [0xC1, 0x7D, 0xE9, 0x11, 0x6E, 0xA0, 0xDC]),
+                      (PATCH_DATA, [0xE4, 0x01, 0x2A, 0x5F, 0xA9, 0xA9, 0x43]),
+                      (PATCH_DATA, [0x34, 0x33, 0x1B, 0x1B, 0xC2, 0x44, 0x6E]),
+                      (PATCH_DATA, [0xC2, 0x16, 0xAB, 0xE2, 0x8C, 0x1E, 0x32]),
+                      (PATCH_DATA, [0x7F, 0x7E, 0x97, 0x59, 0xB3, 0x12, 0xE0]),
+                      (PATCH_DATA, [0x6B, 0xC1, 0xBC, 0xA6, 0xEC, 0x6A, 0x1C]),
+                      (PATCH_DATA, [0xB6, 0xFC, 0xD0, 0x89, 0xB8, 0x72, 0xA9]),
+                      (PATCH_DATA, [0x64, 0xC3, 0x84, 0x1A, 0x0B, 0x7C, 0x3C]),
+                      (PATCH_DATA, [0xCA, 0x3B, 0x16, 0x81, 0x0B, 0x81, 0xD7]),
+                      (PATCH_DATA, [0x84, 0x1C, 0xC7, 0x49, 0x0D, 0x30, 0x90]),
+                      (PATCH_DATA, [0x8E, 0x2C, 0x98, 0x01, 0xE9, 0x78, 0xAD]),
+                      (PATCH_DATA, [0x26, 0x76, 0xAF, 0x0B, 0x13, 0x77, 0xC1]),
+                      (PATCH_DATA, [0x1D, 0xF3, 0x61, 0x26, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x04, 0x31, 0x9A, 0x8E, 0xED]),
+                      (PATCH_DATA, [0xE5, 0x74, 0x60, 0xA0, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x04, 0x60, 0x2B, 0xAE, 0x2F]),
+                      (PATCH_DATA, [0xA9, 0xEA, 0x91, 0x98, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x24, 0xC8, 0x94, 0xC0, 0x30]),
+                      (PATCH_DATA, [0x8B, 0x67, 0xDD, 0x55, 0x06, 0x1E, 0x6F]),
+                      (PATCH_DATA, [0x50, 0xF0, 0xDE, 0xFF, 0x35, 0xF0, 0x17]),
+                      (PATCH_DATA, [0x9A, 0xB3, 0xA0, 0xFA, 0x6F, 0xB6, 0x19]),
+                      (PATCH_DATA, [0x7A, 0x2A, 0xA6, 0x26, 0x24, 0x27, 0xAD]),
+                      (PATCH_DATA, [0xA3, 0x9F, 0x1F, 0x62, 0x05, 0x22, 0x08]),
+                      (PATCH_DATA, [0x52, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x04, 0x76, 0x78, 0x0F, 0xE3]),
+                      (PATCH_DATA, [0x8E, 0xB1, 0x84, 0x6C, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x04, 0x1F, 0x72, 0xCA, 0xC6]),
+                      (PATCH_DATA, [0x73, 0x65, 0xC2, 0xD4, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x02, 0x69, 0x94, 0xD8, 0x6D]),
+                      (PATCH_DATA, [0xDA, 0xED, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x02, 0xCC, 0x2E, 0x52, 0x86]),
+                      (PATCH_DATA, [0x10, 0x36, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                      (PATCH_ARGS, [0x00, 0x00, 0x00, 0x00, 0x00, 0xD1, 0x95])]
+
+    def __init__(self, device = None, worker = None, completion = COMPLETION_CTS, wait_for_stc = True):
+        if completion not in (self.COMPLETION_CTS, self.COMPLETION_SLEEP):
+            raise ValueError('Unknown completion mode: {}'.format(completion))
+        self.completion = completion
+        self.wait_for_stc = wait_for_stc
+        # written on the bus thread, read from the reactor
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+        self._slept = 0.0
+        self.metrics = CommandMetrics()
+        self._properties = {}
+        self._properties_epoch = 0
+        if worker is None:
+            worker = BusWorker()
+        self._worker = worker
+        if device is None:
+            device = Device(self.RADIO_ADDRESS, 1)
+        self._device = device
+        self.power = self.OFF
+
+    def busStatistics(self):
+        statistics = self._worker.statistics()
+        statistics['completion'] = self.completionStatistics()
+        return statistics
+
+    def batch(self, calls, priority = BusWorker.USER):
+        # runs a list of (command method, args) back to back in one turn
+        # of the bus, the result is the list of their results
+        return self._submit(priority, 'batch', self._batch,
+                            [(method.__wrapped__, args) for method, args in calls])
+
+    def _batch(self, calls):
+        return [fn(self, *args) for fn, args in calls]
+
+    def hold(self, owner, priority, seconds):
+        self._worker.hold(owner, priority, seconds)
+
+    def release(self, owner):
+        self._worker.release(owner)
+
+    def _submit(self, priority, name, fn, *args, **kw):
+        # submitted, started and finished times, then the bus I/O and
+        # sleep time of the command, filled in on the bus thread
+        timing = [time.perf_counter(), None, None, 0.0, 0.0]
+
+        def _command():
+            device = self._device
+            io_time = device.io_time
+            slept = self._slept
+            timing[1] = time.perf_counter()
+            try:
+                return fn(*args, **kw)
+            finally:
+                timing[2] = time.perf_counter()
+                timing[3] = device.io_time - io_time
+                timing[4] = self._slept - slept
+
+        _command.__name__ = name
+        d = self._worker.submitWithPriority(priority, _command)
+        d.addCallbacks(self._commandFinished, self._commandFailed,
+                       callbackArgs = (name, timing), errbackArgs = (name, timing))
+        return d
+
+    def _commandFinished(self, result, name, timing):
+        submitted, started, finished, io_time, slept = timing
+        self.metrics.record(name, started - submitted, io_time, slept, time.perf_counter() - finished)
+        return result
+
+    def _commandFailed(self, failure, name, timing):
+        submitted, started, finished, io_time, slept = timing
+        if finished is not None:
+            self.metrics.record(name, started - submitted, io_time, slept, time.perf_counter() - finished)
+        self.metrics.error(name)
+        self.log.error('Error: {failure:}', failure = failure)
+        return failure
+
+    def _sleep(self, seconds):
+        start = time.perf_counter()
+        time.sleep(seconds)
+        self._slept += time.perf_counter() - start
+
+    def completionStatistics(self):
+        with self._latency_lock:
+            latency = {self.COMMAND_NAMES.get(command, command):
+                       {'count': count, 'mean': total / count, 'max': maximum}
+                       for command, (count, total, maximum) in self._latency.items()}
+        return {'mode': self.completion,
+                'latency': latency}
+
+    # The helpers below run on the bus thread. Each one waits for the
+    # command that was just written to complete, either by polling the
+    # status byte or by sleeping the fixed interval when the completion
+    # mode is COMPLETION_SLEEP, and records how long the wait took.
+
+    def _recordLatency(self, command, start):
+        elapsed = time.perf_counter() - start
+        with self._latency_lock:
+            count, total, maximum = self._latency.get(command, (0, 0.0, 0.0))
+            self._latency[command] = (count + 1, total + elapsed, max(maximum, elapsed))
+
+    def _poll(self, command, mask, timeout):
+        start = time.perf_counter()
+        deadline = start + timeout
+        backoff = self.POLL_MIN
+        while True:
+            status = self._device.readRaw8()
+            if status & mask == mask:
+                self._recordLatency(command, start)
+                return status
+            if time.perf_counter() > deadline:
+                raise CommandTimeout('{} timed out waiting for status 0x{:02X}, last status 0x{:02X}'.format(
+                    self.COMMAND_NAMES.get(command, command), mask, status))
+            self._sleep(backoff)
+            backoff = min(backoff * 2, self.POLL_MAX)
+
+    def _complete(self, command, delay, timeout = CTS_TIMEOUT):
+        if self.completion == self.COMPLETION_SLEEP:
+            start = time.perf_counter()
+            if delay:
+                self._sleep(delay)
+            self._recordLatency(command, start)
+            return
+        self._poll(command, self.CTSINT, timeout)
+
+    def _request(self, command, args, length, delay, timeout = CTS_TIMEOUT):
+        # sends a command and returns its response. When polling for CTS
+        # the first read follows the command in the same transfer, so a
+        # command that completes at once costs one transfer. The response
+        # may be a view of the device's buffer, only good until the next
+        # transfer.
+        if self.completion == self.COMPLETION_SLEEP:
+            self._device.writeList(command, args)
+            return self._response(command, length, delay, timeout)
+        start = time.perf_counter()
+        result = self._device.transfer(command, args, length)
+        if result[0] & self.CTSINT:
+            self._recordLatency(command, start)
+            return result
+        return self._response(command, length, delay, timeout, start)
+
+    def _response(self, command, length, delay, timeout = CTS_TIMEOUT, start = None):
+        if start is None:
+            start = time.perf_counter()
+        if self.completion == self.COMPLETION_SLEEP:
+            if delay:
+                self._sleep(delay)
+            result = self._device.readBlock(length)
+            self._recordLatency(command, start)
+            return result
+        # the response starts with the status byte so the response itself
+        # is polled until CTS shows that it is valid
+        deadline = start + timeout
+        backoff = self.POLL_MIN
+        while True:
+            result = self._device.readBlock(length)
+            if result[0] & self.CTSINT:
+                self._recordLatency(command, start)
+                return result
+            if time.perf_counter() > deadline:
+                raise CommandTimeout('{} timed out waiting for CTS, last status 0x{:02X}'.format(
+                    self.COMMAND_NAMES.get(command, command), result[0]))
+            self._sleep(backoff)
+            backoff = min(backoff * 2, self.POLL_MAX)
+
+    @locking
+    def on(self):
+        if self.power == self.ON:
+            return
+
+        reactor.callFromThread(self.log.debug, 'Sending power up in normal mode')
+        reactor.callFromThread(self.invalidateProperties)
+        self._device.writeList(self.POWER_UP, [(self.GPO2EN | self.XOSCEN | self.WB), self.OPMODE])
+        self.power = self.ON
+        self._complete(self.POWER_UP, 2.0) # was self.PUP_DELAY
+
+    @locking
+    def patch(self):
+        if self.power == self.ON:
+            return
+
+        reactor.callFromThread(self.log.debug, 'Sending power up in patch mode')
+        reactor.callFromThread(self.invalidateProperties)
+        self._device.writeList(self.POWER_UP, [(self.GPO2EN | self.PATCH | self.XOSCEN | self.WB), self.OPMODE])
+        self._complete(self.POWER_UP, self.PUP_DELAY)
+
+        reactor.callFromThread(self.log.debug, 'Starting patch')
+
+        for command, data in self.PATCH_COMMANDS:
+            self._device.writeList(command, data)
+            self._complete(command, 0.02)
+
+        reactor.callFromThread(self.log.debug, 'Patch finished')
+        self.power = self.ON
+        if self.completion == self.COMPLETION_SLEEP:
+            self._sleep(2.0)
+
+    @locking
+    def off(self):
+        if self.power == self.OFF:
+            return
+        self._device.write8(self.POWER_DOWN, 0x00)
+        self.power = self.OFF
+        reactor.callFromThread(self.invalidateProperties)
+        self._complete(self.POWER_DOWN, self.CMD_DELAY)
+
+    @locking
+    def getRevision(self):
+        result = self._request(self.GET_REV, [0x00], 9, self.CMD_DELAY)
+        return {'part_number': 'Si470{}'.format(result[1]),
+                'patch_id': '0x{:04x}'.format(result[4] << 8 | result[5]),
+                'firmware_revision': '0x{:02x}{:02x}'.format(result[2], result[3]),
+                'component_firmware_revision': '0x{:02x}{:02x}'.format(result[6], result[7]),
+                'chip_revision': '0x{:02x}'.format(result[8])}
+
+    @locking
+    def getTuneStatus(self, mode = CHECK):
+        result = self._request(self.WB_TUNE_STATUS, [mode], 6, self.CMD_DELAY)
+
+        channel = result[2] << 8 | result[3]
+        frequency = channel * 2500
+        rssi = result[4] - self.RSSI_OFFSET
+        snr = result[5]
+
+        return {'channel': channel,
+                'frequency': frequency,
+                'valid': bool(result[1] & self.VALID),
+                'rssi': rssi,
+                'snr': snr}
+
+    @locking
+    def getRSQStatus(self, mode = CHECK):
+        result = self._request(self.WB_RSQ_STATUS, [mode], 8, self.CMD_DELAY)
+
+        rsq_status = result[1]
+        rssi = result[4] - self.RSSI_OFFSET
+        snr = result[5]
+        frequency_offset = result[7]
+        if frequency_offset >= 128:
+            frequency_offset = frequency_offset - 256
+        frequency_offset = frequency_offset >> 1
+
+        return {'rsq_status': rsq_status,
+                'rssi': rssi,
+                'rssi_units': 'dBm',
+                'snr': snr,
+                'snr_unit': 'dBµV',
+                'frequency_offset': frequency_offset,
+                'frequency_offset_units': 'Hz'}
+
+    @locking
+    def getIntStatus(self):
+        result = self._request(self.GET_INT_STATUS, [0x00], 1, self.CMD_DELAY)
+        return result[0]
+
+    @locking
+    def serviceInterrupt(self):
+        # reads the interrupt status and then services and acknowledges
+        # every pending source without giving up the bus in between
+        event = InterruptEvent(self.getIntStatus.__wrapped__(self))
+
+        if event.status & self.STCINT:
+            event.tune = self.getTuneStatus.__wrapped__(self, self.INTACK)
+            # whatever was in the SAME buffer came from the old channel
+            self.sameFlush.__wrapped__(self)
+
+        if event.status & self.RSQINT:
+            event.rsq = self.getRSQStatus.__wrapped__(self, self.INTACK)
+
+        if event.status & self.SAMEINT:
+            event.same = self.getSameStatus.__wrapped__(self)
+            if event.same.status & self.EOMDET:
+                self.sameFlush.__wrapped__(self)
+
+        if event.status & self.ASQINT:
+            event.asq = self.getASQStatus.__wrapped__(self, self.INTACK)
+
+        return event
+
+    @locking
+    def getAGCStatus(self):
+        response = self._request(self.WB_AGC_STATUS, [0x00], 2, self.CMD_DELAY)
+        return response[1]
+
+    @locking
+    def setAGCStatus(self, setting):
+        self._device.write8(self.WB_AGC_OVERRIDE, setting)
+        self._complete(self.WB_AGC_OVERRIDE, self.CMD_DELAY)
+
+    @locking
+    def getASQStatus(self, mode = CHECK):
+        result = self._request(self.WB_ASQ_STATUS, [mode, 0x00], 3, self.CMD_DELAY)
+        return (result[1], result[2])
+
+    def setVolume(self, volume):
+        if volume > 0x003F:
+            volume = 0x003F
+
+        if volume < 0x0000:
+            volume = 0x0000
+
+        return self.setProperty(self.RX_VOLUME, volume)
+
+    def getVolume(self):
+        return self.getProperty(self.RX_VOLUME)
+
+    def volumeIncrease(self):
+        d = self.getVolume()
+        d.addCallback(self._volumeIncrease)
+
+    def _volumeIncrease(self, result):
+        self.setVolume(result + 1)
+
+    def volumeDecrease(self):
+        d = self.getVolume()
+        d.addCallback(self._volumeDecrease)
+
+    def _volumeDecrease(self, result):
+        self.setVolume(result - 1)
+
+    def setMute(self, value):
+        if value:
+            return self.setProperty(self.RX_HARD_MUTE, 0x0003)
+
+        else:
+            return self.setProperty(self.RX_HARD_MUTE, 0x0000)
+
+    def getMute(self):
+        response = Deferred()
+        d = self.getProperty(self.RX_HARD_MUTE)
+        d.addCallback(self._getMute, response)
+        return response
+
+    def _getMute(self, result, response):
+        if result == 0x0003:
+            response.callback(True)
+        elif result == 0x0000:
+            response.callback(False)
+        else:
+            response.callback(None)
+
+    # Every property value written to or read from the radio is kept in a
+    # shadow table so that reading it back doesn't need a bus round trip.
+    # The table is written through when the command is queued, so a read
+    # queued behind a write sees the new value. It is cleared whenever the
+    # radio loses its properties (reset, power down or patch).
+
+    def setProperty(self, prop, value):
+        self._properties[prop] = value
+        d = self.writeProperty(prop, value)
+        d.addErrback(self._setPropertyFailed, [(prop, value)])
+        return d
+
+    def setProperties(self, properties, priority = BusWorker.USER):
+        # write a list of (property, value) pairs in a single bus session
+        properties = list(properties)
+        self._properties.update(properties)
+        d = self.writeProperties(properties, priority = priority)
+        d.addErrback(self._setPropertyFailed, properties)
+        return d
+
+    def _setPropertyFailed(self, failure, properties):
+        for prop, value in properties:
+            if self._properties.get(prop) == value:
+                del self._properties[prop]
+        return failure
+
+    def getProperty(self, prop):
+        if prop in self._properties:
+            return succeed(self._properties[prop])
+        d = self.readProperty(prop)
+        d.addCallback(self._cacheProperty, prop, self._properties_epoch)
+        return d
+
+    def _cacheProperty(self, value, prop, epoch):
+        if epoch == self._properties_epoch:
+            self._properties.setdefault(prop, value)
+        return value
+
+    def cachedProperties(self):
+        return dict(self._properties)
+
+    def invalidateProperties(self):
+        self._properties_epoch += 1
+        self._properties.clear()
+
+    def auditProperties(self, priority = BusWorker.USER):
+        # re-read every cached property from the radio, returning the ones
+        # whose value has drifted from the shadow table as a dict of
+        # property: (cached, actual)
+        epoch = self._properties_epoch
+        expected = dict(self._properties)
+        props = sorted(expected)
+        d = gatherResults([self.readProperty(prop, priority = priority) for prop in props])
+        d.addCallback(self._auditProperties, props, expected, epoch)
+        return d
+
+    def _auditProperties(self, values, props, expected, epoch):
+        drift = {}
+        for prop, actual in zip(props, values):
+            if actual != expected[prop]:
+                drift[prop] = (expected[prop], actual)
+                self.log.warn('Property {prop:04X} drifted: cached {cached:04X}, radio {actual:04X}',
+                              prop = prop, cached = expected[prop], actual = actual)
+                if epoch == self._properties_epoch and self._properties.get(prop) == expected[prop]:
+                    self._properties[prop] = actual
+        return drift
+
+    @locking
+    def writeProperty(self, prop, value):
+        self._writeProperty(prop, value)
+
+    @locking
+    def writeProperties(self, properties):
+        for prop, value in properties:
+            self._writeProperty(prop, value)
+
+    def _writeProperty(self, prop, value):
+        pHi, pLo = divmod(prop, 0x100)
+        vHi, vLo = divmod(value, 0x100)
+        reactor.callFromThread(self.log.debug,
+                               'Set property {pHi:02X}{pLo:02X} = {vHi:02X}{vLo:02X}',
+                               pHi = pHi, pLo = pLo, vHi = vHi, vLo = vLo)
+        self._device.writeList(self.SET_PROPERTY, [0x00, pHi, pLo, vHi, vLo])
+        self._complete(self.SET_PROPERTY, 0.5)
+
+    @locking
+    def readProperty(self, prop):
+        pHi, pLo = divmod(prop, 0x100)
+        result = self._request(self.GET_PROPERTY, [0x00, pHi, pLo], 4, self.CMD_DELAY)
+        reactor.callFromThread(self.log.debug,
+                               'Get property {pHi:02X}{pLo:02X}: {result:}',
+                               pHi = pHi, pLo = pLo, result = list(result))
+        return result[2] << 8 | result[3]
+
+    @locking
+    def getSameStatus(self):
+        result = self._request(self.WB_SAME_STATUS, [self.INTACK, 0x00], 14, None)
+        reactor.callFromThread(self.log.debug, 'Same Status: {result:}', result = list(result))
+
+        msg = SAMEMessage(result[1], result[2], result[3])
+
+        if not(msg.status & self.HDRRDY):
+            reactor.callFromThread(self.log.debug, 'No SAME header ready!')
+            return msg
+
+        if msg.length < self.SAME_MIN_LENGTH:
+            reactor.callFromThread(self.log.debug, 'SAME message too short')
+            return msg
+
+        msg.addData(result)
+
+        for i in range(8, msg.length, 8):
+            result = self._request(self.WB_SAME_STATUS, [self.CHECK, i], 14, None)
+            msg.addData(result)
+
+            # no point reading the rest of something that confidently isn't
+            # a SAME header; any other error may be outvoted by the other
+            # copies of the header so the whole copy is needed
+            if (msg.parser.failed and msg.parser.failed_in == SAMEParser.PREFIX_STATE and
+                min(msg.confidence[:len(SAMEParser.PREFIX)]) >= self.SAME_CONFIDENCE_THRESHOLD):
+                reactor.callFromThread(self.log.debug, 'SAME header rejected: {error:}', error = msg.parser.error)
+                break
+
+        msg.finish()
+
+        self._device.writeList(self.WB_SAME_STATUS, [self.CLRBUF, 0x00])
+        self._complete(self.WB_SAME_STATUS, None)
+
+        return msg
+
+    @locking
+    def sameFlush(self):
+        reactor.callFromThread(self.log.debug, 'SAME flush!')
+        self._device.writeList(self.WB_SAME_STATUS, [self.CLRBUF | self.INTACK, 0x00])
+        self._complete(self.WB_SAME_STATUS, None)
+
+    #def tuneDirect(self, direct):
+    #    if (direct < 162400) or (direct > 162550):
+    #        return
+    #    channel = int(direct / 2.5)
+
+    @locking
+    def tune(self, lowByte):
+        self._device.writeList(self.WB_TUNE_FREQ, [0x00, self.freqHighByte, lowByte])
+        self._complete(self.WB_TUNE_FREQ, self.TUNE_DELAY)
+        if self.completion == self.COMPLETION_CTS and self.wait_for_stc:
+            # STCINT is left set for the interrupt handler to acknowledge
+            self._poll('WB_TUNE_FREQ_STC', self.STCINT, self.STC_TIMEOUT)
+
+    @locking
+    def scanTune(self, lowByte):
+        # tunes for a channel scan and returns the tune status. The tune
+        # is finished as soon as the STC bit is set, whatever the
+        # completion mode, and STC is acknowledged here so that the
+        # interrupt handler doesn't take the scan for a channel change.
+        self._device.writeList(self.WB_TUNE_FREQ, [0x00, self.freqHighByte, lowByte])
+        self._poll(self.WB_TUNE_FREQ, self.CTSINT, self.CTS_TIMEOUT)
+        self._poll('WB_TUNE_FREQ_STC', self.STCINT, self.STC_TIMEOUT)
+        result = self.getTuneStatus.__wrapped__(self, self.INTACK)
+        # anything in the SAME buffer came from the last channel
+        self.sameFlush.__wrapped__(self)
+        return result
+
+def _confidenceTable(shifts):
+    return tuple(bytes((conf >> shift) & 0x03 for shift in shifts) for conf in range(256))
+
+class SAMEMessage(object):
+    # A page only copies its data and its two packed CONF bytes; the
+    # confidence levels are unpacked, through a table, when they are first
+    # read, and the header parser is only made when there is a header to
+    # decode. Most SAME interrupts carry no header and never need either.
+    # The bytes are kept in lists: smbus hands the pages over as lists,
+    # and extending a list from one is cheaper than copying it into a
+    # bytearray.
+
+    #  SAME confidence level masks and bit shift positions.
+    SAME_STATUS_OUT_CONF0_BYTE =       5
+    SAME_STATUS_OUT_CONF1_BYTE =       5
+    SAME_STATUS_OUT_CONF2_BYTE =       5
+    SAME_STATUS_OUT_CONF3_BYTE =       5
+    SAME_STATUS_OUT_CONF4_BYTE =       4
+    SAME_STATUS_OUT_CONF5_BYTE =       4
+    SAME_STATUS_OUT_CONF6_BYTE =       4
+    SAME_STATUS_OUT_CONF7_BYTE =       4
+    SAME_STATUS_OUT_CONF0_SHFT =       0
+    SAME_STATUS_OUT_CONF1_SHFT =       2
+    SAME_STATUS_OUT_CONF2_SHFT =       4
+    SAME_STATUS_OUT_CONF3_SHFT =       6
+    SAME_STATUS_OUT_CONF4_SHFT =       0
+    SAME_STATUS_OUT_CONF5_SHFT =       2
+    SAME_STATUS_OUT_CONF6_SHFT =       4
+    SAME_STATUS_OUT_CONF7_SHFT =       6
+
+    SAME_STATUS_OUT_DATA =             6
+    PAGE_SIZE =                        8
+    BUFFER_SIZE = (SI4707.SAME_BUFFER_SIZE + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+    # The four 2-bit confidence levels packed into each CONF byte.
+    CONFIDENCE_TABLE = _confidenceTable((SAME_STATUS_OUT_CONF0_SHFT,
+                                         SAME_STATUS_OUT_CONF1_SHFT,
+                                         SAME_STATUS_OUT_CONF2_SHFT,
+                                         SAME_STATUS_OUT_CONF3_SHFT))
+
+    __slots__ = ('status', 'state', 'length', 'size', 'header', '_data', '_conf', '_confidence', '_parser')
+
+    def __init__(self, sameStatus, sameState, sameLength):
+        self.status = sameStatus
+        self.state = sameState
+        self.length = sameLength
+        self.size = 0
+        self.header = None
+
+        self._data = []
+        # the CONF4-7 and CONF0-3 bytes of each page, as read
+        self._conf = []
+        self._confidence = []
+        self._parser = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def confidence(self):
+        conf = self._conf
+        table = self.CONFIDENCE_TABLE
+        for i in range(len(self._confidence) // 4, len(conf), 2):
+            self._confidence.extend(table[conf[i + 1]])
+            self._confidence.extend(table[conf[i]])
+        return self._confidence
+
+    @property
+    def parser(self):
+        # the header is decoded page by page as it is read
+        if self._parser is None:
+            self._parser = SAMEParser()
+        return self._parser
+
+    def page(self, index):
+        start = index * self.PAGE_SIZE
+        return self._data[start:start + self.PAGE_SIZE]
+
+    def finish(self):
+        if self.parser.done or self.parser.finish():
+            self.header = self.parser.header
+        return self.header
+
+    def addData(self, result):
+        start = self.size
+        if start >= self.BUFFER_SIZE:
+            return
+        self.size = start + 8
+
+        self._data.extend(result[6:14])
+        self._conf.append(result[4])
+        self._conf.append(result[5])
+
+        remaining = self.length - start
+        if remaining > 0:
+            parser = self._parser
+            if parser is None:
+                parser = self._parser = SAMEParser()
+            parser.feed(self._data[start:start + min(remaining, 8)])
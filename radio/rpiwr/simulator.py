@@ -0,0 +1,534 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# A software model of the Si4707 weather band receiver and the GPIO lines
+# of the AIW Industries add-on board. The model sits behind i2c.Device in
+# place of smbus.SMBus so that the daemon can be run, exercised and
+# benchmarked on a machine without the radio hardware.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+import time
+
+from .si4707 import SI4707
+
+class SimulatedSI4707(object):
+    # Property values after a reset, taken from the Si4707 data sheet.
+    PROPERTY_DEFAULTS = {SI4707.GPO_IEN: 0x0000,
+                         SI4707.REFCLK_FREQ: 0x8000,
+                         SI4707.REFCLK_PRESCALE: 0x0001,
+                         SI4707.RX_VOLUME: 0x003F,
+                         SI4707.RX_HARD_MUTE: 0x0000,
+                         SI4707.WB_MAX_TUNE_ERROR: 0x000A,
+                         SI4707.WB_RSQ_INT_SOURCE: 0x0000,
+                         SI4707.WB_RSQ_SNR_HIGH_THRESHOLD: 0x007F,
+                         SI4707.WB_RSQ_SNR_LOW_THRESHOLD: 0x0000,
+                         SI4707.WB_RSQ_RSSI_HIGH_THRESHOLD: 0x007F,
+                         SI4707.WB_RSQ_RSSI_LOW_THRESHOLD: 0x0000,
+                         SI4707.WB_VALID_SNR_THRESHOLD: 0x0003,
+                         SI4707.WB_VALID_RSSI_THRESHOLD: 0x0014,
+                         SI4707.WB_SAME_INTERRUPT_SOURCE: 0x0000,
+                         SI4707.WB_ASQ_INT_SOURCE: 0x0000}
+
+    RSQ_PROPERTIES = (SI4707.WB_RSQ_INT_SOURCE,
+                      SI4707.WB_RSQ_SNR_HIGH_THRESHOLD,
+                      SI4707.WB_RSQ_SNR_LOW_THRESHOLD,
+                      SI4707.WB_RSQ_RSSI_HIGH_THRESHOLD,
+                      SI4707.WB_RSQ_RSSI_LOW_THRESHOLD)
+
+    # Signal conditions (rssi in dBµV, snr in dB, frequency offset) seen on
+    # each of the seven NOAA channels.
+    CHANNEL_SIGNALS = {0xFDC0: (12, 2, 0),
+                       0xFDCA: (18, 4, 1),
+                       0xFDD4: (25, 9, -2),
+                       0xFDDE: (10, 1, 0),
+                       0xFDE8: (30, 14, 3),
+                       0xFDF2: (16, 3, 0),
+                       0xFDFC: (45, 24, -1)}
+
+    PART_NUMBER = 7
+    FIRMWARE_REVISION = (0x32, 0x30)
+    COMPONENT_REVISION = (0x32, 0x30)
+    CHIP_REVISION = 0x42
+
+    INTERRUPT_MASK = (SI4707.STCINT | SI4707.ASQINT | SI4707.SAMEINT |
+                      SI4707.RSQINT | SI4707.ERRINT)
+
+    def __init__(self, tune_time = 0.0, command_time = 0.0):
+        # tune_time is how long after WB_TUNE_FREQ the STC interrupt is
+        # raised, command_time how long CTS stays low after a command
+        self.tune_time = tune_time
+        self.command_time = command_time
+
+        self._mutex = threading.RLock()
+        self._interrupt_listeners = []
+        self._same_script = collections.deque()
+        self.auto_advance = True
+
+        self.commands = collections.Counter()
+        self.edges = 0
+
+        self.reset()
+
+    def reset(self):
+        with self._mutex:
+            if getattr(self, '_stc_timer', None) is not None:
+                self._stc_timer.cancel()
+            self.powered = False
+            self.patch_mode = False
+            self.patched = False
+            self.patch_id = 0x0000
+            self.properties = dict(self.PROPERTY_DEFAULTS)
+            self.interrupts = 0
+            self.error = False
+            self.agc = 0x00
+            self.channel = 0x0000
+            self.rssi = 0
+            self.snr = 0
+            self.frequency_offset = 0
+            self.rsq_interrupts = 0
+            self.asq_interrupts = 0
+            self.alert_tone = False
+            self._response = [0x00]
+            self._busy_until = 0.0
+            self._stc_timer = None
+            self._clearSAME()
+
+    # Hooks for the virtual interrupt line.
+
+    def addInterruptListener(self, listener):
+        self._interrupt_listeners.append(listener)
+
+    def removeInterruptListener(self, listener):
+        self._interrupt_listeners.remove(listener)
+
+    def _raise(self, bits):
+        with self._mutex:
+            new = bits & ~self.interrupts
+            self.interrupts |= bits
+            enabled = self.properties[SI4707.GPO_IEN] & self.INTERRUPT_MASK
+            repeat = (self.properties[SI4707.GPO_IEN] >> 8) & self.INTERRUPT_MASK
+            fire = self.powered and ((new | (bits & repeat)) & enabled)
+        if fire:
+            self.edges += 1
+            for listener in list(self._interrupt_listeners):
+                listener()
+
+    # Scripted stimulus.
+
+    def setSignal(self, rssi, snr, frequency_offset = 0):
+        with self._mutex:
+            self.rssi = rssi
+            self.snr = snr
+            self.frequency_offset = frequency_offset
+            new = self._checkSignal()
+        if new:
+            self._raise(SI4707.RSQINT)
+
+    def setAlertTone(self, present):
+        with self._mutex:
+            if present == self.alert_tone:
+                return
+            self.alert_tone = present
+            if present:
+                bit = SI4707.ALERTON
+            else:
+                bit = SI4707.ALERTOF
+            fire = self.properties[SI4707.WB_ASQ_INT_SOURCE] & bit
+            self.asq_interrupts |= bit
+        if fire:
+            self._raise(SI4707.ASQINT)
+
+    def queueSAME(self, header, confidence = 3, repeats = 3, eom = True):
+        # queue the bursts that make up one broadcast: the header repeated
+        # (three times on air) followed by the end of message
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(confidence, int):
+            confidence = [confidence] * len(header)
+        with self._mutex:
+            for i in range(repeats):
+                self._same_script.append((bytes(header), list(confidence)))
+            if eom:
+                self._same_script.append(None)
+
+    def pendingSAME(self):
+        with self._mutex:
+            return len(self._same_script)
+
+    def deliverSAME(self):
+        # put the next scripted burst into the SAME buffer
+        with self._mutex:
+            if not self._same_script or not self.powered:
+                return False
+            burst = self._same_script.popleft()
+            if burst is None:
+                self._clearSAME()
+                self.same_status = SI4707.EOMDET
+            else:
+                header, confidence = burst
+                self.same_buffer = header
+                self.same_confidence = confidence
+                self.same_status = SI4707.PREDET | SI4707.SOMDET | SI4707.HDRRDY
+            source = self.properties[SI4707.WB_SAME_INTERRUPT_SOURCE]
+            fire = self.same_status & source
+        if fire:
+            self._raise(SI4707.SAMEINT)
+        return True
+
+    def _clearSAME(self):
+        self.same_status = 0
+        self.same_state = 0
+        self.same_buffer = b''
+        self.same_confidence = []
+
+    # SMBus interface used by i2c.Device.
+
+    def write_byte(self, address, value):
+        self._command(value, [])
+
+    def read_byte(self, address):
+        return self._read(1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._command(register, [value & 0xff])
+
+    def read_byte_data(self, address, register):
+        return self._read(1)[0]
+
+    def write_word_data(self, address, register, value):
+        self._command(register, [value & 0xff, (value >> 8) & 0xff])
+
+    def read_word_data(self, address, register):
+        result = self._read(2)
+        return result[0] | result[1] << 8
+
+    def write_i2c_block_data(self, address, register, data):
+        self._command(register, list(data))
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._read(length)
+
+    def close(self):
+        pass
+
+    # The chip itself.
+
+    def _checkSignal(self):
+        # compares the signal with the RSQ thresholds, returns the
+        # threshold interrupts that weren't already pending
+        bits = 0
+        if self.rssi < self.properties[SI4707.WB_RSQ_RSSI_LOW_THRESHOLD]:
+            bits |= SI4707.RSSILINT
+        if self.rssi > self.properties[SI4707.WB_RSQ_RSSI_HIGH_THRESHOLD]:
+            bits |= SI4707.RSSIHINT
+        if self.snr < self.properties[SI4707.WB_RSQ_SNR_LOW_THRESHOLD]:
+            bits |= SI4707.SNRLINT
+        if self.snr > self.properties[SI4707.WB_RSQ_SNR_HIGH_THRESHOLD]:
+            bits |= SI4707.SNRHINT
+        bits &= self.properties[SI4707.WB_RSQ_INT_SOURCE]
+        new = bits & ~self.rsq_interrupts
+        self.rsq_interrupts |= bits
+        return new
+
+    def _status(self):
+        status = self.interrupts & self.INTERRUPT_MASK
+        if self.error:
+            status |= SI4707.ERRINT
+        if time.monotonic() >= self._busy_until:
+            status |= SI4707.CTSINT
+        return status
+
+    def _read(self, length):
+        with self._mutex:
+            response = list(self._response[:length])
+            response[0] = self._status()
+        if len(response) < length:
+            response.extend([0x00] * (length - len(response)))
+        return response
+
+    def _command(self, command, args):
+        advance = False
+        signal = False
+        with self._mutex:
+            self.commands[command] += 1
+            self.error = False
+            self._busy_until = time.monotonic() + self.command_time
+            handler = self._handlers.get(command)
+            if handler is None or (not self.powered and command != SI4707.POWER_UP
+                                   and not (self.patch_mode and command in (SI4707.PATCH_ARGS,
+                                                                            SI4707.PATCH_DATA))):
+                self.error = True
+                self._response = [0x00]
+                return
+            self._response = [0x00] + handler(self, args)
+            if command == SI4707.WB_SAME_STATUS and args and args[0] & SI4707.CLRBUF:
+                advance = self.auto_advance
+            # the thresholds are watched all the time, so new ones can
+            # fire straight away
+            if command == SI4707.SET_PROPERTY and (args[1] << 8 | args[2]) in self.RSQ_PROPERTIES:
+                signal = self._checkSignal()
+        if advance:
+            self.deliverSAME()
+        if signal:
+            self._raise(SI4707.RSQINT)
+
+    def _powerUp(self, args):
+        function = args[0] & 0x0f
+        if function != SI4707.WB:
+            self.error = True
+            return []
+        if args[0] & SI4707.PATCH:
+            self.patch_mode = True
+            self.patched = False
+            self.patch_id = 0x0000
+        else:
+            self.powered = True
+        return []
+
+    def _patchArgs(self, args):
+        if not self.patch_mode:
+            self.error = True
+            return []
+        # the final PATCH_ARGS block carries the patch id
+        if args[:5] == [0x00] * 5:
+            self.patch_id = args[5] << 8 | args[6]
+            self.patched = True
+            self.patch_mode = False
+            self.powered = True
+        return []
+
+    def _patchData(self, args):
+        if not self.patch_mode:
+            self.error = True
+        return []
+
+    def _powerDown(self, args):
+        self.powered = False
+        self.patch_mode = False
+        if self._stc_timer is not None:
+            self._stc_timer.cancel()
+            self._stc_timer = None
+        return []
+
+    def _getRevision(self, args):
+        return [self.PART_NUMBER,
+                self.FIRMWARE_REVISION[0], self.FIRMWARE_REVISION[1],
+                self.patch_id >> 8, self.patch_id & 0xff,
+                self.COMPONENT_REVISION[0], self.COMPONENT_REVISION[1],
+                self.CHIP_REVISION]
+
+    def _setProperty(self, args):
+        prop = args[1] << 8 | args[2]
+        value = args[3] << 8 | args[4]
+        if prop not in self.properties:
+            self.error = True
+            return []
+        self.properties[prop] = value
+        return []
+
+    def _getProperty(self, args):
+        prop = args[1] << 8 | args[2]
+        if prop not in self.properties:
+            self.error = True
+            return []
+        value = self.properties[prop]
+        return [0x00, value >> 8, value & 0xff]
+
+    def _getIntStatus(self, args):
+        return []
+
+    def _tuneFreq(self, args):
+        channel = args[1] << 8 | args[2]
+        if channel < SI4707.WB_MIN_FREQUENCY or channel > SI4707.WB_MAX_FREQUENCY:
+            self.error = True
+            return []
+        self.channel = channel
+        self.rssi, self.snr, self.frequency_offset = self.CHANNEL_SIGNALS.get(channel, (0, 0, 0))
+        self.interrupts &= ~SI4707.STCINT
+        self._clearSAME()
+        if self._stc_timer is not None:
+            self._stc_timer.cancel()
+        if self.tune_time > 0:
+            self._stc_timer = threading.Timer(self.tune_time, self._raise, (SI4707.STCINT,))
+            self._stc_timer.daemon = True
+            self._stc_timer.start()
+        else:
+            self._stc_timer = None
+            # raised once the command has returned, outside of the mutex
+            threading.Thread(target = self._raise, args = (SI4707.STCINT,), daemon = True).start()
+        return []
+
+    def _valid(self):
+        flags = 0
+        if (self.rssi >= self.properties[SI4707.WB_VALID_RSSI_THRESHOLD] and
+            self.snr >= self.properties[SI4707.WB_VALID_SNR_THRESHOLD]):
+            flags |= SI4707.VALID
+        return flags
+
+    def _tuneStatus(self, args):
+        if args and args[0] & SI4707.INTACK:
+            self.interrupts &= ~SI4707.STCINT
+        return [self._valid(), self.channel >> 8, self.channel & 0xff,
+                self.rssi & 0xff, self.snr & 0xff]
+
+    def _rsqStatus(self, args):
+        flags = self.rsq_interrupts
+        if args and args[0] & SI4707.INTACK:
+            self.rsq_interrupts = 0
+            self.interrupts &= ~SI4707.RSQINT
+        return [flags, self._valid(), 0x00,
+                self.rssi & 0xff, self.snr & 0xff, 0x00,
+                (self.frequency_offset << 1) & 0xff]
+
+    def _sameStatus(self, args):
+        mode = args[0] if args else 0
+        address = args[1] if len(args) > 1 else 0
+        if mode & SI4707.INTACK:
+            self.interrupts &= ~SI4707.SAMEINT
+
+        page = self.same_buffer[address:address + 8]
+        page = list(page) + [0x00] * (8 - len(page))
+        confidence = self.same_confidence[address:address + 8]
+        confidence = list(confidence) + [0] * (8 - len(confidence))
+        conf_hi = (confidence[4] | confidence[5] << 2 |
+                   confidence[6] << 4 | confidence[7] << 6)
+        conf_lo = (confidence[0] | confidence[1] << 2 |
+                   confidence[2] << 4 | confidence[3] << 6)
+        response = [self.same_status, self.same_state,
+                    len(self.same_buffer), conf_hi, conf_lo] + page
+
+        if mode & SI4707.CLRBUF:
+            self._clearSAME()
+        return response
+
+    def _asqStatus(self, args):
+        flags = self.asq_interrupts
+        if args and args[0] & SI4707.INTACK:
+            self.asq_interrupts = 0
+            self.interrupts &= ~SI4707.ASQINT
+        return [flags, SI4707.ALERT if self.alert_tone else 0x00]
+
+    def _agcStatus(self, args):
+        return [self.agc]
+
+    def _agcOverride(self, args):
+        self.agc = args[0] & 0x01 if args else 0
+        return []
+
+    def _gpio(self, args):
+        return []
+
+    _handlers = {SI4707.POWER_UP: _powerUp,
+                 SI4707.GET_REV: _getRevision,
+                 SI4707.POWER_DOWN: _powerDown,
+                 SI4707.SET_PROPERTY: _setProperty,
+                 SI4707.GET_PROPERTY: _getProperty,
+                 SI4707.GET_INT_STATUS: _getIntStatus,
+                 SI4707.PATCH_ARGS: _patchArgs,
+                 SI4707.PATCH_DATA: _patchData,
+                 SI4707.WB_TUNE_FREQ: _tuneFreq,
+                 SI4707.WB_TUNE_STATUS: _tuneStatus,
+                 SI4707.WB_RSQ_STATUS: _rsqStatus,
+                 SI4707.WB_SAME_STATUS: _sameStatus,
+                 SI4707.WB_ASQ_STATUS: _asqStatus,
+                 SI4707.WB_AGC_STATUS: _agcStatus,
+                 SI4707.WB_AGC_OVERRIDE: _agcOverride,
+                 SI4707.GPIO_CTL: _gpio,
+                 SI4707.GPIO_SET: _gpio}
+
+class SimulatedGPIO(object):
+    # Stand-in for the RPi.GPIO module. The reset pin is wired to the
+    # simulated radio's reset and the interrupt pin to its interrupt line.
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    PUD_DOWN = 21
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    def __init__(self, radio, reset_pin, interrupt_pin):
+        self.radio = radio
+        self.reset_pin = reset_pin
+        self.interrupt_pin = interrupt_pin
+        self.levels = {}
+        self._listener = None
+        self._line_events = None
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down = None, initial = None):
+        if direction == self.OUT:
+            if initial is not None:
+                self.output(pin, initial)
+            else:
+                self.levels.setdefault(pin, self.LOW)
+
+    def output(self, pin, value):
+        if pin == self.reset_pin and value == self.LOW and self.levels.get(pin) != self.LOW:
+            self.radio.reset()
+        self.levels[pin] = value
+
+    def input(self, pin):
+        return self.levels.get(pin, self.HIGH)
+
+    def add_event_detect(self, pin, edge, callback = None, bouncetime = None):
+        if pin != self.interrupt_pin or callback is None:
+            return
+        self.remove_event_detect(pin)
+        self._listener = lambda: callback(pin)
+        self.radio.addInterruptListener(self._listener)
+
+    def remove_event_detect(self, pin):
+        if pin == self.interrupt_pin and self._listener is not None:
+            self.radio.removeInterruptListener(self._listener)
+            self._listener = None
+
+    def lineEvents(self, pin, callback):
+        # stands in for gpioevents.GPIOLineEvents, the simulated radio
+        # writes its interrupt edges into a pipe
+        from .gpioevents import PipeEdges
+        self.removeLineEvents()
+        self._line_events = PipeEdges(callback)
+        self.radio.addInterruptListener(self._line_events.trigger)
+        return self._line_events
+
+    def removeLineEvents(self):
+        if self._line_events is not None:
+            self.radio.removeInterruptListener(self._line_events.trigger)
+            self._line_events = None
+
+    def cleanup(self, channels = None):
+        if channels is None:
+            channels = list(self.levels) + [self.interrupt_pin]
+        elif isinstance(channels, int):
+            channels = [channels]
+        for pin in channels:
+            if pin == self.interrupt_pin:
+                self.remove_event_detect(pin)
+                self.removeLineEvents()
+            self.levels.pop(pin, None)
@@ -0,0 +1,187 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Keeps the daemon connected to the MQTT broker. The connection uses a
+# client id of its own and a persistent session, dead connections are
+# found with the MQTT keepalive, and every lost or failed connection is
+# retried after an exponentially growing, jittered delay.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from zope.interface import implementer
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+from twisted.internet import endpoints
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+
+from mqtt.client.factory import MQTTFactory
+from mqtt import v311
+
+@implementer(IOpenSSLClientConnectionCreator)
+class SessionReusingTLS(object):
+    # Offers the TLS session of the last connection to the broker so
+    # that a reconnect can skip the full handshake.
+
+    def __init__(self, hostname):
+        # pulls in pyOpenSSL, which is slow to import, so only when TLS is used
+        from twisted.internet import ssl
+        self.options = ssl.optionsForClientTLS(hostname)
+        self.session = None
+        self.handshakes = 0
+        self.resumed = 0
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = self.options.clientConnectionForTLS(tlsProtocol)
+        if self.session is not None:
+            connection.set_session(self.session)
+        return connection
+
+    def remember(self, connection):
+        # called once the connection is up
+        self.handshakes += 1
+        if connection.session_reused():
+            self.resumed += 1
+        self.session = connection.get_session()
+
+class MQTTSupervisor(object):
+    log = Logger()
+
+    def __init__(self, hostname, port, client_id, tls = False, keepalive = 60,
+                 initial_delay = 1.0, max_delay = 300.0, factor = 2.0, clock = reactor):
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.clock = clock
+
+        endpoint = endpoints.HostnameEndpoint(reactor, hostname, port)
+        if tls:
+            self.tls = SessionReusingTLS(hostname)
+            endpoint = endpoints.wrapClientTLS(self.tls, endpoint)
+        else:
+            self.tls = None
+        self.endpoint = endpoint
+        self.factory = MQTTFactory(profile = MQTTFactory.PUBLISHER | MQTTFactory.SUBSCRIBER)
+
+        # called with (protocol, session present) and (reason)
+        self.connected = None
+        self.disconnected = None
+
+        self.mqtt = None
+        self._protocol = None
+        self._retry = None
+        self._attempt = 0
+        self._lost_at = None
+        self._stopping = False
+
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.last_reconnect_time = None
+        self.max_reconnect_time = None
+
+    def start(self):
+        self._stopping = False
+        self._connect()
+
+    def stop(self):
+        self._stopping = True
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        self._retry = None
+        if self.mqtt is not None:
+            self.mqtt.disconnect()
+
+    def statistics(self):
+        statistics = {'connected': self.mqtt is not None,
+                      'connects': self.connects,
+                      'reconnects': self.reconnects,
+                      'failed_attempts': self.failed_attempts,
+                      'last_reconnect_time': self.last_reconnect_time,
+                      'max_reconnect_time': self.max_reconnect_time}
+        if self.tls is not None:
+            statistics['tls_handshakes'] = self.tls.handshakes
+            statistics['tls_resumed'] = self.tls.resumed
+        return statistics
+
+    def nextDelay(self):
+        # half of the delay is fixed and half random so that radios that
+        # lost the same broker don't all come back at the same moment
+        delay = min(self.max_delay, self.initial_delay * self.factor ** self._attempt)
+        self._attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _connect(self):
+        self._retry = None
+        d = self.endpoint.connect(self.factory)
+        d.addCallback(self._gotProtocol)
+        d.addErrback(self._failed)
+
+    def _gotProtocol(self, mqtt):
+        if self._stopping:
+            mqtt.transport.loseConnection()
+            return
+        self._protocol = mqtt
+        d = mqtt.connect(self.client_id, keepalive = self.keepalive, cleanStart = False, version = v311)
+        d.addCallback(self._connectAcknowledged, mqtt)
+        return d
+
+    def _connectAcknowledged(self, session_present, mqtt):
+        self._protocol = None
+        if self._stopping:
+            # stopped while the connection was being made
+            mqtt.disconnect()
+            return
+        self.mqtt = mqtt
+        mqtt.onDisconnection = self._lost
+        self._attempt = 0
+        self.connects += 1
+        if self._lost_at is not None:
+            self.reconnects += 1
+            self.last_reconnect_time = self.clock.seconds() - self._lost_at
+            self.max_reconnect_time = max(self.max_reconnect_time or 0, self.last_reconnect_time)
+            self._lost_at = None
+        if self.tls is not None:
+            self.tls.remember(mqtt.transport.getHandle())
+        self.log.info('Connected to the MQTT broker as {client_id:}, session present: {session:}',
+                      client_id = self.client_id, session = session_present)
+        if self.connected is not None:
+            self.connected(mqtt, bool(session_present))
+
+    def _failed(self, failure):
+        self.failed_attempts += 1
+        if self._protocol is not None:
+            # the broker accepted the TCP connection but not the MQTT one
+            self._protocol.transport.abortConnection()
+            self._protocol = None
+        self._scheduleRetry('Connecting to the MQTT broker failed: {error:}', failure.getErrorMessage())
+
+    def _lost(self, reason):
+        self.mqtt = None
+        self._lost_at = self.clock.seconds()
+        if self.disconnected is not None:
+            self.disconnected(reason)
+        self._scheduleRetry('Lost the MQTT connection: {error:}', reason.getErrorMessage())
+
+    def _scheduleRetry(self, message, error):
+        if self._stopping:
+            return
+        delay = self.nextDelay()
+        self.log.warn(message + ', retrying in {delay:.1f}s', error = error, delay = delay)
+        self._retry = self.clock.callLater(delay, self._connect)
@@ -0,0 +1,133 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Publishes the radio's status values to MQTT, each on its own topic
+# and all together as one JSON message, but only when they have
+# changed by more than a deadband and not more often than a minimum
+# interval per topic.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from twisted.logger import Logger
+from twisted.internet import reactor
+
+class TelemetryPublisher(object):
+    log = Logger()
+
+    FIELDS = ('rssi', 'snr', 'frequency_offset', 'frequency', 'channel', 'mute_status', 'volume_status')
+    COMBINED = 'telemetry'
+
+    # the signal quality readings wander by a unit or so from one poll to
+    # the next without anything having changed
+    DEADBANDS = {'rssi': 2,
+                 'snr': 2,
+                 'frequency_offset': 2}
+
+    def __init__(self, serial, outbox, deadbands = None, intervals = None, clock = reactor):
+        self.deadbands = dict(self.DEADBANDS)
+        self.deadbands.update(deadbands or {})
+        self.intervals = intervals or {}
+        self.clock = clock
+        self.outbox = outbox
+
+        # built once rather than on every publish
+        self.prefix = 'weather_radio/{}/'.format(serial)
+        self.topics = {name: self.prefix + name for name in self.FIELDS + (self.COMBINED,)}
+
+        self.values = {}
+        # name: (message, value, time) of the last publish
+        self._sent = {}
+        self._pending = {}
+
+        self.published = 0
+        self.suppressed = 0
+
+    def resend(self):
+        # a new connection gets every value again
+        self._sent.clear()
+        self._cancelPending()
+        if self.values:
+            self.update({})
+
+    def update(self, values):
+        # values: {name: value}, with the value already in the form that
+        # is published on the field's own topic
+        self.values.update(values)
+
+        changed = False
+        for name in values or self.values:
+            value = self.values[name]
+            if self._publish(name, value, '{}'.format(value)):
+                changed = True
+        if changed or self.COMBINED not in self._sent:
+            self._publish(self.COMBINED, None, json.dumps(self.values, sort_keys = True))
+
+    def statistics(self):
+        return {'published': self.published,
+                'suppressed': self.suppressed}
+
+    def _publish(self, name, value, message):
+        now = self.clock.seconds()
+        sent = self._sent.get(name)
+        if sent is not None:
+            last_message, last_value, last_time = sent
+            if message == last_message or self._withinDeadband(name, value, last_value):
+                self.suppressed += 1
+                return False
+            wait = self.intervals.get(name, 0) - (now - last_time)
+            if wait > 0:
+                # too soon, the newest value goes out when the interval is up
+                self.suppressed += 1
+                if name not in self._pending:
+                    self._pending[name] = self.clock.callLater(wait, self._flush, name)
+                return False
+
+        pending = self._pending.pop(name, None)
+        if pending is not None and pending.active():
+            pending.cancel()
+        self._sent[name] = (message, value, now)
+        self.published += 1
+        self.outbox.publish(topic = self._topic(name), qos = 0, message = message)
+        return True
+
+    def _flush(self, name):
+        del self._pending[name]
+        if name == self.COMBINED:
+            self._publish(name, None, json.dumps(self.values, sort_keys = True))
+        elif name in self.values:
+            self.update({})
+
+    def _withinDeadband(self, name, value, last_value):
+        deadband = self.deadbands.get(name)
+        if deadband is None or value is None or last_value is None:
+            return False
+        try:
+            return abs(value - last_value) < deadband
+        except TypeError:
+            return False
+
+    def _topic(self, name):
+        topic = self.topics.get(name)
+        if topic is None:
+            topic = self.topics[name] = self.prefix + name
+        return topic
+
+    def _cancelPending(self):
+        for call in self._pending.values():
+            if call.active():
+                call.cancel()
+        self._pending.clear()
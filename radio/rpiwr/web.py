@@ -0,0 +1,74 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# The daemon's web server: /metrics in the Prometheus text format and,
+# for receivers that keep a signal history, /history as JSON. Only
+# imported when the web server is configured.
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .metrics import PrometheusText
+from .history import HistoryQueryError
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, render):
+        # render is called for each request and returns a PrometheusText
+        Resource.__init__(self)
+        self._render = render
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', PrometheusText.CONTENT_TYPE)
+        return self._render().text().encode('utf-8')
+
+class HistoryResource(Resource):
+    # GET /history?field=rssi&start=-86400&resolution=minute, with
+    # receiver=<serial> to pick the receiver when there is more than one
+    isLeaf = True
+
+    def __init__(self, histories):
+        # histories: {receiver serial: SignalHistory}
+        Resource.__init__(self)
+        self.histories = histories
+
+    def render_GET(self, request):
+        query = {key.decode('utf-8'): values[0].decode('utf-8') for key, values in request.args.items()}
+        request.setHeader(b'content-type', b'application/json')
+        try:
+            result = self._history(query.pop('receiver', None)).request(query)
+        except HistoryQueryError as e:
+            request.setResponseCode(400)
+            result = {'error': str(e)}
+        return json.dumps(result).encode('utf-8')
+
+    def _history(self, receiver):
+        if receiver is None and len(self.histories) == 1:
+            return next(iter(self.histories.values()))
+        if receiver not in self.histories:
+            raise HistoryQueryError('unknown receiver: {}'.format(receiver))
+        return self.histories[receiver]
+
+def site(render, histories):
+    root = Resource()
+    root.putChild(b'metrics', MetricsResource(render))
+    if histories:
+        root.putChild(b'history', HistoryResource(histories))
+    return Site(root)
@@ -0,0 +1,34 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright 2016 by Jeffrey C. Ollie
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from setuptools import setup
+
+setup(name = 'rpiwr',
+      version = '0.1',
+      description = 'Raspberry Pi Weather Radio',
+      author = 'Jeffrey C. Ollie',
+      url = 'https://github.com/jcollie/rpiwr',
+      license = 'GPLv3+',
+      packages = ['rpiwr'],
+      install_requires = ['Twisted >= 16.2.0',
+                          'twisted-mqtt >= 0.1.6'],
+      extras_require = {'pi': ['RPi.GPIO >= 0.6.2',
+                               'smbus-cffi >= 0.5.1'],
+                        'tls': ['pyOpenSSL >= 16.0.0',
+                                'service-identity >= 16.0.0',
+                                'idna >= 2.1']},
+      entry_points = {'console_scripts': ['rpiwr = rpiwr.cli:main']})